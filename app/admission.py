@@ -0,0 +1,256 @@
+import os
+import math
+import time
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+
+from app import tracing
+from app.deadline import Deadline
+
+# Batas konkurensi pipeline (STT -> LLM -> TTS) yang berjalan bersamaan
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "2"))
+
+# Jumlah maksimum permintaan yang boleh menunggu di antrean
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "8"))
+
+# Tenggat waktu total (antre + proses) per permintaan, sedikit di bawah
+# REQUEST_TIMEOUT milik frontend Gradio (60 detik)
+ADMISSION_DEADLINE_S = float(os.getenv("ADMISSION_DEADLINE_S", "55"))
+
+# Perkiraan awal durasi satu pipeline sebelum ada pengukuran nyata
+ADMISSION_INITIAL_SERVICE_S = float(os.getenv("ADMISSION_INITIAL_SERVICE_S", "10"))
+
+# Rate limit per klien (token bucket): laju isi ulang dan kapasitas burst
+RATE_LIMIT_PER_MIN = float(os.getenv("RATE_LIMIT_PER_MIN", "20"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "5"))
+
+# Bobot EWMA untuk memperbarui perkiraan durasi layanan
+_EWMA_ALPHA = 0.2
+
+# Bucket klien yang tidak aktif selama ini akan dibuang
+_BUCKET_IDLE_S = 600
+
+
+class AdmissionRejected(Exception):
+    """Permintaan ditolak sebelum diproses (antrean penuh, tenggat terlampaui, atau rate limit)."""
+
+    def __init__(self, status_code: int, retry_after: float, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+        self.reason = reason
+
+
+class TokenBucket:
+    def __init__(self, rate_per_s: float, burst: int):
+        self.rate_per_s = rate_per_s
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> float:
+        """
+        Ambil satu token dari bucket.
+        Returns:
+            float: 0 jika token tersedia, selain itu lama menunggu (detik) sampai token berikutnya
+        """
+        # `now` bisa sedikit lebih awal dari waktu bucket dibuat; jangan sampai token berkurang
+        elapsed = max(0.0, now - self.updated)
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate_per_s)
+        self.updated = max(self.updated, now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        if self.rate_per_s <= 0:
+            return float(_BUCKET_IDLE_S)
+        return (1 - self.tokens) / self.rate_per_s
+
+
+class RateLimiter:
+    def __init__(self, per_minute: float, burst: int):
+        self.rate_per_s = per_minute / 60.0
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def check(self, client_id: str) -> float:
+        """Kembalikan 0 jika klien boleh lanjut, selain itu nilai Retry-After dalam detik."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client_id)
+            if bucket is None:
+                bucket = self._buckets[client_id] = TokenBucket(self.rate_per_s, self.burst)
+            wait = bucket.take(now)
+            if len(self._buckets) > 1024:
+                self._prune(now)
+            return wait
+
+    def _prune(self, now: float):
+        idle = [cid for cid, b in self._buckets.items() if now - b.updated > _BUCKET_IDLE_S]
+        for cid in idle:
+            del self._buckets[cid]
+
+
+class AdmissionController:
+    """
+    Antrean admisi terbatas untuk pipeline voice chat.
+
+    Permintaan ditolak lebih awal (503 + Retry-After) jika antrean penuh atau perkiraan
+    waktu tunggu melewati tenggat, dan 429 jika klien melampaui rate limit, sehingga
+    server tidak membuang komputasi untuk respons yang tidak akan dibaca.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, deadline_s: float,
+                 rate_limiter: RateLimiter = None):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.deadline_s = deadline_s
+        self.rate_limiter = rate_limiter
+        self.service_time_s = ADMISSION_INITIAL_SERVICE_S
+        self._semaphore = None
+        self._running = 0
+        self._waiting = 0
+        self._stats = {
+            "admitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "goodput": 0,
+            "rejected_rate_limited": 0,
+            "rejected_queue_full": 0,
+            "rejected_deadline": 0,
+            "queue_timeouts": 0,
+        }
+
+    def predicted_wait(self) -> float:
+        """Perkiraan lama antre (detik) untuk permintaan yang datang sekarang."""
+        ahead = self._running + self._waiting - self.max_concurrency + 1
+        if ahead <= 0:
+            return 0.0
+        return math.ceil(ahead / self.max_concurrency) * self.service_time_s
+
+    def queue_depth(self) -> int:
+        """Jumlah permintaan yang sedang menunggu slot pipeline."""
+        return self._waiting
+
+    def check_rate_limit(self, client_id: str):
+        """Lempar AdmissionRejected (429) jika klien melampaui rate limit."""
+        if self.rate_limiter is None:
+            return
+        retry_after = self.rate_limiter.check(client_id)
+        if retry_after > 0:
+            self._stats["rejected_rate_limited"] += 1
+            raise AdmissionRejected(429, retry_after, "Terlalu banyak permintaan dari klien ini")
+
+    def check_capacity(self):
+        """Lempar AdmissionRejected (503) jika antrean penuh atau perkiraan tunggu melewati tenggat."""
+        if self._running + self._waiting >= self.max_concurrency + self.max_queue:
+            self._stats["rejected_queue_full"] += 1
+            raise AdmissionRejected(503, self.predicted_wait() or self.service_time_s,
+                                    "Antrean server penuh")
+
+        wait = self.predicted_wait()
+        if wait + self.service_time_s > self.deadline_s:
+            self._stats["rejected_deadline"] += 1
+            raise AdmissionRejected(503, wait, "Perkiraan waktu tunggu melebihi tenggat")
+
+    def screen(self, client_id: str):
+        """
+        Pemeriksaan murah sebelum body permintaan dibaca: rate limit dan kapasitas antrean.
+        Setelah itu panggil admit(client_id, rate_checked=True) agar token rate limit tidak
+        diambil dua kali.
+        """
+        self.check_rate_limit(client_id)
+        self.check_capacity()
+
+    @asynccontextmanager
+    async def admit(self, client_id: str, deadline: Deadline = None, rate_checked: bool = False):
+        """
+        Ambil slot pipeline, menunggu di antrean bila perlu.
+        Args:
+            client_id (str): Identitas klien untuk rate limit
+            deadline (Deadline): Tenggat permintaan (X-Request-Timeout, dikurangi waktu upload);
+                tanpa deadline dipakai ADMISSION_DEADLINE_S sejak admit dipanggil
+            rate_checked (bool): True jika screen() sudah mengambil token rate limit
+        """
+        if not rate_checked:
+            self.check_rate_limit(client_id)
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        # Dicek ulang karena beban bisa berubah selama upload dibaca
+        self.check_capacity()
+
+        # Jangan menunggu lebih lama dari sisa tenggat dikurangi perkiraan durasi proses
+        remaining = deadline.remaining() if deadline is not None else None
+        budget = (self.deadline_s if remaining is None else remaining) - self.service_time_s
+        if budget <= 0:
+            self._stats["rejected_deadline"] += 1
+            raise AdmissionRejected(503, self.service_time_s, "Sisa tenggat tidak cukup untuk memproses permintaan")
+
+        arrived = time.monotonic()
+        self._waiting += 1
+        try:
+            with tracing.span("admission.queue", **{"admission.waiting": self._waiting,
+                                                    "admission.running": self._running}):
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=budget)
+        except asyncio.TimeoutError:
+            self._stats["queue_timeouts"] += 1
+            raise AdmissionRejected(503, self.predicted_wait() or self.service_time_s,
+                                    "Waktu tunggu antrean habis")
+        finally:
+            self._waiting -= 1
+
+        self._running += 1
+        self._stats["admitted"] += 1
+        started = time.monotonic()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            finished = time.monotonic()
+            self._running -= 1
+            self._semaphore.release()
+            self._observe(finished - started)
+            if ok:
+                self._stats["completed"] += 1
+                if finished - arrived <= self.deadline_s:
+                    self._stats["goodput"] += 1
+            else:
+                self._stats["failed"] += 1
+
+    def _observe(self, service_s: float):
+        self.service_time_s = (1 - _EWMA_ALPHA) * self.service_time_s + _EWMA_ALPHA * service_s
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "running": self._running,
+            "waiting": self._waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "deadline_s": self.deadline_s,
+            "service_time_s": round(self.service_time_s, 3),
+            "predicted_wait_s": round(self.predicted_wait(), 3),
+        }
+
+
+def client_id_from_request(request) -> str:
+    """Identitas klien untuk rate limit: header X-Client-ID bila ada, selain itu alamat IP."""
+    client_id = request.headers.get("x-client-id")
+    if client_id:
+        return client_id
+    if request.client is not None:
+        return request.client.host
+    return "anonymous"
+
+
+# Instance bersama yang dipakai oleh endpoint
+admission = AdmissionController(
+    ADMISSION_MAX_CONCURRENCY,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_DEADLINE_S,
+    rate_limiter=RateLimiter(RATE_LIMIT_PER_MIN, RATE_LIMIT_BURST),
+)
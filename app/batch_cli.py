@@ -0,0 +1,243 @@
+"""
+CLI batch offline untuk transkripsi (STT) dan sintesis (TTS) dalam jumlah besar.
+
+Contoh:
+    python -m app.batch_cli stt rekaman/ -o transkripsi.jsonl
+    python -m app.batch_cli stt manifest.jsonl -o transkripsi.jsonl --workers 4
+    python -m app.batch_cli tts prompt.txt -o sintesis.jsonl --out-dir audio/
+
+Hasil ditulis per item ke file JSONL begitu selesai. Jika dijalankan ulang dengan file
+output yang sama, item yang sudah berhasil dilewati sehingga pekerjaan bisa dilanjutkan.
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from app.stt import STT_PROFILES, transcribe_speech_to_text
+from app.tts import transcribe_text_to_speech
+from app.scratch import scratch
+from app.scheduler import scheduler
+from app.speakers import speaker_table
+
+AUDIO_EXTENSIONS = {".wav", ".mp3", ".flac", ".ogg", ".m4a"}
+
+_CPU_COUNT = os.cpu_count() or 2
+
+# Jumlah thread yang dipakai satu job engine (whisper: opsi -t), untuk menghitung jumlah worker default
+STT_THREADS_PER_JOB = 4
+TTS_THREADS_PER_JOB = 1
+
+
+# === Input ===
+
+def _load_manifest(path: str) -> list:
+    """Baca manifest .jsonl (objek per baris) atau .txt (satu nilai per baris)."""
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                entries.append(json.loads(line))
+            else:
+                entries.append({"id": f"line-{line_no}", "value": line})
+    return entries
+
+
+def collect_stt_items(source: str) -> list:
+    """Kumpulkan item STT (id, path) dari direktori atau manifest."""
+    if os.path.isdir(source):
+        items = []
+        for root, _, files in os.walk(source):
+            for name in files:
+                if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS:
+                    path = os.path.join(root, name)
+                    items.append((os.path.relpath(path, source), path))
+        return sorted(items)
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    items = []
+    for entry in _load_manifest(source):
+        path = entry.get("path", entry.get("value"))
+        if not os.path.isabs(path):
+            path = os.path.join(base_dir, path)
+        items.append((str(entry.get("id", path)), path))
+    return items
+
+
+def collect_tts_items(source: str, default_speaker: str = None) -> list:
+    """Kumpulkan item TTS (id, teks, speaker) dari manifest; field "speaker" per baris bersifat opsional."""
+    return [(str(entry["id"]), entry.get("text", entry.get("value")), entry.get("speaker", default_speaker))
+            for entry in _load_manifest(source)]
+
+
+def load_done_ids(output_path: str, retry_errors: bool = True) -> set:
+    """Id item yang sudah tercatat di output (dan berhasil, jika retry_errors)."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Baris terakhir bisa terpotong jika proses sebelumnya dihentikan paksa
+                continue
+            if retry_errors and "error" in record:
+                continue
+            done.add(record["id"])
+    return done
+
+
+# === Job (dijalankan di proses worker) ===
+
+def _init_worker(threads: int):
+    # Batasi thread BLAS/OpenMP per worker agar core tidak oversubscribed
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    # Pembagian core sudah diatur per proses di sini, bukan oleh scheduler server
+    scheduler.enabled = False
+
+
+def _stt_job(item_id: str, path: str, profile_name: str, threads: int) -> dict:
+    started = time.monotonic()
+    with open(path, "rb") as f:
+        audio_content = f.read()
+    # Batch offline tidak terpengaruh beban server, jadi profil ditentukan dari argumen CLI
+    profile = STT_PROFILES[profile_name].with_threads(threads)
+    transcription = transcribe_speech_to_text(audio_content, os.path.splitext(path)[1] or ".wav", profile=profile)
+    record = {"id": item_id, "path": path, "seconds": round(time.monotonic() - started, 3)}
+    if transcription.startswith("[ERROR]"):
+        record["error"] = transcription
+    else:
+        record["text"] = transcription.strip()
+    return record
+
+
+def _safe_name(item_id: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", item_id)
+
+
+def _tts_job(item_id: str, text: str, speaker: str, out_dir: str) -> dict:
+    started = time.monotonic()
+    # Paralelisme sudah di level proses, jadi potongan kalimat disintesis berurutan
+    audio_path = transcribe_text_to_speech(text, parallel=False, speaker=speaker)
+    record = {"id": item_id, "text": text, "speaker": speaker, "seconds": round(time.monotonic() - started, 3)}
+    if audio_path.startswith("[ERROR]"):
+        record["error"] = audio_path
+    else:
+        out_path = os.path.join(out_dir, f"{_safe_name(item_id)}.wav")
+        shutil.move(audio_path, out_path)
+        scratch.detach(audio_path)
+        record["audio_path"] = out_path
+    return record
+
+
+# === Runner ===
+
+def _format_eta(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def _terminate_partial_line(output_path: str):
+    # Pastikan record baru tidak tersambung ke baris terpotong dari run sebelumnya
+    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+        return
+    with open(output_path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+
+def run_batch(job, items: list, output_path: str, workers: int, threads: int) -> dict:
+    """
+    Jalankan job untuk setiap item di process pool dan tulis hasil ke JSONL secara bertahap.
+    Returns:
+        dict: Ringkasan (jumlah selesai, gagal, durasi, throughput)
+    """
+    total = len(items)
+    completed = 0
+    failed = 0
+    started = time.monotonic()
+    _terminate_partial_line(output_path)
+
+    with open(output_path, "a", encoding="utf-8") as out, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(threads,)) as pool:
+        futures = {pool.submit(job, *item): item[0] for item in items}
+        try:
+            for future in as_completed(futures):
+                try:
+                    record = future.result()
+                except Exception as e:
+                    record = {"id": futures[future], "error": f"[ERROR] {str(e)}"}
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+
+                completed += 1
+                if "error" in record:
+                    failed += 1
+                elapsed = time.monotonic() - started
+                rate = completed / elapsed if elapsed > 0 else 0.0
+                eta = (total - completed) / rate if rate > 0 else 0.0
+                print(f"[{completed}/{total}] {rate:.2f} item/s, gagal {failed}, ETA {_format_eta(eta)}",
+                      file=sys.stderr)
+        except KeyboardInterrupt:
+            print("Dihentikan; jalankan ulang perintah yang sama untuk melanjutkan.", file=sys.stderr)
+            pool.shutdown(wait=True, cancel_futures=True)
+            raise
+
+    elapsed = time.monotonic() - started
+    return {
+        "completed": completed,
+        "failed": failed,
+        "seconds": round(elapsed, 3),
+        "items_per_s": round(completed / elapsed, 3) if elapsed > 0 else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch STT/TTS offline dengan output JSONL yang bisa dilanjutkan")
+    parser.add_argument("mode", choices=["stt", "tts"])
+    parser.add_argument("source", help="Direktori audio atau manifest (.jsonl/.txt)")
+    parser.add_argument("-o", "--output", required=True, help="File output JSONL")
+    parser.add_argument("--out-dir", default="tts_output", help="Direktori file WAV hasil TTS")
+    parser.add_argument("--workers", type=int, default=None, help="Jumlah proses worker (default: sesuai jumlah core)")
+    parser.add_argument("--speaker", default=None, help="Speaker TTS default untuk item tanpa field speaker")
+    parser.add_argument("--stt-profile", choices=sorted(STT_PROFILES), default="accurate",
+                        help="Profil decoding whisper untuk mode stt")
+    parser.add_argument("--no-retry-errors", action="store_true", help="Jangan ulangi item yang sebelumnya gagal")
+    args = parser.parse_args(argv)
+
+    if args.mode == "stt":
+        threads = STT_THREADS_PER_JOB
+        items = [(item_id, path, args.stt_profile, threads) for item_id, path in collect_stt_items(args.source)]
+        job = _stt_job
+    else:
+        items = collect_tts_items(args.source, args.speaker)
+        # Nama speaker divalidasi sekali di proses utama sebelum worker dijalankan
+        items = [(item_id, text, speaker_table.resolve(speaker)) for item_id, text, speaker in items]
+        os.makedirs(args.out_dir, exist_ok=True)
+        items = [(*item, os.path.abspath(args.out_dir)) for item in items]
+        threads = TTS_THREADS_PER_JOB
+        job = _tts_job
+
+    workers = args.workers or max(1, _CPU_COUNT // threads)
+    done = load_done_ids(args.output, retry_errors=not args.no_retry_errors)
+    pending = [item for item in items if item[0] not in done]
+    print(f"{len(items)} item, {len(items) - len(pending)} sudah selesai, {len(pending)} diproses "
+          f"dengan {workers} worker", file=sys.stderr)
+
+    summary = run_batch(job, pending, args.output, workers, threads)
+    print(json.dumps(summary), file=sys.stderr)
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
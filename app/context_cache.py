@@ -0,0 +1,367 @@
+import os
+import time
+import asyncio
+import hashlib
+import threading
+
+from google.genai import types
+from pydantic import TypeAdapter
+
+# Explicit context caching Gemini untuk system instruction (dan prefix riwayat chat)
+GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "1") == "1"
+
+# Ikut cache-kan giliran chat lama; giliran terbaru tetap dikirim biasa
+GEMINI_CACHE_HISTORY = os.getenv("GEMINI_CACHE_HISTORY", "1") == "1"
+
+# Umur cache di server; TTL diperpanjang otomatis setelah separuhnya terpakai
+GEMINI_CACHE_TTL_S = int(os.getenv("GEMINI_CACHE_TTL_S", "600"))
+
+# Gemini menolak cache yang lebih kecil dari batas minimum token model; kosong = sesuai model
+# (lihat _MODEL_MIN_CACHE_TOKENS)
+GEMINI_CACHE_MIN_TOKENS = os.getenv("GEMINI_CACHE_MIN_TOKENS", "")
+
+# Prefix riwayat dipotong per kelipatan ini (jumlah Content, genap agar berakhir di giliran model)
+# supaya cache tidak dibuat ulang di setiap giliran
+GEMINI_CACHE_HISTORY_STEP = max(2, int(os.getenv("GEMINI_CACHE_HISTORY_STEP", "8")) // 2 * 2)
+
+# Lama menunggu sebelum mencoba membuat cache lagi setelah gagal
+GEMINI_CACHE_RETRY_S = float(os.getenv("GEMINI_CACHE_RETRY_S", "300"))
+
+# Cache dianggap kedaluwarsa sedikit lebih awal agar tidak habis di tengah panggilan
+_EXPIRY_MARGIN_S = min(10.0, GEMINI_CACHE_TTL_S * 0.1)
+
+# Batas minimum token explicit caching per keluarga model; model lain memakai batas terbesar
+_MODEL_MIN_CACHE_TOKENS = (("flash", 1024), ("pro", 4096))
+_DEFAULT_MIN_CACHE_TOKENS = 4096
+
+# Jumlah hasil count_tokens (per kunci prefix) yang disimpan agar tidak dihitung ulang tiap giliran
+_TOKEN_COUNT_MEMO = 8
+
+_contents_adapter = TypeAdapter(list[types.Content])
+
+
+def min_cache_tokens(model: str) -> int:
+    """Batas minimum token cache untuk model (GEMINI_CACHE_MIN_TOKENS jika di-set)."""
+    if GEMINI_CACHE_MIN_TOKENS:
+        return int(GEMINI_CACHE_MIN_TOKENS)
+    for family, tokens in _MODEL_MIN_CACHE_TOKENS:
+        if family in model:
+            return tokens
+    return _DEFAULT_MIN_CACHE_TOKENS
+
+
+def _estimate_tokens(text: str) -> int:
+    # Perkiraan kasar (~4 karakter per token), hanya dipakai jika count_tokens gagal
+    return len(text) // 4
+
+
+class CachePlan:
+    """Hasil prepare(): config untuk generate_content dan bagian riwayat yang masih dikirim biasa."""
+
+    def __init__(self, config: types.GenerateContentConfig, history_tail: list, cache_name: str = None):
+        self.config = config
+        self.history_tail = history_tail
+        self.cache_name = cache_name
+
+    @property
+    def cached(self) -> bool:
+        return self.cache_name is not None
+
+
+class ContextCache:
+    """
+    Mengelola satu CachedContent Gemini berisi system instruction dan (opsional) prefix riwayat
+    chat. Jika cache tidak tersedia (terlalu kecil, model tidak mendukung, error API), permintaan
+    dikirim tanpa cache seperti biasa.
+    """
+
+    def __init__(self, client, model: str, system_instruction: str, base_config: types.GenerateContentConfig):
+        self.client = client
+        self.model = model
+        self.system_instruction = system_instruction
+        self.base_config = base_config
+        self.enabled = GEMINI_CONTEXT_CACHE
+        self.min_tokens = min_cache_tokens(model)
+        self._lock = threading.Lock()
+        self._name = None
+        self._key = None
+        self._prefix_len = 0
+        self._expires_at = 0.0
+        self._refreshed_at = 0.0
+        self._disabled_until = 0.0
+        self._refresh_task = None
+        # Referensi task penghapusan cache lama, agar tidak dibuang garbage collector di tengah jalan
+        self._delete_tasks = set()
+        # Kunci prefix -> jumlah token system instruction + prefix (hasil count_tokens)
+        self._token_counts = {}
+        self._stats = {
+            "created": 0,
+            "refreshed": 0,
+            "create_failures": 0,
+            "fallbacks": 0,
+            "skipped_small": 0,
+            "last_error": None,
+        }
+        self._calls = {
+            mode: {"requests": 0, "latency_s": 0.0, "prompt_tokens": 0, "cached_tokens": 0}
+            for mode in ("cached", "uncached")
+        }
+
+    # === Perencanaan ===
+
+    def _prefix_length(self, history: list) -> int:
+        if not GEMINI_CACHE_HISTORY:
+            return 0
+        return len(history) // GEMINI_CACHE_HISTORY_STEP * GEMINI_CACHE_HISTORY_STEP
+
+    def _key_for(self, prefix: list) -> str:
+        digest = hashlib.sha256(self.model.encode())
+        digest.update(self.system_instruction.encode())
+        digest.update(_contents_adapter.dump_json(prefix))
+        return digest.hexdigest()
+
+    def _uncached(self, history: list) -> CachePlan:
+        return CachePlan(self.base_config, history)
+
+    def _current(self, key: str, history: list):
+        # Dipanggil dengan self._lock terpegang
+        if self._name is not None and self._key == key and time.monotonic() < self._expires_at - _EXPIRY_MARGIN_S:
+            config = types.GenerateContentConfig(cached_content=self._name)
+            return CachePlan(config, history[self._prefix_len:], self._name)
+        return None
+
+    def _can_try(self) -> bool:
+        return self.enabled and time.monotonic() >= self._disabled_until
+
+    def _large_enough(self, tokens: int) -> bool:
+        # Dipanggil dengan self._lock terpegang
+        if tokens < self.min_tokens:
+            self._stats["skipped_small"] += 1
+            return False
+        return True
+
+    # === Hitung token ===
+
+    def _count_contents(self, prefix: list) -> list:
+        # System instruction dihitung sebagai satu Content agar cukup satu panggilan count_tokens
+        return [types.Content(role="user", parts=[types.Part.from_text(text=self.system_instruction)])] + prefix
+
+    def _known_tokens(self, key: str):
+        with self._lock:
+            return self._token_counts.get(key)
+
+    def _remember_tokens(self, key: str, tokens: int):
+        with self._lock:
+            self._token_counts[key] = tokens
+            while len(self._token_counts) > _TOKEN_COUNT_MEMO:
+                self._token_counts.pop(next(iter(self._token_counts)))
+
+    def _counted(self, response, prefix: list) -> int:
+        tokens = getattr(response, "total_tokens", None)
+        if tokens is None:
+            prefix_text = _contents_adapter.dump_json(prefix).decode("utf-8")
+            tokens = _estimate_tokens(self.system_instruction + prefix_text)
+        return tokens
+
+    def _count_tokens(self, key: str, prefix: list) -> int:
+        tokens = self._known_tokens(key)
+        if tokens is None:
+            try:
+                response = self.client.models.count_tokens(model=self.model, contents=self._count_contents(prefix))
+            except Exception as e:
+                print(f"[WARN] count_tokens gagal, memakai perkiraan panjang teks: {e}")
+                response = None
+            tokens = self._counted(response, prefix)
+            self._remember_tokens(key, tokens)
+        return tokens
+
+    async def _count_tokens_async(self, key: str, prefix: list) -> int:
+        tokens = self._known_tokens(key)
+        if tokens is None:
+            try:
+                response = await self.client.aio.models.count_tokens(
+                    model=self.model, contents=self._count_contents(prefix))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[WARN] count_tokens gagal, memakai perkiraan panjang teks: {e}")
+                response = None
+            tokens = self._counted(response, prefix)
+            self._remember_tokens(key, tokens)
+        return tokens
+
+    def _create_config(self, prefix: list) -> types.CreateCachedContentConfig:
+        return types.CreateCachedContentConfig(
+            system_instruction=self.system_instruction,
+            contents=prefix or None,
+            ttl=f"{GEMINI_CACHE_TTL_S}s",
+            display_name="voice-chatbot-context",
+        )
+
+    def _install(self, cache, key: str, prefix_len: int):
+        # Dipanggil dengan self._lock terpegang; mengembalikan nama cache lama untuk dihapus
+        old_name = self._name
+        now = time.monotonic()
+        self._name = cache.name
+        self._key = key
+        self._prefix_len = prefix_len
+        self._expires_at = now + GEMINI_CACHE_TTL_S
+        self._refreshed_at = now
+        self._stats["created"] += 1
+        return old_name if old_name != cache.name else None
+
+    def _create_failed(self, error: Exception):
+        self._stats["create_failures"] += 1
+        self._stats["last_error"] = str(error)[:300]
+        self._disabled_until = time.monotonic() + GEMINI_CACHE_RETRY_S
+        print(f"[WARN] Context cache Gemini tidak tersedia, lanjut tanpa cache: {error}")
+
+    def _refresh_due(self) -> bool:
+        return self._name is not None and time.monotonic() - self._refreshed_at >= GEMINI_CACHE_TTL_S / 2
+
+    def _refreshed(self):
+        now = time.monotonic()
+        self._refreshed_at = now
+        self._expires_at = now + GEMINI_CACHE_TTL_S
+        self._stats["refreshed"] += 1
+
+    # === Sync ===
+
+    def prepare(self, history: list) -> CachePlan:
+        prefix = history[:self._prefix_length(history)]
+        key = self._key_for(prefix)
+        # self._lock hanya melindungi state lokal; panggilan jaringan dilakukan di luar lock
+        # agar prepare_async di event loop tidak ikut tertahan
+        with self._lock:
+            plan = self._current(key, history)
+            refresh_name = self._name if plan is not None and self._refresh_due() else None
+            if plan is None and not self._can_try():
+                return self._uncached(history)
+        if plan is not None:
+            if refresh_name:
+                self._refresh_sync(refresh_name)
+            return plan
+        tokens = self._count_tokens(key, prefix)
+        with self._lock:
+            if not self._large_enough(tokens):
+                return self._uncached(history)
+        # Pemanggil sudah memegang lock chat, jadi pembuatan cache tidak berjalan ganda
+        try:
+            cache = self.client.caches.create(model=self.model, config=self._create_config(prefix))
+        except Exception as e:
+            with self._lock:
+                self._create_failed(e)
+            return self._uncached(history)
+        with self._lock:
+            old_name = self._install(cache, key, len(prefix))
+        self._delete_sync(old_name)
+        return CachePlan(types.GenerateContentConfig(cached_content=cache.name), history[len(prefix):], cache.name)
+
+    def _refresh_sync(self, name: str):
+        try:
+            self.client.caches.update(
+                name=name, config=types.UpdateCachedContentConfig(ttl=f"{GEMINI_CACHE_TTL_S}s"))
+            with self._lock:
+                if self._name == name:
+                    self._refreshed()
+        except Exception as e:
+            print(f"[WARN] Gagal memperpanjang TTL context cache: {e}")
+
+    def _delete_sync(self, name: str):
+        if not name:
+            return
+        try:
+            self.client.caches.delete(name=name)
+        except Exception as e:
+            print(f"[WARN] Gagal menghapus context cache lama {name}: {e}")
+
+    # === Async ===
+
+    async def prepare_async(self, history: list) -> CachePlan:
+        prefix = history[:self._prefix_length(history)]
+        key = self._key_for(prefix)
+        with self._lock:
+            plan = self._current(key, history)
+            if plan is not None:
+                if self._refresh_due() and (self._refresh_task is None or self._refresh_task.done()):
+                    # Perpanjangan TTL tidak perlu ditunggu oleh permintaan yang sedang berjalan
+                    self._refresh_task = asyncio.create_task(self._refresh_async(self._name))
+                return plan
+            if not self._can_try():
+                return self._uncached(history)
+        tokens = await self._count_tokens_async(key, prefix)
+        with self._lock:
+            if not self._large_enough(tokens):
+                return self._uncached(history)
+        # Pemanggil sudah memegang lock async chat, jadi pembuatan cache tidak berjalan ganda
+        try:
+            cache = await self.client.aio.caches.create(model=self.model, config=self._create_config(prefix))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            with self._lock:
+                self._create_failed(e)
+            return self._uncached(history)
+        with self._lock:
+            old_name = self._install(cache, key, len(prefix))
+        if old_name:
+            task = asyncio.create_task(self._delete_async(old_name))
+            self._delete_tasks.add(task)
+            task.add_done_callback(self._delete_tasks.discard)
+        return CachePlan(types.GenerateContentConfig(cached_content=cache.name), history[len(prefix):], cache.name)
+
+    async def _refresh_async(self, name: str):
+        try:
+            await self.client.aio.caches.update(
+                name=name, config=types.UpdateCachedContentConfig(ttl=f"{GEMINI_CACHE_TTL_S}s"))
+            with self._lock:
+                if self._name == name:
+                    self._refreshed()
+        except Exception as e:
+            print(f"[WARN] Gagal memperpanjang TTL context cache: {e}")
+
+    async def _delete_async(self, name: str):
+        try:
+            await self.client.aio.caches.delete(name=name)
+        except Exception as e:
+            print(f"[WARN] Gagal menghapus context cache lama {name}: {e}")
+
+    # === Fallback dan statistik ===
+
+    def invalidate(self, error: Exception):
+        """Lupakan cache saat ini (mis. sudah dihapus/kedaluwarsa di server) setelah panggilan gagal."""
+        with self._lock:
+            self._name = None
+            self._key = None
+            self._stats["fallbacks"] += 1
+            self._stats["last_error"] = str(error)[:300]
+        print(f"[WARN] Panggilan dengan context cache gagal, diulang tanpa cache: {error}")
+
+    def record(self, plan: CachePlan, response, latency_s: float):
+        usage = getattr(response, "usage_metadata", None)
+        calls = self._calls["cached" if plan.cached else "uncached"]
+        with self._lock:
+            calls["requests"] += 1
+            calls["latency_s"] += latency_s
+            if usage is not None:
+                calls["prompt_tokens"] += usage.prompt_token_count or 0
+                calls["cached_tokens"] += usage.cached_content_token_count or 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            result = {
+                **self._stats,
+                "enabled": self.enabled,
+                "min_tokens": self.min_tokens,
+                "context_tokens": next(reversed(self._token_counts.values()), None),
+                "cache_name": self._name,
+                "cached_prefix_contents": self._prefix_len if self._name else 0,
+                "ttl_remaining_s": round(max(0.0, self._expires_at - time.monotonic()), 1) if self._name else 0,
+            }
+            for mode, calls in self._calls.items():
+                result[mode] = {
+                    **calls,
+                    "latency_s": round(calls["latency_s"], 3),
+                    "avg_latency_ms": round(calls["latency_s"] / max(1, calls["requests"]) * 1000, 1),
+                }
+        return result
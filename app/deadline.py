@@ -0,0 +1,161 @@
+import os
+import time
+import asyncio
+import signal
+import threading
+import subprocess
+
+from app import tracing
+
+# Interval polling saat menunggu subprocess, sekaligus batas latensi pembatalan
+_POLL_INTERVAL_S = 0.1
+
+# Interval pengecekan apakah klien HTTP sudah memutus koneksi
+DISCONNECT_POLL_S = 0.5
+
+
+class RequestCancelled(Exception):
+    """Pekerjaan dihentikan karena klien terputus atau tenggat permintaan habis."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Deadline:
+    """
+    Tenggat dan token pembatalan per permintaan yang dibawa ke setiap tahap pipeline.
+    Aman dipakai dari thread mana pun.
+    """
+
+    def __init__(self, timeout_s: float = None):
+        self.expires_at = time.monotonic() + timeout_s if timeout_s is not None else None
+        self.reason = None
+        self._cancelled = threading.Event()
+
+    def remaining(self):
+        """Sisa waktu dalam detik, atau None jika tidak ada batas waktu."""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def cancel(self, reason: str = "cancelled"):
+        if not self._cancelled.is_set():
+            self.reason = reason
+            self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._cancelled.is_set() and self.expires_at is not None and time.monotonic() >= self.expires_at:
+            self.cancel("deadline exceeded")
+        return self._cancelled.is_set()
+
+    def check(self):
+        """Lempar RequestCancelled jika permintaan sudah dibatalkan atau kedaluwarsa."""
+        if self.cancelled:
+            raise RequestCancelled(self.reason)
+
+
+def _kill(proc: subprocess.Popen):
+    # Subprocess dijalankan di session baru sehingga seluruh grup proses (termasuk
+    # proses anak yang dibuat oleh CLI) ikut dihentikan
+    try:
+        if os.name == "posix":
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except ProcessLookupError:
+        pass
+
+
+def _pin(pid: int, cpus):
+    # Thread engine dibuat setelah model dimuat, sehingga ikut affinity proses utamanya
+    try:
+        os.sched_setaffinity(pid, cpus)
+    except (AttributeError, OSError):
+        pass
+
+
+def run_subprocess(cmd, deadline: Deadline = None, check: bool = False, cpus=None,
+                   **kwargs) -> subprocess.CompletedProcess:
+    """
+    Pengganti subprocess.run() yang bisa dibatalkan melalui Deadline.
+    Args:
+        cmd (list): Perintah yang dijalankan
+        deadline (Deadline): Tenggat/token pembatalan, opsional
+        check (bool): Lempar CalledProcessError jika return code bukan 0
+        cpus (set): Core tempat subprocess dijalankan (CPU affinity), opsional
+        **kwargs: Argumen lain untuk subprocess.Popen (capture_output, text, cwd, ...)
+    Returns:
+        subprocess.CompletedProcess: Hasil eksekusi
+    """
+    if kwargs.pop("capture_output", False):
+        kwargs["stdout"] = subprocess.PIPE
+        kwargs["stderr"] = subprocess.PIPE
+    if os.name == "posix":
+        kwargs.setdefault("start_new_session", True)
+    # Proses anak menerima TRACEPARENT agar engine yang mendukung OTel bisa melanjutkan trace
+    kwargs["env"] = tracing.child_env(kwargs.get("env"))
+
+    with tracing.span(f"subprocess {os.path.basename(str(cmd[0]))}",
+                      **{"process.command": str(cmd[0])}) as process_span, subprocess.Popen(cmd, **kwargs) as proc:
+        process_span.set_attribute("process.pid", proc.pid)
+        if cpus:
+            _pin(proc.pid, cpus)
+        while True:
+            try:
+                stdout, stderr = proc.communicate(timeout=_POLL_INTERVAL_S)
+                break
+            except subprocess.TimeoutExpired:
+                if deadline is not None and deadline.cancelled:
+                    _kill(proc)
+                    proc.communicate()
+                    raise RequestCancelled(deadline.reason)
+        process_span.set_attribute("process.exit_code", proc.returncode)
+
+    if check and proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+
+def deadline_from_request(request, default_timeout_s: float) -> Deadline:
+    """Buat tenggat permintaan; klien boleh meminta tenggat lebih pendek lewat header X-Request-Timeout (detik)."""
+    timeout = default_timeout_s
+    header = request.headers.get("x-request-timeout")
+    if header:
+        try:
+            timeout = min(timeout, float(header))
+        except ValueError:
+            pass
+    return Deadline(timeout)
+
+
+async def watch_disconnect(request, deadline: Deadline, task: asyncio.Task):
+    # Batalkan task begitu klien terputus atau tenggat habis
+    while not task.done():
+        if await request.is_disconnected():
+            deadline.cancel("client disconnected")
+        if deadline.cancelled:
+            task.cancel()
+            return
+        await asyncio.sleep(DISCONNECT_POLL_S)
+
+
+async def run_cancellable(request, deadline: Deadline, coro):
+    """
+    Jalankan coroutine sebagai task yang dibatalkan ketika klien terputus atau tenggat habis.
+    Subprocess engine dihentikan melalui Deadline, sedangkan await yang sedang berjalan
+    (misalnya panggilan LLM atau job yang masih antre di pool) dibatalkan melalui
+    pembatalan task asyncio.
+    """
+    task = asyncio.create_task(coro)
+    watcher = asyncio.create_task(watch_disconnect(request, deadline, task))
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if deadline.cancelled:
+            raise RequestCancelled(deadline.reason) from None
+        deadline.cancel("cancelled")
+        raise
+    finally:
+        watcher.cancel()
@@ -0,0 +1,312 @@
+"""
+Konverter grafem-ke-IPA (G2P) berbasis aturan untuk bahasa Indonesia.
+
+Dipakai untuk mengubah respons teks biasa dari LLM menjadi transkripsi IPA yang
+diharapkan model Coqui TTS, sehingga LLM tidak perlu menghasilkan IPA sendiri.
+Prosesnya deterministik: normalisasi teks (angka, mata uang, singkatan, akronim),
+lalu konversi per kata dengan leksikon pengecualian dan memoization.
+"""
+import re
+import unicodedata
+from functools import lru_cache
+
+# === Angka ===
+
+_SATUAN = ["nol", "satu", "dua", "tiga", "empat", "lima", "enam", "tujuh",
+           "delapan", "sembilan", "sepuluh", "sebelas"]
+
+_SKALA = [(10 ** 12, "triliun"), (10 ** 9, "miliar"), (10 ** 6, "juta")]
+
+# Angka yang lebih panjang dari ini (atau diawali nol, misalnya nomor telepon) dibaca per digit
+_MAX_NUMBER_DIGITS = 15
+
+
+def number_to_words(n: int) -> str:
+    """Ubah bilangan bulat menjadi kata dalam bahasa Indonesia (misalnya 1250 -> "seribu dua ratus lima puluh")."""
+    if n < 0:
+        return "minus " + number_to_words(-n)
+    if n < 12:
+        return _SATUAN[n]
+    if n < 20:
+        return _SATUAN[n - 10] + " belas"
+    if n < 100:
+        return _join(_SATUAN[n // 10] + " puluh", n % 10)
+    if n < 200:
+        return _join("seratus", n - 100)
+    if n < 1000:
+        return _join(_SATUAN[n // 100] + " ratus", n % 100)
+    if n < 2000:
+        return _join("seribu", n - 1000)
+    if n < 10 ** 6:
+        return _join(number_to_words(n // 1000) + " ribu", n % 1000)
+    for value, name in _SKALA:
+        if n >= value:
+            return _join(number_to_words(n // value) + " " + name, n % value)
+    return str(n)
+
+
+def _join(head: str, rest: int) -> str:
+    return head if rest == 0 else head + " " + number_to_words(rest)
+
+
+def _digits_to_words(digits: str) -> str:
+    return " ".join(_SATUAN[int(d)] for d in digits)
+
+
+def _read_number(token: str) -> str:
+    """
+    Baca angka berformat Indonesia: titik sebagai pemisah ribuan, koma sebagai desimal.
+    Titik yang tidak diikuti tepat tiga digit (mis. 3.5 gaya Inggris) dibaca sebagai desimal,
+    deretan bertitik lain (nomor versi 2.0.1) dibaca per bagian dengan "titik".
+    """
+    if "," not in token and "." in token and not _THOUSANDS_RE.fullmatch(token):
+        if token.count(".") > 1:
+            return " titik ".join(_read_number(part) for part in token.split("."))
+        integer, _, fraction = token.partition(".")
+    else:
+        integer, _, fraction = token.partition(",")
+        integer = integer.replace(".", "")
+    if len(integer) > _MAX_NUMBER_DIGITS or (len(integer) > 1 and integer.startswith("0")):
+        # Nomor telepon/kode (0812..., 007) dibaca per digit agar nol di depan tidak hilang
+        words = _digits_to_words(integer)
+    else:
+        words = number_to_words(int(integer))
+    if fraction:
+        words += " koma " + _digits_to_words(fraction)
+    return words
+
+
+# Ribuan bertitik (1.500.000), deretan bertitik (2.0.1), desimal gaya Inggris (3.5),
+# atau angka biasa dengan desimal koma
+_THOUSANDS = r"\d{1,3}(?:\.\d{3})+(?!\.?\d)"
+_NUMBER = _THOUSANDS + r"(?:,\d+)?|\d+(?:\.\d+)+(?!\.?\d)|\d+(?:,\d+)?"
+_THOUSANDS_RE = re.compile(_THOUSANDS)
+
+_CURRENCY_RE = re.compile(r"\bRp\.?\s?(" + _NUMBER + r")", re.IGNORECASE)
+_PERCENT_RE = re.compile(r"(" + _NUMBER + r")\s?%")
+_ORDINAL_RE = re.compile(r"\bke-?(\d+)\b", re.IGNORECASE)
+_TIME_RE = re.compile(r"\b(pukul|jam)\s+(\d{1,2})[.:](\d{2})\b", re.IGNORECASE)
+_NUMBER_RE = re.compile(_NUMBER)
+
+
+def _ordinal(match) -> str:
+    n = int(match.group(1))
+    return "pertama" if n == 1 else "ke" + number_to_words(n)
+
+
+def _time(match) -> str:
+    minutes = int(match.group(3))
+    words = f"{match.group(1)} {number_to_words(int(match.group(2)))}"
+    return words if minutes == 0 else f"{words} lewat {number_to_words(minutes)} menit"
+
+
+# === Singkatan dan akronim ===
+
+ABBREVIATIONS = {
+    "dll": "dan lain-lain",
+    "dsb": "dan sebagainya",
+    "dst": "dan seterusnya",
+    "yg": "yang",
+    "dgn": "dengan",
+    "tdk": "tidak",
+    "utk": "untuk",
+    "krn": "karena",
+    "sdh": "sudah",
+    "blm": "belum",
+    "tsb": "tersebut",
+    "sbg": "sebagai",
+    "spt": "seperti",
+    "ttg": "tentang",
+    "pd": "pada",
+    "dlm": "dalam",
+    "thn": "tahun",
+    "bln": "bulan",
+    "jl": "jalan",
+    "kab": "kabupaten",
+    "kec": "kecamatan",
+    "dr": "dokter",
+    "prof": "profesor",
+    "km": "kilometer",
+    "kg": "kilogram",
+    "cm": "sentimeter",
+    "mm": "milimeter",
+    "wib": "waktu indonesia barat",
+    "wita": "waktu indonesia tengah",
+    "wit": "waktu indonesia timur",
+    "ok": "oke",
+}
+
+# Singkatan gelar/alamat yang titiknya bukan akhir kalimat ("Dr. Budi", "Jl. Sudirman")
+_TITLE_ABBREVIATIONS = {"dr", "prof", "jl", "kab", "kec"}
+
+_ABBREVIATION_RE = re.compile(
+    r"\b(" + "|".join(sorted(ABBREVIATIONS, key=len, reverse=True)) + r")\b(\.)?", re.IGNORECASE
+)
+
+
+def _abbreviation(match) -> str:
+    abbreviation = match.group(1).lower()
+    # Titik setelah singkatan lain dipertahankan karena bisa juga menandai akhir kalimat
+    dot = match.group(2) if match.group(2) and abbreviation not in _TITLE_ABBREVIATIONS else ""
+    return ABBREVIATIONS[abbreviation] + dot
+
+
+# Akronim yang dibaca sebagai kata, bukan dieja per huruf
+ACRONYM_WORDS = {"ASEAN", "NATO", "COVID", "UNESCO", "UNICEF", "BUMN", "PEMILU", "ABRI"}
+
+_LETTER_NAMES = {
+    "a": "a", "b": "be", "c": "ce", "d": "de", "e": "e", "f": "ef", "g": "ge",
+    "h": "ha", "i": "i", "j": "je", "k": "ka", "l": "el", "m": "em", "n": "en",
+    "o": "o", "p": "pe", "q": "ki", "r": "er", "s": "es", "t": "te", "u": "u",
+    "v": "fe", "w": "we", "x": "eks", "y": "ye", "z": "zet",
+}
+
+_ACRONYM_RE = re.compile(r"\b[A-Z]{2,6}\b")
+
+
+def _acronym(match) -> str:
+    word = match.group(0)
+    if word in ACRONYM_WORDS:
+        return word
+    return " ".join(_LETTER_NAMES[c] for c in word.lower())
+
+
+_SYMBOLS = {
+    "°C": " derajat celsius",
+    "°": " derajat",
+    "&": " dan ",
+    "+": " tambah ",
+    "=": " sama dengan ",
+    "/": " per ",
+}
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalisasi teks sebelum G2P: angka, mata uang, persen, waktu, singkatan,
+    akronim, dan simbol dijabarkan menjadi kata; hasilnya huruf kecil dengan
+    tanda baca . , ? ! saja.
+    """
+    text = unicodedata.normalize("NFKC", text)
+    text = _CURRENCY_RE.sub(lambda m: _read_number(m.group(1)) + " rupiah", text)
+    text = _TIME_RE.sub(_time, text)
+    text = _ORDINAL_RE.sub(_ordinal, text)
+    text = _PERCENT_RE.sub(lambda m: _read_number(m.group(1)) + " persen", text)
+    text = _NUMBER_RE.sub(lambda m: _read_number(m.group(0)), text)
+    text = _ABBREVIATION_RE.sub(_abbreviation, text)
+    text = _ACRONYM_RE.sub(_acronym, text)
+    for symbol, words in _SYMBOLS.items():
+        text = text.replace(symbol, words)
+
+    # Buang diakritik (é -> e), lalu sisakan huruf dan tanda baca yang didukung
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[;:]", ",", text)
+    text = re.sub(r"[^a-z.,?!\s]", " ", text)
+    text = re.sub(r"\s+([.,?!])", r"\1", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+# === Grafem ke fonem ===
+
+# Pengecualian yang tidak bisa ditebak aturan (terutama e pepet/taling dan o)
+LEXICON = {
+    "indonesia": "indɔnɛsia",
+    "terletak": "tərlɛtak",
+    "letak": "lɛtak",
+    "enak": "ɛnak",
+    "ekor": "ɛkɔr",
+    "meja": "mɛd͡ʒa",
+    "desa": "dɛsa",
+    "bebek": "bɛbɛk",
+    "nenek": "nɛnɛk",
+    "merdeka": "mərdɛka",
+    "mereka": "mərɛka",
+    "kereta": "kərɛta",
+    "sepeda": "səpɛda",
+    "pendek": "pɛndɛk",
+    "dewasa": "dɛwasa",
+    "heran": "hɛran",
+    "lebar": "lɛbar",
+    "ember": "ɛmbər",
+    "telepon": "tɛlɛpɔn",
+    "teknologi": "tɛknɔlɔɡi",
+    "ekonomi": "ɛkɔnɔmi",
+    "elektronik": "ɛlɛktrɔnik",
+    "energi": "ɛnərɡi",
+    "tempe": "tɛmpe",
+    "email": "imɛl",
+    "google": "ɡuɡəl",
+}
+
+# Nama huruf hasil pengejaan akronim (DPR -> de pe er) diucapkan dengan e taling
+LEXICON.update({
+    name: name.replace("e", "ɛ").replace("c", "t͡ʃ").replace("j", "d͡ʒ").replace("g", "ɡ").replace("y", "ʝ")
+    for name in _LETTER_NAMES.values() if "e" in name
+})
+
+_DIGRAPHS = {"ng": "ŋ", "ny": "ɲ", "sy": "ʃ", "kh": "x"}
+
+_CONSONANTS = {
+    "c": "t͡ʃ",
+    "j": "d͡ʒ",
+    "y": "ʝ",
+    "g": "ɡ",
+    "q": "k",
+    "v": "f",
+    "x": "ks",
+}
+
+_VOWELS = set("aiueo")
+
+
+@lru_cache(maxsize=16384)
+def word_to_ipa(word: str) -> str:
+    """Konversi satu kata (huruf kecil, tanpa tanda baca) menjadi IPA."""
+    if word in LEXICON:
+        return LEXICON[word]
+
+    phones = []
+    i = 0
+    while i < len(word):
+        pair = word[i:i + 2]
+        if pair in _DIGRAPHS:
+            phones.append(_DIGRAPHS[pair])
+            i += 2
+            continue
+        char = word[i]
+        if char in _VOWELS and phones and phones[-1] == char:
+            # Vokal kembar dipisah hentian glotal: saat -> saʔat
+            phones.append("ʔ")
+        phones.append(_CONSONANTS.get(char, char))
+        i += 1
+
+    # e: taling (ɛ) pada suku kata terakhir kata bersuku banyak, selain itu pepet (ə)
+    vowels = [k for k, phone in enumerate(phones) if phone in _VOWELS]
+    for k in vowels:
+        if phones[k] == "e":
+            phones[k] = "ɛ" if k == vowels[-1] and len(vowels) > 1 else "ə"
+        elif phones[k] == "o":
+            phones[k] = "ɔ"
+    return "".join(phones)
+
+
+_TOKEN_RE = re.compile(r"[a-z]+|[.,?!]")
+
+
+def text_to_ipa(text: str) -> str:
+    """
+    Konversi teks Indonesia biasa menjadi transkripsi IPA untuk TTS.
+    Args:
+        text (str): Teks respons (misalnya dari LLM)
+    Returns:
+        str: Transkripsi IPA, kata dipisah spasi dengan tanda baca menempel
+    """
+    parts = []
+    for token in _TOKEN_RE.findall(normalize_text(text)):
+        if token in ".,?!":
+            if parts:
+                parts[-1] += token
+        else:
+            parts.append(word_to_ipa(token))
+    return " ".join(parts)
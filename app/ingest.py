@@ -0,0 +1,333 @@
+import io
+import os
+import struct
+import asyncio
+import hashlib
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException, Request
+from starlette.requests import ClientDisconnect
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from app.deadline import Deadline, RequestCancelled
+from app.scratch import scratch
+from app import tracing
+
+# Ukuran maksimum file audio yang diupload
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+
+# Durasi audio maksimum (detik), dicek dari header WAV saat data masih mengalir
+MAX_AUDIO_SECONDS = float(os.getenv("MAX_AUDIO_SECONDS", "60"))
+
+# Upload disimpan di memori sampai ukuran ini, selebihnya di file temporer
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", str(1024 * 1024)))
+
+# Batas ukuran field form non-file (mis. nama speaker)
+_MAX_FIELD_BYTES = 1024
+
+
+class SpooledUpload:
+    """
+    File upload yang ditulis bertahap: di memori sampai `spool_bytes`, lalu dipindah ke file
+    di scratch store. Hash sha256 byte mentah dihitung sambil data masuk.
+    """
+
+    def __init__(self, filename: str, spool_bytes: int = UPLOAD_SPOOL_BYTES):
+        self.filename = filename or ""
+        self.file_ext = os.path.splitext(self.filename)[1] or ".wav"
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self.spool_bytes = spool_bytes
+        self._buffer = io.BytesIO()
+        self._file = None
+        self._path = None
+
+    @property
+    def in_memory(self) -> bool:
+        return self._path is None
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        self.sha256.update(data)
+        if self._file is None and self._buffer.tell() + len(data) > self.spool_bytes:
+            self._rollover()
+        (self._file or self._buffer).write(data)
+
+    def _rollover(self):
+        self._path = scratch.new_path(self.file_ext, prefix="upload_")
+        self._file = open(self._path, "wb")
+        self._file.write(self._buffer.getvalue())
+        self._buffer = io.BytesIO()
+
+    def finish(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            scratch.commit(self._path)
+
+    def getvalue(self) -> bytes:
+        """Isi upload sebagai bytes (hanya untuk upload yang masih di memori)."""
+        return self._buffer.getvalue()
+
+    def to_path(self) -> str:
+        """Path file di disk; upload kecil ditulis ke scratch store saat pertama kali diminta."""
+        if self._path is None:
+            self._path = scratch.new_path(self.file_ext, prefix="upload_")
+            with open(self._path, "wb") as f:
+                f.write(self._buffer.getvalue())
+            scratch.commit(self._path)
+        return self._path
+
+    def close(self):
+        self.finish()
+        self._buffer = io.BytesIO()
+        if self._path is not None:
+            scratch.release(self._path)
+            self._path = None
+
+
+class WavHeaderProbe:
+    """
+    Membaca header RIFF/WAV dari potongan awal upload untuk mengetahui byte rate dan ukuran
+    data, sehingga durasi audio bisa dibatasi sebelum seluruh file diterima.
+    """
+
+    # Header WAV (termasuk chunk LIST/fact sebelum "data") jarang lebih dari ini
+    _MAX_HEADER_BYTES = 64 * 1024
+
+    def __init__(self):
+        self._head = b""
+        self.done = False
+        self.is_wav = None
+        self.byte_rate = None
+        self.data_offset = None
+        self.data_size = None
+
+    def feed(self, data: bytes):
+        if self.done:
+            return
+        self._head += data[:self._MAX_HEADER_BYTES - len(self._head)]
+        if len(self._head) >= 12 and self.is_wav is None:
+            self.is_wav = self._head[:4] in (b"RIFF", b"RF64") and self._head[8:12] == b"WAVE"
+            if not self.is_wav:
+                self.done = True
+                return
+        self._parse()
+        if self.data_offset is not None or len(self._head) >= self._MAX_HEADER_BYTES:
+            self.done = True
+            self._head = b""
+
+    def _parse(self):
+        offset = 12
+        while offset + 8 <= len(self._head):
+            chunk_id, chunk_size = struct.unpack("<4sI", self._head[offset:offset + 8])
+            body = offset + 8
+            if chunk_id == b"fmt ":
+                if body + 16 > len(self._head):
+                    return
+                self.byte_rate = struct.unpack("<I", self._head[body + 8:body + 12])[0]
+            elif chunk_id == b"data":
+                self.data_offset = body
+                # Perekam streaming sering menulis 0 atau 0xFFFFFFFF karena ukuran belum diketahui
+                self.data_size = chunk_size if 0 < chunk_size < 0xFFFFFFFF else None
+                return
+            offset = body + chunk_size + (chunk_size & 1)
+
+    def duration(self, received: int):
+        """Durasi (detik) menurut header, atau menurut byte yang sudah diterima jika lebih besar."""
+        if not self.byte_rate or self.data_offset is None:
+            return None
+        received_s = max(0, received - self.data_offset) / self.byte_rate
+        declared_s = self.data_size / self.byte_rate if self.data_size else 0.0
+        return max(received_s, declared_s)
+
+
+class UploadForm:
+    """Hasil parsing multipart: file audio (satu atau lebih) beserta field teks lainnya."""
+
+    def __init__(self, uploads: list, fields: dict, durations: list):
+        self.uploads = uploads
+        self.fields = fields
+        # Durasi per file menurut header WAV; None untuk format lain
+        self.durations = durations
+
+    @property
+    def upload(self) -> SpooledUpload:
+        return self.uploads[0]
+
+    @property
+    def duration_s(self):
+        return self.durations[0]
+
+    def close(self):
+        for upload in self.uploads:
+            upload.close()
+
+
+def _too_large(detail: str) -> HTTPException:
+    return HTTPException(status_code=413, detail=detail)
+
+
+class _MultipartIngest:
+    def __init__(self, file_field: str, max_bytes: int, max_seconds: float, max_files: int = 1):
+        self.file_field = file_field
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.max_files = max_files
+        self.uploads = []
+        self.probes = []
+        self.fields = {}
+        self.error = None
+        self._header_field = b""
+        self._header_value = b""
+        self._headers = {}
+        self._name = None
+        self._value = b""
+        self._is_file = False
+
+    # === Callback python-multipart ===
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._name = None
+        self._value = b""
+        self._is_file = False
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._name = options.get(b"name", b"").decode("latin-1")
+        if self._name == self.file_field:
+            if len(self.uploads) >= self.max_files:
+                self.error = HTTPException(status_code=400,
+                                           detail=f"Maksimal {self.max_files} file '{self.file_field}' per permintaan")
+                return
+            filename = options.get(b"filename", b"").decode("utf-8", errors="replace")
+            self.uploads.append(SpooledUpload(filename))
+            self.probes.append(WavHeaderProbe())
+            self._is_file = True
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self.error is not None:
+            return
+        chunk = data[start:end]
+        if not self._is_file:
+            self._value += chunk
+            if len(self._value) > _MAX_FIELD_BYTES:
+                self.error = _too_large(f"Field '{self._name}' terlalu besar")
+            return
+
+        upload, probe = self.uploads[-1], self.probes[-1]
+        if upload.size + len(chunk) > self.max_bytes:
+            self.error = _too_large(f"Ukuran file melebihi batas {self.max_bytes} byte")
+            return
+        upload.write(chunk)
+        probe.feed(chunk)
+        duration = probe.duration(upload.size)
+        if duration is not None and duration > self.max_seconds:
+            self.error = _too_large(f"Durasi audio melebihi batas {self.max_seconds:g} detik")
+
+    def on_part_end(self):
+        if self._is_file:
+            self.uploads[-1].finish()
+        elif self._name:
+            self.fields[self._name] = self._value.decode("utf-8", errors="replace")
+
+
+async def read_upload_form(request: Request, deadline: Deadline, file_field: str = "file",
+                           max_bytes: int = MAX_UPLOAD_BYTES, max_seconds: float = MAX_AUDIO_SECONDS,
+                           max_files: int = 1) -> UploadForm:
+    """
+    Baca body multipart secara streaming tanpa memuat seluruh file ke memori.
+    Ukuran dan durasi audio dibatasi sambil data masuk; permintaan yang melanggar ditolak
+    (413) tanpa menunggu sisa upload. Pemanggil wajib memanggil form.close() setelah selesai;
+    pakai ingest_upload jika upload cukup hidup selama satu blok `async with`.
+    Args:
+        request (Request): Permintaan HTTP multipart/form-data
+        deadline (Deadline): Tenggat permintaan; upload yang terlalu lama dibatalkan
+        file_field (str): Nama field file audio
+        max_files (int): Jumlah file maksimum di field tersebut; batas ukuran/durasi berlaku per file
+    Returns:
+        UploadForm: File audio yang sudah di-spool beserta field teks lainnya
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=400, detail="Body harus berupa multipart/form-data")
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes * max_files + 64 * 1024:
+        # Tolak sebelum membaca body jika ukurannya sudah jelas melebihi batas
+        raise _too_large(f"Ukuran file melebihi batas {max_bytes} byte")
+
+    state = _MultipartIngest(file_field, max_bytes, max_seconds, max_files)
+    parser = MultipartParser(boundary, {
+        "on_part_begin": state.on_part_begin,
+        "on_part_data": state.on_part_data,
+        "on_part_end": state.on_part_end,
+        "on_header_field": state.on_header_field,
+        "on_header_value": state.on_header_value,
+        "on_header_end": state.on_header_end,
+        "on_headers_finished": state.on_headers_finished,
+    })
+
+    async def consume():
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if state.error is not None:
+                raise state.error
+        parser.finalize()
+
+    try:
+        with tracing.span("upload") as upload_span:
+            try:
+                await asyncio.wait_for(consume(), timeout=deadline.remaining())
+            except asyncio.TimeoutError:
+                deadline.cancel("deadline exceeded")
+                raise RequestCancelled(deadline.reason)
+            except ClientDisconnect:
+                deadline.cancel("client disconnected")
+                raise RequestCancelled(deadline.reason)
+
+            if not state.uploads or any(upload.size == 0 for upload in state.uploads):
+                raise HTTPException(status_code=400, detail=f"Field file '{file_field}' tidak ditemukan atau kosong")
+
+            durations = [probe.duration(upload.size) if probe.is_wav else None
+                         for upload, probe in zip(state.uploads, state.probes)]
+            upload_span.set_attribute("upload.bytes", sum(upload.size for upload in state.uploads))
+            upload_span.set_attribute("upload.in_memory", all(upload.in_memory for upload in state.uploads))
+            if max_files > 1:
+                upload_span.set_attribute("upload.files", len(state.uploads))
+            else:
+                upload_span.set_attribute("audio.duration_s", durations[0])
+        return UploadForm(state.uploads, state.fields, durations)
+    except BaseException:
+        for upload in state.uploads:
+            upload.close()
+        raise
+
+
+@asynccontextmanager
+async def ingest_upload(request: Request, deadline: Deadline, file_field: str = "file",
+                        max_bytes: int = MAX_UPLOAD_BYTES, max_seconds: float = MAX_AUDIO_SECONDS,
+                        max_files: int = 1):
+    """
+    Seperti read_upload_form, tetapi file temporer dihapus saat keluar dari context.
+    Yields:
+        UploadForm: File audio yang sudah di-spool beserta field teks lainnya
+    """
+    form = await read_upload_form(request, deadline, file_field, max_bytes, max_seconds, max_files)
+    try:
+        yield form
+    finally:
+        form.close()
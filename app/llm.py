@@ -1,9 +1,16 @@
 import os
+import time
+import asyncio
+import threading
 from google import genai
 from google.genai import types
 from pydantic import TypeAdapter
 from dotenv import load_dotenv
 
+from app.deadline import Deadline, RequestCancelled
+from app.context_cache import CachePlan, ContextCache
+from app import tracing
+
 # Path untuk file .env
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 ENV_PATH = os.path.join(ROOT_DIR, '.env')
@@ -20,33 +27,37 @@ GOOGLE_API_KEY = os.getenv("GEMINI_API_KEY")
 if not GOOGLE_API_KEY:
     raise ValueError("GEMINI_API_KEY tidak ditemukan di file .env. Pastikan file .env berisi GEMINI_API_KEY=your_api_key")
 
+# Endpoint alternatif untuk API Gemini, mis. server tiruan lokal (scripts/fake_gemini_server.py)
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CHAT_HISTORY_FILE = os.path.join(BASE_DIR, "chat_history.json")
 
-# Prompt sistem yang digunakan untuk membimbing gaya respons LLM
+# Prompt sistem yang digunakan untuk membimbing gaya respons LLM.
+# LLM menjawab dengan teks biasa; konversi ke IPA untuk TTS dilakukan lokal oleh app.g2p
 system_instruction = """
 You are a responsive, intelligent, and fluent virtual assistant designed for Indonesian language interaction.
 Your task is to provide clear, concise, and informative answers in response to user queries or statements spoken through voice.
 
-IMPORTANT: Your response must ONLY be the IPA phonetic transcription of what you would say in Indonesian. Do not include any regular text.
+IMPORTANT: Your response will be converted to speech. Write plain Indonesian text only: no markdown, lists, emoji, or phonetic transcription.
 
 Your answers must:
 - Be based on polite and easily understandable Indonesian.
 - Be short and to the point (maximum 2–3 sentences).
 - Avoid repeating the user's question; respond directly with the answer.
-- ONLY output the IPA phonetic transcription, nothing else.
+- Write numbers as digits (e.g. 30, 1.500, 2,5%); they are read aloud automatically.
 
 Examples:
 User: What's the weather like today?
-Assistant: hari ini t͡ʃuat͡ʃaɲa t͡ʃərah di səbaɡian bəsar wilaʝah, dəŋan suhu səkitar tiɡa puluh dərat͡ʃat.
+Assistant: Hari ini cuaca cerah di sebagian besar wilayah, dengan suhu sekitar 30 derajat.
 
 User: Do you know who is the president of Indonesia?
-Assistant: prɛsidɛn indonɛsia saʔat ini adalah d͡ʒɔkɔ widɔdɔ.
+Assistant: Presiden Indonesia saat ini adalah Joko Widodo.
 
 User: Tell me about Jakarta
-Assistant: d͡ʒakarta adalah ibu kɔta indɔnɛsia ʝaŋ tərlɛtak di pulau d͡ʒawa. kɔta ini mərupakan pusat pəmərintahan dəŋan pɔpulasi səkitar səpuluh d͡ʒuta d͡ʒiwa.
+Assistant: Jakarta adalah ibu kota Indonesia yang terletak di pulau Jawa. Kota ini merupakan pusat pemerintahan dengan populasi sekitar 10 juta jiwa.
 
-If you're unsure about an answer, respond with the IPA transcription of "Maaf, saya tidak tahu jawaban untuk pertanyaan tersebut."
+If you're unsure about an answer, respond with "Maaf, saya tidak tahu jawaban untuk pertanyaan tersebut."
 """
 
 # TODO: Inisialisasi klien Gemini dan konfigurasi prompt
@@ -54,10 +65,16 @@ If you're unsure about an answer, respond with the IPA transcription of "Maaf, s
 # Gunakan types.GenerateContentConfig(system_instruction=...) untuk membuat konfigurasi awal.
 # Jika ingin melihat contoh implementasi, baca dokumentasi resmi Gemini:
 # https://github.com/google-gemini/cookbook/blob/main/quickstarts/Get_started.ipynb
-client = genai.Client(api_key=GOOGLE_API_KEY)
+client = genai.Client(
+    api_key=GOOGLE_API_KEY,
+    http_options=types.HttpOptions(base_url=GEMINI_BASE_URL) if GEMINI_BASE_URL else None,
+)
 chat_config = types.GenerateContentConfig(system_instruction=system_instruction)
 history_adapter = TypeAdapter(list[types.Content])
 
+# System instruction dan prefix riwayat yang tidak berubah dikirim lewat context cache Gemini
+context_cache = ContextCache(client, MODEL, system_instruction, chat_config)
+
 # Fungsi untuk menyimpan/memuat riwayat chat
 def export_chat_history(chat) -> str:
     return history_adapter.dump_json(chat.get_history()).decode("utf-8")
@@ -90,11 +107,119 @@ def load_chat_history():
 # Inisialisasi sesi chat saat aplikasi dimulai
 chat = load_chat_history()
 
+# Sesi chat dipakai bersama oleh beberapa thread worker, jadi akses harus diserialisasi
+_chat_lock = threading.Lock()
+_chat_async_lock = asyncio.Lock()
+
+def _user_content(prompt: str) -> types.Content:
+    return types.Content(role="user", parts=[types.Part.from_text(text=prompt)])
+
+def _commit_turn(history: list, user_content: types.Content, response) -> str:
+    # Dipanggil dengan _chat_lock terpegang
+    global chat
+    chat = client.chats.create(
+        model=MODEL,
+        config=chat_config,
+        history=history + [user_content, response.candidates[0].content],
+    )
+    save_chat_history(chat)
+    return response.text.strip()
+
+def _trace_generate(plan: CachePlan):
+    # Span CLIENT untuk satu panggilan generate_content (atribut mengikuti konvensi gen_ai OTel)
+    return tracing.span(f"generate_content {MODEL}", tracing.KIND_CLIENT, **{
+        "gen_ai.system": "gemini",
+        "gen_ai.request.model": MODEL,
+        "llm.context_cached": plan.cached,
+        "llm.history_tail": len(plan.history_tail),
+    })
+
+def _trace_usage(span, response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        span.set_attribute("gen_ai.usage.input_tokens", usage.prompt_token_count)
+        span.set_attribute("gen_ai.usage.output_tokens", usage.candidates_token_count)
+        span.set_attribute("llm.cached_tokens", usage.cached_content_token_count)
+
+def _generate_with_plan(plan: CachePlan, user_content: types.Content):
+    started = time.monotonic()
+    with _trace_generate(plan) as span:
+        response = client.models.generate_content(
+            model=MODEL, contents=plan.history_tail + [user_content], config=plan.config)
+        _trace_usage(span, response)
+    context_cache.record(plan, response, time.monotonic() - started)
+    return response
+
+async def _generate_with_plan_async(plan: CachePlan, user_content: types.Content, timeout: float = None):
+    started = time.monotonic()
+    with _trace_generate(plan) as span:
+        call = client.aio.models.generate_content(
+            model=MODEL, contents=plan.history_tail + [user_content], config=plan.config)
+        response = await asyncio.wait_for(call, timeout=timeout)
+        _trace_usage(span, response)
+    context_cache.record(plan, response, time.monotonic() - started)
+    return response
+
 # Kirim prompt ke LLM dan kembalikan respons teks
 def generate_response(prompt: str) -> str:
     try:
-        response = chat.send_message(prompt)
-        save_chat_history(chat)
-        return response.text.strip()
+        with _chat_lock:
+            history = chat.get_history()
+            user_content = _user_content(prompt)
+            plan = context_cache.prepare(history)
+            try:
+                response = _generate_with_plan(plan, user_content)
+            except Exception as e:
+                if not plan.cached:
+                    raise
+                # Cache hilang/kedaluwarsa di server: ulangi sekali tanpa cache
+                context_cache.invalidate(e)
+                response = _generate_with_plan(CachePlan(chat_config, history), user_content)
+            return _commit_turn(history, user_content, response)
     except Exception as e:
         return f"[ERROR] {str(e)}"
+
+# Versi async yang bisa dibatalkan: jika task di-cancel (klien terputus) atau tenggat habis,
+# request HTTP ke Gemini ikut dihentikan dan riwayat chat tidak diubah
+async def generate_response_async(prompt: str, deadline: Deadline = None) -> str:
+    async with _chat_async_lock:
+        try:
+            if deadline is not None:
+                deadline.check()
+            history = chat.get_history()
+            user_content = _user_content(prompt)
+            plan = await context_cache.prepare_async(history)
+            try:
+                response = await _generate_with_plan_async(
+                    plan, user_content, deadline.remaining() if deadline is not None else None)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                raise
+            except Exception as e:
+                if not plan.cached:
+                    raise
+                # Cache hilang/kedaluwarsa di server: ulangi sekali tanpa cache
+                context_cache.invalidate(e)
+                response = await _generate_with_plan_async(
+                    CachePlan(chat_config, history), user_content,
+                    deadline.remaining() if deadline is not None else None)
+            if deadline is not None:
+                deadline.check()
+
+            with _chat_lock:
+                return _commit_turn(history, user_content, response)
+        except asyncio.TimeoutError:
+            if deadline is not None:
+                deadline.cancel("deadline exceeded")
+            raise RequestCancelled("deadline exceeded")
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            return f"[ERROR] {str(e)}"
+
+async def warm_up_async():
+    """Siapkan context cache untuk riwayat saat ini sebelum giliran pertama (mis. saat sesi suara dibuka)."""
+    async with _chat_async_lock:
+        await context_cache.prepare_async(chat.get_history())
+
+def llm_stats() -> dict:
+    return {"context_cache": context_cache.stats()}
@@ -1,15 +1,27 @@
-import os
 import logging
-import tempfile
-import shutil
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import FileResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 
 # Import fungsi dari modul lain
-from app.stt import transcribe_speech_to_text
-from app.llm import generate_response
-from app.tts import transcribe_text_to_speech
+from app.stt import STTProfile, transcribe_speech_upload, select_profile, stt_profile_stats
+from app.stt_cache import stt_cache_stats
+from app.llm import generate_response_async, llm_stats
+from app.tts import transcribe_text_to_speech, tts_batcher_stats
+from app.admission import admission, AdmissionRejected, client_id_from_request
+from app.deadline import Deadline, RequestCancelled, deadline_from_request, run_cancellable
+from app.workers import STT_POOL, pool_stats
+from app.scheduler import scheduler, limit_api_threads
+from app.speakers import UnknownSpeaker, speaker_table
+from app.ingest import SpooledUpload, ingest_upload
+from app.scratch import ScratchQuotaExceeded, scratch
+from app.session import session_stats
+from app.profiling import ProfilingMiddleware
+from app.tracing import TracingMiddleware
+from app import stages, session, profiling, tracing
 
 # Konfigurasi logging
 logging.basicConfig(
@@ -19,7 +31,22 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Buat instance FastAPI
-app = FastAPI(title="Voice Chatbot API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Bagi core antara pool STT/TTS dan batasi threadpool API sebelum menerima permintaan
+    limit_api_threads()
+    scheduler.start()
+    # Sweeper file audio sementara (upload, potongan dan hasil TTS) yang bocor
+    scratch.start()
+    # Embedding speaker dimuat sekali dan dipakai bersama oleh semua worker TTS
+    await run_in_threadpool(speaker_table.load)
+    yield
+    scratch.stop()
+    scheduler.stop()
+    # Kirim span yang masih tertahan di antrean exporter
+    tracing.shutdown()
+
+app = FastAPI(title="Voice Chatbot API", lifespan=lifespan)
 
 # Tambahkan CORS middleware untuk mengizinkan request dari frontend
 app.add_middleware(
@@ -30,6 +57,12 @@ app.add_middleware(
     allow_headers=["*"],  # Mengizinkan semua headers
 )
 
+# Profiling on-demand (lihat /admin/profile); tanpa overhead berarti saat tidak aktif
+app.add_middleware(ProfilingMiddleware)
+
+# Span per permintaan yang melanjutkan trace dari header traceparent frontend
+app.add_middleware(TracingMiddleware)
+
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
     logger.error(f"HTTP Exception: {exc.detail}")
@@ -38,6 +71,42 @@ async def http_exception_handler(request, exc):
         content={"message": str(exc.detail)},
     )
 
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request, exc):
+    logger.warning(f"Permintaan ditolak ({exc.status_code}): {exc.reason}")
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"message": exc.reason},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.exception_handler(ScratchQuotaExceeded)
+async def scratch_quota_handler(request, exc):
+    logger.warning(f"Penyimpanan sementara penuh: {exc.reason}")
+    return JSONResponse(
+        status_code=503,
+        content={"message": "Server sedang sibuk (penyimpanan sementara penuh), coba lagi nanti"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.exception_handler(UnknownSpeaker)
+async def unknown_speaker_handler(request, exc):
+    logger.warning(str(exc))
+    return JSONResponse(
+        status_code=400,
+        content={"message": str(exc), "speakers": exc.available},
+    )
+
+@app.exception_handler(RequestCancelled)
+async def request_cancelled_handler(request, exc):
+    logger.warning(f"Permintaan dibatalkan: {exc.reason}")
+    # 499 (client closed request) jika klien terputus, 504 jika tenggat habis
+    status_code = 499 if exc.reason == "client disconnected" else 504
+    return JSONResponse(
+        status_code=status_code,
+        content={"message": f"Permintaan dibatalkan: {exc.reason}"},
+    )
+
 @app.exception_handler(Exception)
 async def general_exception_handler(request, exc):
     logger.error(f"Unexpected error: {str(exc)}", exc_info=True)
@@ -46,38 +115,96 @@ async def general_exception_handler(request, exc):
         content={"message": f"Terjadi kesalahan internal: {str(exc)}"},
     )
 
+# Endpoint per tahap (/stt, /chat, /tts) beserta varian batch
+app.include_router(stages.router)
+
+# Sesi suara duplex lewat WebSocket (/voice-session) dengan barge-in
+app.include_router(session.router)
+
+# Endpoint admin untuk profiling CPU/alokasi (butuh ADMIN_TOKEN)
+app.include_router(profiling.router)
+
 @app.get("/")
 async def root():
     """Endpoint root untuk mengecek apakah API berjalan."""
     logger.info("Root endpoint diakses")
     return {"message": "Voice Chatbot API sedang berjalan. Gunakan endpoint /voice-chat untuk berinteraksi."}
 
-@app.post("/voice-chat")
-async def voice_chat(file: UploadFile = File(...)):
+@app.get("/metrics")
+async def metrics():
+    """Statistik runtime server (admisi, antrean, dan sebagainya)."""
+    return {
+        "admission": admission.stats(),
+        "workers": pool_stats(),
+        "tts_batcher": tts_batcher_stats(),
+        "stt_cache": stt_cache_stats(),
+        "stt_profiles": stt_profile_stats(),
+        "scheduler": scheduler.stats(),
+        "speakers": speaker_table.stats(),
+        "llm": llm_stats(),
+        "scratch": scratch.stats(),
+        "sessions": session_stats(),
+        "tracing": tracing.tracing_stats(),
+    }
+
+# Skema body untuk dokumentasi OpenAPI; body dibaca sendiri secara streaming oleh ingest_upload
+_VOICE_CHAT_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {
+                        "file": {"type": "string", "format": "binary"},
+                        "speaker": {"type": "string"},
+                    },
+                },
+            },
+        },
+    },
+}
+
+@app.post("/voice-chat", openapi_extra=_VOICE_CHAT_OPENAPI)
+async def voice_chat(request: Request):
     """
     Endpoint utama untuk interaksi voice chat.
     
     Args:
-        file: File audio yang diupload dari pengguna (Gradio menggunakan nama 'file' sebagai default)
+        request: Request HTTP multipart dengan field 'file' (Gradio menggunakan nama 'file' sebagai default)
+            dan field opsional 'speaker' (lihat GET /speakers)
     
     Returns:
         FileResponse: File audio dengan respons dari chatbot
     """
-    logger.info(f"Menerima permintaan voice chat dengan file: {file.filename}")
-    
+    deadline = deadline_from_request(request, admission.deadline_s)
+    client_id = client_id_from_request(request)
+
+    # Admission control: tolak lebih awal (429/503) sebelum upload dibaca jika server
+    # sedang kelebihan beban; slot pipeline baru diambil setelah upload selesai
+    admission.screen(client_id)
+
+    # Upload dibaca bertahap dan dibatasi ukuran/durasinya sebelum masuk antrean
+    async with ingest_upload(request, deadline) as form:
+        upload = form.upload
+        speaker = speaker_table.resolve(form.fields.get("speaker"))
+        logger.info(f"Menerima permintaan voice chat dengan file: {upload.filename} "
+                    f"({upload.size} byte, durasi {form.duration_s or '?'} detik)")
+
+        async with admission.admit(client_id, deadline, rate_checked=True):
+            # Profil STT dipilih saat masuk antrean, berdasarkan durasi audio dan beban pool
+            profile = select_profile(form.duration_s, STT_POOL.queue_depth())
+            return await run_cancellable(request, deadline, _process_voice_chat(upload, deadline, profile, speaker))
+
+async def _process_voice_chat(upload: SpooledUpload, deadline: Deadline, profile: STTProfile, speaker: str):
     try:
-        # Baca konten file audio
-        audio_content = await file.read()
-        
-        # Dapatkan ekstensi file dari nama file, defaultnya .wav jika tidak ada ekstensi
-        file_ext = os.path.splitext(file.filename)[1]
-        if not file_ext:
-            file_ext = ".wav"  # Default extension jika tidak ada
-        logger.info(f"Ekstensi file: {file_ext}")
+        logger.info(f"Ekstensi file: {upload.file_ext}")
         
         # Langkah 1: Konversi suara ke teks menggunakan Whisper
-        logger.info("Memulai konversi speech-to-text")
-        transcription = transcribe_speech_to_text(audio_content, file_ext)
+        logger.info(f"Memulai konversi speech-to-text (profil {profile.name})")
+        with tracing.span("stt", **{"stt.profile": profile.name}):
+            transcription = await STT_POOL.run(transcribe_speech_upload, upload, deadline, profile)
         
         # Periksa apakah transkripsi berhasil
         if transcription.startswith("[ERROR]"):
@@ -88,7 +215,8 @@ async def voice_chat(file: UploadFile = File(...)):
         
         # Langkah 2: Dapatkan respons menggunakan model Gemini
         logger.info("Menghasilkan respons LLM")
-        llm_response = generate_response(transcription)
+        with tracing.span("llm"):
+            llm_response = await generate_response_async(transcription, deadline)
         
         # Periksa apakah pembuatan respons berhasil
         if llm_response.startswith("[ERROR]"):
@@ -99,7 +227,10 @@ async def voice_chat(file: UploadFile = File(...)):
         
         # Langkah 3: Konversi teks respons menjadi suara
         logger.info("Mengkonversi teks ke suara")
-        audio_response_path = transcribe_text_to_speech(llm_response)
+        # Orkestrasi berjalan di threadpool biasa; potongan kalimat disintesis paralel di TTS_POOL
+        with tracing.span("tts", **{"tts.speaker": speaker, "tts.chars": len(llm_response)}):
+            audio_response_path = await run_in_threadpool(
+                transcribe_text_to_speech, llm_response, deadline, speaker=speaker)
         
         # Periksa apakah path respons audio valid
         if isinstance(audio_response_path, str) and audio_response_path.startswith("[ERROR]"):
@@ -108,14 +239,18 @@ async def voice_chat(file: UploadFile = File(...)):
         
         logger.info(f"Respons audio disimpan di: {audio_response_path}")
         
-        # Langkah 4: Kembalikan file audio
+        # Langkah 4: Kembalikan file audio; file dilepas dari scratch store setelah terkirim
         logger.info("Mengembalikan respons audio ke klien")
         return FileResponse(
             path=audio_response_path,
             media_type="audio/wav",
-            filename="response.wav"
+            filename="response.wav",
+            headers={"X-STT-Profile": profile.name},
+            background=BackgroundTask(scratch.release, audio_response_path),
         )
         
+    except (RequestCancelled, ScratchQuotaExceeded):
+        raise
     except Exception as e:
         logger.error(f"Terjadi kesalahan saat memproses permintaan voice chat: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Terjadi kesalahan: {str(e)}")
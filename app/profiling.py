@@ -0,0 +1,376 @@
+"""
+Profiling on-demand untuk permintaan yang sedang berjalan di server produksi.
+
+Admin menyalakan profiling lewat POST /admin/profile untuk N permintaan berikutnya atau T
+detik. Selama aktif:
+  - thread sampler mengambil stack semua thread setiap PROFILE_SAMPLE_INTERVAL_MS dan
+    menimbangnya dengan waktu CPU thread tersebut (thread yang menunggu I/O tidak dihitung)
+  - tracemalloc merekam alokasi; snapshot awal dan akhir dibandingkan per traceback
+
+Hasil per sesi profiling (GET /admin/profile/{id}/{file}):
+  cpu.pstats       dibuka dengan pstats.Stats / snakeviz
+  cpu.folded       stack terlipat untuk flamegraph.pl / speedscope
+  alloc_diff.txt   selisih alokasi terbesar antara awal dan akhir
+  alloc_*.snapshot snapshot tracemalloc mentah (tracemalloc.Snapshot.load)
+  summary.json     ringkasan dan daftar permintaan yang ikut diprofil
+
+Saat profiling tidak aktif, middleware hanya memeriksa satu atribut per permintaan.
+"""
+import os
+import sys
+import hmac
+import json
+import time
+import uuid
+import shutil
+import marshal
+import tempfile
+import threading
+import tracemalloc
+from collections import Counter, defaultdict
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+
+# Token admin (header X-Admin-Token); jika kosong, endpoint /admin tidak tersedia
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Interval sampling stack
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+
+# Kedalaman traceback yang direkam tracemalloc
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "10"))
+
+# Batas atas satu sesi profiling, agar tidak lupa dimatikan
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))
+
+# Lokasi hasil profiling dan jumlah sesi terakhir yang disimpan
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "voice-chatbot-profiles"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "10"))
+
+# Batas stack yang disimpan per sampel dan jumlah baris di alloc_diff.txt
+_MAX_STACK_DEPTH = 128
+_ALLOC_TOP = 50
+
+ARTIFACTS = ("cpu.pstats", "cpu.folded", "alloc_diff.txt", "alloc_start.snapshot", "alloc_end.snapshot",
+             "summary.json")
+
+
+def _thread_cpu_time(thread_id: int):
+    # Waktu CPU per thread (Linux/Unix); None jika tidak didukung atau thread sudah selesai
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(thread_id))
+    except (AttributeError, OSError, OverflowError):
+        return None
+
+
+class StackSampler:
+    """
+    Profiler sampling untuk semua thread di proses. Setiap sampel diberi bobot waktu CPU yang
+    dipakai thread sejak sampel sebelumnya, sehingga hasilnya berupa profil CPU, bukan wall-clock.
+    Jika waktu CPU per thread tidak tersedia, setiap sampel diberi bobot satu interval.
+    """
+
+    def __init__(self, interval_s: float):
+        self.interval_s = interval_s
+        self.samples = Counter()
+        self.sample_count = 0
+        self.cpu_weighted = _thread_cpu_time(threading.get_ident()) is not None
+        self._cpu = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                if self.cpu_weighted:
+                    now = _thread_cpu_time(thread_id)
+                    previous = self._cpu.get(thread_id)
+                    self._cpu[thread_id] = now
+                    if now is None or previous is None or now <= previous:
+                        continue
+                    weight = now - previous
+                else:
+                    weight = self.interval_s
+                self.samples[self._stack(frame)] += weight
+                self.sample_count += 1
+
+    @staticmethod
+    def _stack(frame) -> tuple:
+        stack = []
+        while frame is not None and len(stack) < _MAX_STACK_DEPTH:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+
+    def write_folded(self, path: str):
+        """Format stack terlipat: `fungsi (file:baris);...;fungsi <bobot mikrodetik>` per baris."""
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, seconds in self.samples.most_common():
+                names = ";".join(f"{name} ({os.path.basename(filename)}:{line})" for filename, line, name in stack)
+                f.write(f"{names} {max(1, int(seconds * 1e6))}\n")
+
+    def write_pstats(self, path: str):
+        """Tulis sampel dalam format marshal milik pstats (waktu = waktu CPU hasil sampling)."""
+        tt = defaultdict(float)
+        ct = defaultdict(float)
+        calls = Counter()
+        callers = defaultdict(lambda: defaultdict(lambda: [0, 0, 0.0, 0.0]))
+        for stack, seconds in self.samples.items():
+            if not stack:
+                continue
+            tt[stack[-1]] += seconds
+            for func in set(stack):
+                ct[func] += seconds
+                calls[func] += 1
+            for depth in range(1, len(stack)):
+                entry = callers[stack[depth]][stack[depth - 1]]
+                entry[0] += 1
+                entry[1] += 1
+                entry[2] += seconds if depth == len(stack) - 1 else 0.0
+                entry[3] += seconds
+        stats = {
+            func: (calls[func], calls[func], tt[func], ct[func],
+                   {caller: tuple(values) for caller, values in callers[func].items()})
+            for func in ct
+        }
+        with open(path, "wb") as f:
+            marshal.dump(stats, f)
+
+
+class ProfileSession:
+    def __init__(self, max_requests: int, max_seconds: float, memory: bool):
+        self.id = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        self.dir = os.path.join(PROFILE_DIR, self.id)
+        self.max_requests = max_requests
+        self.max_seconds = min(max_seconds, PROFILE_MAX_SECONDS)
+        self.memory = memory
+        self.started_at = time.time()
+        self.requests = []
+        self.finished = False
+        self.sampler = StackSampler(PROFILE_SAMPLE_INTERVAL_MS / 1000.0)
+        self._own_tracemalloc = False
+        self._start_snapshot = None
+
+    def start(self):
+        os.makedirs(self.dir, exist_ok=True)
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+                self._own_tracemalloc = True
+            self._start_snapshot = tracemalloc.take_snapshot()
+        self.sampler.start()
+
+    def finish(self, reason: str):
+        self.sampler.stop()
+        self.sampler.write_pstats(os.path.join(self.dir, "cpu.pstats"))
+        self.sampler.write_folded(os.path.join(self.dir, "cpu.folded"))
+        if self._start_snapshot is not None:
+            end_snapshot = tracemalloc.take_snapshot()
+            if self._own_tracemalloc:
+                tracemalloc.stop()
+            self._write_alloc(self._start_snapshot, end_snapshot)
+            self._start_snapshot = None
+        self.finished = True
+        with open(os.path.join(self.dir, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump({**self.status(), "reason": reason}, f, ensure_ascii=False, indent=2)
+
+    def _write_alloc(self, start, end):
+        # Alokasi milik tracemalloc dan sampler sendiri tidak relevan
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        start = start.filter_traces(filters)
+        end = end.filter_traces(filters)
+        start.dump(os.path.join(self.dir, "alloc_start.snapshot"))
+        end.dump(os.path.join(self.dir, "alloc_end.snapshot"))
+        with open(os.path.join(self.dir, "alloc_diff.txt"), "w", encoding="utf-8") as f:
+            for stat in end.compare_to(start, "traceback")[:_ALLOC_TOP]:
+                f.write(f"{stat.size_diff / 1024:+.1f} KiB ({stat.count_diff:+d} blok), "
+                        f"total {stat.size / 1024:.1f} KiB\n")
+                for line in stat.traceback.format(most_recent_first=True):
+                    f.write(f"    {line}\n")
+                f.write("\n")
+
+    def status(self) -> dict:
+        return {
+            "id": self.id,
+            "started_at": self.started_at,
+            "finished": self.finished,
+            "max_requests": self.max_requests,
+            "max_seconds": self.max_seconds,
+            "memory": self.memory,
+            "requests_seen": len(self.requests),
+            "samples": self.sampler.sample_count,
+            "cpu_weighted": self.sampler.cpu_weighted,
+            "requests": self.requests,
+        }
+
+
+class Profiler:
+    """Satu sesi profiling aktif per proses; sesi berakhir setelah N permintaan atau T detik."""
+
+    def __init__(self):
+        self.active = None
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def start(self, max_requests: int, max_seconds: float, memory: bool) -> ProfileSession:
+        with self._lock:
+            if self.active is not None:
+                raise HTTPException(status_code=409, detail=f"Profiling {self.active.id} masih berjalan")
+            session = ProfileSession(max_requests, max_seconds, memory)
+            session.start()
+            self.active = session
+        self._timer = threading.Timer(session.max_seconds, self.stop, args=(session, "time limit"))
+        self._timer.daemon = True
+        self._timer.start()
+        print(f"[WARN] Profiling {session.id} dimulai ({max_requests} permintaan / {session.max_seconds} detik)")
+        return session
+
+    def stop(self, session: ProfileSession = None, reason: str = "stopped"):
+        with self._lock:
+            if self.active is None or (session is not None and self.active is not session):
+                return None
+            session, self.active = self.active, None
+        if self._timer is not None:
+            self._timer.cancel()
+        session.finish(reason)
+        _prune_old_profiles()
+        print(f"[WARN] Profiling {session.id} selesai ({reason}): {session.dir}")
+        return session
+
+    def request_finished(self, session: ProfileSession, method: str, path: str, status: int, duration_s: float):
+        session.requests.append({"method": method, "path": path, "status": status,
+                                 "duration_ms": round(duration_s * 1000, 1)})
+        if session.max_requests and len(session.requests) >= session.max_requests:
+            # Hasil ditulis di thread terpisah agar event loop tidak terblokir
+            threading.Thread(target=self.stop, args=(session, "request limit"), daemon=True).start()
+
+
+def _prune_old_profiles():
+    try:
+        entries = sorted(os.listdir(PROFILE_DIR))
+    except FileNotFoundError:
+        return
+    for name in entries[:-PROFILE_KEEP] if PROFILE_KEEP > 0 else entries:
+        shutil.rmtree(os.path.join(PROFILE_DIR, name), ignore_errors=True)
+
+
+profiler = Profiler()
+
+
+class ProfilingMiddleware:
+    """Middleware ASGI yang mencatat permintaan selama profiling aktif (tanpa biaya saat tidak aktif)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        session = profiler.active
+        if session is None or scope["type"] not in ("http", "websocket") or scope["path"].startswith("/admin/"):
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": None}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.request_finished(session, scope.get("method", "WS"), scope["path"], status["code"],
+                                      time.perf_counter() - started)
+
+
+# === Endpoint admin ===
+
+router = APIRouter(prefix="/admin/profile")
+
+
+def require_admin(request: Request):
+    # Tanpa ADMIN_TOKEN endpoint admin disembunyikan sepenuhnya
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = request.headers.get("x-admin-token", "")
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Token admin tidak valid")
+
+
+class ProfileRequest(BaseModel):
+    # Jumlah permintaan yang diprofil (0 = sampai batas waktu)
+    requests: int = 20
+    seconds: float = 60
+    # Rekam alokasi dengan tracemalloc (menambah overhead selama profiling)
+    memory: bool = True
+
+
+@router.post("")
+async def start_profile(request: Request, body: ProfileRequest):
+    """Nyalakan profiling CPU dan alokasi untuk N permintaan berikutnya atau T detik."""
+    require_admin(request)
+    if body.requests < 0 or body.seconds <= 0:
+        raise HTTPException(status_code=400, detail="requests harus >= 0 dan seconds > 0")
+    # tracemalloc.start()/take_snapshot() bisa lama pada proses yang sibuk; jangan blokir event loop
+    session = await run_in_threadpool(profiler.start, body.requests, body.seconds, body.memory)
+    return session.status()
+
+
+@router.post("/stop")
+async def stop_profile(request: Request):
+    """Hentikan profiling yang sedang berjalan dan tulis hasilnya."""
+    require_admin(request)
+    session = await run_in_threadpool(profiler.stop)
+    if session is None:
+        raise HTTPException(status_code=409, detail="Tidak ada profiling yang berjalan")
+    return {**session.status(), "files": _artifacts(session.id)}
+
+
+@router.get("")
+async def list_profiles(request: Request):
+    """Status profiling aktif dan daftar hasil yang bisa diunduh."""
+    require_admin(request)
+    try:
+        ids = sorted(os.listdir(PROFILE_DIR), reverse=True)
+    except FileNotFoundError:
+        ids = []
+    active = profiler.active
+    return {
+        "active": active.status() if active is not None else None,
+        "profiles": [{"id": pid, "files": _artifacts(pid)} for pid in ids if active is None or pid != active.id],
+    }
+
+
+@router.get("/{profile_id}/{artifact}")
+async def download_profile(request: Request, profile_id: str, artifact: str):
+    """Unduh satu file hasil profiling."""
+    require_admin(request)
+    if artifact not in ARTIFACTS or os.path.basename(profile_id) != profile_id or profile_id in (".", ".."):
+        raise HTTPException(status_code=404, detail="File profil tidak ditemukan")
+    path = os.path.join(PROFILE_DIR, profile_id, artifact)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="File profil tidak ditemukan")
+    return FileResponse(path, filename=f"{profile_id}-{artifact}")
+
+
+def _artifacts(profile_id: str) -> list:
+    directory = os.path.join(PROFILE_DIR, profile_id)
+    return [name for name in ARTIFACTS if os.path.isfile(os.path.join(directory, name))]
@@ -0,0 +1,171 @@
+import os
+import threading
+
+from app.workers import STT_POOL, TTS_POOL
+
+# 0 = engine memakai pengaturan thread bawaannya sendiri
+SCHED_ENABLED = os.getenv("SCHED_ENABLED", "1") == "1"
+
+# Core yang tidak dibagikan ke engine (event loop, parsing upload, panggilan LLM)
+SCHED_RESERVED_CORES = int(os.getenv("SCHED_RESERVED_CORES", "1"))
+
+# Porsi awal core untuk STT; porsi sebenarnya digeser mengikuti antrean
+SCHED_STT_SHARE = float(os.getenv("SCHED_STT_SHARE", "0.5"))
+
+# Porsi minimum untuk masing-masing pool agar pool yang sepi tetap bisa langsung melayani
+SCHED_MIN_SHARE = float(os.getenv("SCHED_MIN_SHARE", "0.25"))
+
+# Interval rebalancing dan faktor smoothing porsi (0..1, makin besar makin cepat bereaksi)
+SCHED_REBALANCE_S = float(os.getenv("SCHED_REBALANCE_S", "2"))
+SCHED_SMOOTHING = float(os.getenv("SCHED_SMOOTHING", "0.5"))
+
+# Pin subprocess whisper/TTS ke set core pool-nya (CPU affinity, hanya Linux)
+SCHED_PIN = os.getenv("SCHED_PIN", "0") == "1"
+
+# Jumlah thread threadpool FastAPI/anyio (orkestrasi dan I/O, bukan komputasi engine)
+API_THREADS = int(os.getenv("API_THREADS", "16"))
+
+
+def _available_cores() -> list:
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 2))
+
+
+class CoreScheduler:
+    """
+    Membagi core host antara pool STT dan TTS. Jumlah thread per job engine dihitung dari
+    porsi core pool dibagi ukuran pool, sehingga total thread engine tidak melebihi jumlah
+    core. Porsi digeser secara berkala mengikuti kedalaman antrean masing-masing pool.
+    """
+
+    def __init__(self, cores: list = None, stt_pool=STT_POOL, tts_pool=TTS_POOL):
+        self.enabled = SCHED_ENABLED
+        self.cores = cores or _available_cores()
+        self.stt_pool = stt_pool
+        self.tts_pool = tts_pool
+        reserved = min(SCHED_RESERVED_CORES, max(0, len(self.cores) - 2))
+        self.reserved = self.cores[:reserved]
+        self.engine_cores = self.cores[reserved:]
+        self._share = SCHED_STT_SHARE
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.rebalances = 0
+        self._split = None
+        self._apply(self._share)
+
+    def _apply(self, share: float):
+        total = len(self.engine_cores)
+        if total < 2:
+            # Satu core: kedua pool memakai core yang sama
+            split = (list(self.engine_cores), list(self.engine_cores))
+        else:
+            stt_count = min(total - 1, max(1, round(total * share)))
+            split = (self.engine_cores[:stt_count], self.engine_cores[stt_count:])
+        with self._lock:
+            changed = self._split is not None and split != self._split
+            self._split = split
+            self._share = share
+            if changed:
+                self.rebalances += 1
+
+    # === Rebalancing ===
+
+    def rebalance(self):
+        """Geser porsi core ke pool yang antreannya lebih dalam."""
+        stt_demand = self.stt_pool.queue_depth() / self.stt_pool.size
+        tts_demand = self.tts_pool.queue_depth() / self.tts_pool.size
+        if stt_demand + tts_demand == 0:
+            target = SCHED_STT_SHARE
+        else:
+            target = stt_demand / (stt_demand + tts_demand)
+        target = min(1 - SCHED_MIN_SHARE, max(SCHED_MIN_SHARE, target))
+        self._apply(self._share + SCHED_SMOOTHING * (target - self._share))
+
+    def _run(self):
+        while not self._stop.wait(SCHED_REBALANCE_S):
+            self.rebalance()
+
+    def start(self):
+        if self.enabled and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="core-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    # === Alokasi ===
+
+    def stt_cores(self) -> list:
+        with self._lock:
+            return self._split[0]
+
+    def tts_cores(self) -> list:
+        with self._lock:
+            return self._split[1]
+
+    def stt_threads(self):
+        """Thread whisper (-t) untuk satu job STT, atau None jika scheduler nonaktif."""
+        if not self.enabled:
+            return None
+        return max(1, len(self.stt_cores()) // self.stt_pool.size)
+
+    def tts_threads(self, batched: bool = False):
+        """
+        Thread torch untuk satu job TTS, atau None jika scheduler nonaktif. Engine batching
+        menjalankan satu forward pass untuk seluruh pool, sehingga mendapat semua core TTS.
+        """
+        if not self.enabled:
+            return None
+        cores = len(self.tts_cores())
+        return max(1, cores if batched else cores // self.tts_pool.size)
+
+    def stt_affinity(self):
+        return set(self.stt_cores()) if self.enabled and SCHED_PIN else None
+
+    def tts_affinity(self):
+        return set(self.tts_cores()) if self.enabled and SCHED_PIN else None
+
+    def tts_env(self):
+        """Environment subprocess TTS dengan batas thread OpenMP/BLAS sesuai porsi core."""
+        if not self.enabled:
+            return None
+        threads = str(self.tts_threads())
+        env = dict(os.environ)
+        for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+            env[var] = threads
+        return env
+
+    def stats(self) -> dict:
+        if not self.enabled:
+            return {"enabled": False}
+        pools = {"stt": (self.stt_pool, self.stt_cores(), self.stt_threads()),
+                 "tts": (self.tts_pool, self.tts_cores(), self.tts_threads())}
+        result = {
+            "cores": len(self.cores),
+            "reserved_cores": self.reserved,
+            "stt_share": round(self._share, 3),
+            "rebalances": self.rebalances,
+            "pinned": SCHED_PIN,
+            "api_threads": API_THREADS,
+        }
+        for name, (pool, cores, threads) in pools.items():
+            pool_stats = pool.stats()
+            result[name] = {
+                "cores": cores,
+                "threads_per_job": threads,
+                "queue_depth": pool_stats["queued"] + pool_stats["active"],
+                "utilization": pool_stats["utilization"],
+            }
+        return result
+
+
+def limit_api_threads():
+    """Batasi threadpool anyio yang dipakai run_in_threadpool dan endpoint sync FastAPI."""
+    import anyio.to_thread
+    anyio.to_thread.current_default_thread_limiter().total_tokens = API_THREADS
+
+
+scheduler = CoreScheduler()
@@ -0,0 +1,225 @@
+import os
+import time
+import uuid
+import shutil
+import tempfile
+import threading
+
+
+def _default_root() -> str:
+    # tmpfs (/dev/shm) jika tersedia: file audio sementara tidak perlu menyentuh disk
+    shm = "/dev/shm"
+    base = shm if os.path.isdir(shm) and os.access(shm, os.W_OK) else tempfile.gettempdir()
+    return os.path.join(base, "voice-chatbot")
+
+
+# Direktori khusus untuk semua file audio sementara (upload, potongan dan hasil TTS)
+SCRATCH_DIR = os.getenv("SCRATCH_DIR", _default_root())
+
+# Kuota per proses; file baru ditolak jika kuota habis setelah GC
+SCRATCH_MAX_BYTES = int(os.getenv("SCRATCH_MAX_BYTES", str(512 * 1024 * 1024)))
+SCRATCH_MAX_FILES = int(os.getenv("SCRATCH_MAX_FILES", "2000"))
+
+# File yang lebih tua dari ini dianggap bocor (mis. klien putus sebelum respons terkirim)
+# dan dihapus oleh sweeper, termasuk sisa proses lain yang sudah mati
+SCRATCH_MAX_AGE_S = float(os.getenv("SCRATCH_MAX_AGE_S", "900"))
+SCRATCH_SWEEP_S = float(os.getenv("SCRATCH_SWEEP_S", "60"))
+
+
+class ScratchQuotaExceeded(Exception):
+    """Kuota scratch store habis."""
+
+    def __init__(self, reason: str, retry_after: int = 5):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Entry:
+    def __init__(self, path: str):
+        self.path = path
+        self.refs = 1
+        self.size = 0
+        self.created = time.time()
+
+
+class ScratchStore:
+    """
+    Penyimpanan file audio sementara dengan masa hidup berbasis referensi. Pembuat file
+    memegang satu referensi; file dihapus saat referensi terakhir dilepas (mis. setelah
+    FileResponse selesai dikirim). Sweeper di background menghapus file yang bocor.
+    """
+
+    def __init__(self, root: str = SCRATCH_DIR, max_bytes: int = SCRATCH_MAX_BYTES,
+                 max_files: int = SCRATCH_MAX_FILES, max_age_s: float = SCRATCH_MAX_AGE_S):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.max_age_s = max_age_s
+        self._entries = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._stats = {"created": 0, "released": 0, "expired": 0, "orphans_removed": 0, "rejected": 0}
+        self._disk = {"files": 0, "bytes": 0, "swept_at": None}
+
+    # === Alokasi ===
+
+    def new_path(self, suffix: str = ".wav", prefix: str = "") -> str:
+        """
+        Buat path file baru di scratch store dengan satu referensi milik pemanggil.
+        Raises:
+            ScratchQuotaExceeded: jika kuota file/byte tetap penuh setelah file kedaluwarsa dibersihkan
+        """
+        with self._lock:
+            full = self._over_quota()
+        if full:
+            self.sweep()
+            with self._lock:
+                full = self._over_quota()
+                if full:
+                    self._stats["rejected"] += 1
+            if full:
+                raise ScratchQuotaExceeded(
+                    f"Kuota file sementara penuh ({len(self._entries)} file, {self._bytes} byte)")
+
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, f"{prefix}{uuid.uuid4().hex}{suffix}")
+        with self._lock:
+            self._entries[path] = _Entry(path)
+            self._stats["created"] += 1
+        return path
+
+    def new_dir(self, prefix: str = "") -> str:
+        """Seperti new_path(), tetapi membuat direktori (dihapus beserta isinya saat dilepas)."""
+        path = self.new_path("", prefix)
+        os.mkdir(path)
+        return path
+
+    def _over_quota(self) -> bool:
+        # Dipanggil dengan self._lock terpegang
+        return len(self._entries) >= self.max_files or self._bytes >= self.max_bytes
+
+    def commit(self, path: str):
+        """Catat ukuran file setelah selesai ditulis (untuk kuota byte)."""
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                self._bytes += size - entry.size
+                entry.size = size
+
+    def acquire(self, path: str):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                entry.refs += 1
+
+    def release(self, path: str):
+        """Lepas satu referensi; file dihapus saat referensi terakhir dilepas."""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return
+            entry.refs -= 1
+            if entry.refs > 0:
+                return
+            del self._entries[path]
+            self._bytes -= entry.size
+            self._stats["released"] += 1
+        self._unlink(path)
+
+    def release_all(self, paths):
+        for path in paths:
+            self.release(path)
+
+    def detach(self, path: str):
+        """Berhenti melacak file tanpa menghapusnya (file dipindah keluar dari scratch store)."""
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self._bytes -= entry.size
+
+    @staticmethod
+    def _unlink(path: str):
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"[WARN] Gagal menghapus file sementara {path}: {e}")
+
+    # === GC ===
+
+    def sweep(self):
+        """Hapus file yang melewati umur maksimum dan hitung ulang pemakaian direktori."""
+        now = time.time()
+        with self._lock:
+            expired = [e for e in self._entries.values() if now - e.created > self.max_age_s]
+            for entry in expired:
+                del self._entries[entry.path]
+                self._bytes -= entry.size
+            self._stats["expired"] += len(expired)
+            tracked = set(self._entries)
+        for entry in expired:
+            self._unlink(entry.path)
+
+        files = 0
+        total = 0
+        orphans = 0
+        try:
+            with os.scandir(self.root) as it:
+                for item in it:
+                    try:
+                        stat = item.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if item.path not in tracked and now - stat.st_mtime > self.max_age_s:
+                        self._unlink(item.path)
+                        orphans += 1
+                        continue
+                    files += 1
+                    total += stat.st_size
+        except FileNotFoundError:
+            os.makedirs(self.root, exist_ok=True)
+
+        with self._lock:
+            self._stats["orphans_removed"] += orphans
+            self._disk = {"files": files, "bytes": total, "swept_at": round(now, 3)}
+
+    def _run(self):
+        while not self._stop.wait(SCRATCH_SWEEP_S):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"[WARN] Sweeper scratch store gagal: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="scratch-sweeper", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "root": self.root,
+                "tracked_files": len(self._entries),
+                "tracked_bytes": self._bytes,
+                "max_files": self.max_files,
+                "max_bytes": self.max_bytes,
+                "disk": dict(self._disk),
+            }
+
+
+scratch = ScratchStore()
@@ -0,0 +1,381 @@
+"""
+Sesi suara full-duplex lewat WebSocket (/voice-session) dengan barge-in.
+
+Protokol:
+  - Klien mengirim audio mikrofon terus-menerus sebagai frame biner PCM 16-bit mono
+    (sample rate default SESSION_SAMPLE_RATE, bisa diganti lewat pesan "config").
+  - Pesan teks JSON dari klien:
+      {"type": "config", "sample_rate": 16000, "speaker": "wibowo"}
+      {"type": "end_of_turn"}    akhiri ucapan sekarang (push-to-talk) tanpa menunggu jeda
+      {"type": "interrupt"}      hentikan balasan yang sedang berjalan
+      {"type": "playback_end"}   klien selesai memutar semua audio balasan
+  - Pesan dari server: JSON "ready", "speech_start", "transcript", "reply", "audio",
+    "reply_end", "interrupted", "error"; setiap pesan "audio" langsung diikuti satu
+    frame biner berisi file WAV untuk satu potongan kalimat.
+
+Ucapan dideteksi dengan VAD berbasis energi. Jika pengguna mulai bicara saat balasan
+masih diproses atau diputar, server mengirim "interrupted" (klien harus langsung
+menghentikan pemutaran) dan membatalkan STT/LLM/TTS yang tersisa untuk balasan lama.
+"""
+import io
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+
+import numpy as np
+import scipy.io.wavfile
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from starlette.concurrency import run_in_threadpool
+
+from app.stt import transcribe_speech_to_text, select_profile
+from app.llm import generate_response_async, warm_up_async
+from app.tts import split_for_tts, group_chunks, synthesize_chunk, warm_up_tts
+from app.speakers import UnknownSpeaker, speaker_table
+from app.admission import admission, AdmissionRejected, client_id_from_request
+from app.deadline import Deadline, RequestCancelled
+from app.ingest import MAX_AUDIO_SECONDS
+from app.workers import STT_POOL, TTS_POOL
+from app import tracing
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Format audio masuk default (PCM 16-bit mono)
+SESSION_SAMPLE_RATE = int(os.getenv("SESSION_SAMPLE_RATE", "16000"))
+
+# Ambang energi VAD (dBFS); frame di atas ambang dianggap ucapan
+SESSION_VAD_THRESHOLD_DB = float(os.getenv("SESSION_VAD_THRESHOLD_DB", "-40"))
+
+# Lama ucapan berturut-turut sebelum dianggap mulai bicara (sekaligus pemicu barge-in)
+SESSION_VAD_START_MS = float(os.getenv("SESSION_VAD_START_MS", "150"))
+
+# Lama jeda yang mengakhiri satu ucapan
+SESSION_ENDPOINT_MS = float(os.getenv("SESSION_ENDPOINT_MS", "700"))
+
+# Sesi ditutup jika tidak ada pesan dari klien selama ini
+SESSION_IDLE_TIMEOUT_S = float(os.getenv("SESSION_IDLE_TIMEOUT_S", "300"))
+
+# Panjang frame analisis VAD dan audio sebelum awal ucapan yang ikut disimpan
+_FRAME_MS = 20
+_PRE_ROLL_MS = 300
+
+# Rentang sample rate yang boleh dipilih klien lewat pesan config
+_MIN_SAMPLE_RATE = 8000
+_MAX_SAMPLE_RATE = 48000
+
+
+class EnergyVAD:
+    """VAD sederhana berbasis energi RMS per frame 20 ms dengan hangover untuk akhir ucapan."""
+
+    def __init__(self, sample_rate: int, threshold_db: float = SESSION_VAD_THRESHOLD_DB,
+                 start_ms: float = SESSION_VAD_START_MS, endpoint_ms: float = SESSION_ENDPOINT_MS):
+        self.frame_bytes = sample_rate * _FRAME_MS // 1000 * 2
+        self.threshold = 32768.0 * 10 ** (threshold_db / 20)
+        self.start_frames = max(1, int(start_ms / _FRAME_MS))
+        self.endpoint_frames = max(1, int(endpoint_ms / _FRAME_MS))
+        self.in_speech = False
+        self._pending = b""
+        self._voiced = 0
+        self._silent = 0
+
+    def feed(self, pcm: bytes) -> list:
+        """
+        Proses audio baru. Returns:
+            list: pasangan (event, frame) per frame; event berupa None, "speech_start" atau "speech_end"
+        """
+        data = self._pending + pcm
+        usable = len(data) - len(data) % self.frame_bytes
+        self._pending = data[usable:]
+        results = []
+        for offset in range(0, usable, self.frame_bytes):
+            frame = data[offset:offset + self.frame_bytes]
+            samples = np.frombuffer(frame, dtype="<i2").astype(np.float32)
+            voiced = float(np.sqrt(np.mean(samples * samples))) >= self.threshold
+            event = None
+            if not self.in_speech:
+                self._voiced = self._voiced + 1 if voiced else 0
+                if self._voiced >= self.start_frames:
+                    self.in_speech = True
+                    self._silent = 0
+                    event = "speech_start"
+            else:
+                self._silent = 0 if voiced else self._silent + 1
+                if self._silent >= self.endpoint_frames:
+                    self.in_speech = False
+                    self._voiced = 0
+                    event = "speech_end"
+            results.append((event, frame))
+        return results
+
+    def reset(self):
+        self.in_speech = False
+        self._voiced = 0
+        self._silent = 0
+
+
+def _pcm_to_wav(pcm: bytes, sample_rate: int) -> bytes:
+    buffer = io.BytesIO()
+    scipy.io.wavfile.write(buffer, sample_rate, np.frombuffer(pcm, dtype="<i2"))
+    return buffer.getvalue()
+
+
+def _wav_duration(wav: bytes) -> float:
+    rate, data = scipy.io.wavfile.read(io.BytesIO(wav))
+    return len(data) / float(rate)
+
+
+class VoiceSession:
+    """
+    Satu koneksi duplex. Audio masuk diproses di loop penerima, sedangkan setiap balasan
+    (STT -> LLM -> TTS per kalimat) berjalan sebagai task terpisah yang bisa dibatalkan.
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self.ws = websocket
+        self.id = uuid.uuid4().hex[:12]
+        self.client_id = client_id_from_request(websocket)
+        self.sample_rate = SESSION_SAMPLE_RATE
+        self.speaker = speaker_table.resolve(websocket.query_params.get("speaker"))
+        self.vad = EnergyVAD(self.sample_rate)
+        self.turn = 0
+        self._pre_roll = bytearray()
+        self._utterance = bytearray()
+        self._reply_task = None
+        self._reply_deadline = None
+        self._playing_until = 0.0
+        self._send_lock = asyncio.Lock()
+        # Trace dari klien (header traceparent saat handshake); tiap giliran menjadi span di dalamnya
+        self.traceparent = websocket.headers.get("traceparent")
+
+    # === Kirim ===
+
+    async def send_json(self, message: dict):
+        async with self._send_lock:
+            await self.ws.send_text(json.dumps(message))
+
+    async def _send_audio(self, header: dict, wav: bytes):
+        # Header dan frame biner dikirim berurutan tanpa diselingi pesan lain
+        async with self._send_lock:
+            await self.ws.send_text(json.dumps(header))
+            await self.ws.send_bytes(wav)
+
+    # === Loop penerima ===
+
+    async def run(self):
+        await self.ws.accept()
+        _sessions[self.id] = self
+        _stats["sessions"] += 1
+        try:
+            # Model TTS in-process dan context cache LLM disiapkan sebelum giliran pertama
+            await run_in_threadpool(warm_up_tts)
+            await warm_up_async()
+            await self.send_json({"type": "ready", "session": self.id, "sample_rate": self.sample_rate,
+                                  "speaker": self.speaker})
+            while True:
+                message = await asyncio.wait_for(self.ws.receive(), timeout=SESSION_IDLE_TIMEOUT_S)
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("bytes") is not None:
+                    await self._on_audio(message["bytes"])
+                elif message.get("text") is not None:
+                    await self._on_control(message["text"])
+        except (WebSocketDisconnect, asyncio.TimeoutError):
+            pass
+        finally:
+            _sessions.pop(self.id, None)
+            self._cancel_reply("session closed")
+            logger.info(f"Sesi suara {self.id} ditutup setelah {self.turn} giliran")
+
+    async def _on_audio(self, pcm: bytes):
+        max_bytes = int(MAX_AUDIO_SECONDS * self.sample_rate) * 2
+        pre_roll_bytes = self.sample_rate * _PRE_ROLL_MS // 1000 * 2
+        for event, frame in self.vad.feed(pcm):
+            if event == "speech_start":
+                await self._speech_started()
+                self._utterance = bytearray(self._pre_roll)
+            if self.vad.in_speech or event == "speech_end":
+                self._utterance += frame
+                if event == "speech_end" or len(self._utterance) >= max_bytes:
+                    self.vad.reset()
+                    self._end_utterance()
+            else:
+                self._pre_roll += frame
+                del self._pre_roll[:-pre_roll_bytes]
+
+    async def _on_control(self, text: str):
+        try:
+            message = json.loads(text)
+        except ValueError:
+            await self.send_json({"type": "error", "message": "Pesan kontrol bukan JSON"})
+            return
+        kind = message.get("type")
+        if kind == "config":
+            # Semua nilai divalidasi dulu; jika ada yang tidak valid, konfigurasi sesi tidak berubah
+            sample_rate = self.sample_rate
+            if "sample_rate" in message:
+                value = message["sample_rate"]
+                try:
+                    if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+                        raise ValueError(value)
+                    sample_rate = int(value)
+                    if not _MIN_SAMPLE_RATE <= sample_rate <= _MAX_SAMPLE_RATE:
+                        raise ValueError(value)
+                except (TypeError, ValueError):
+                    await self.send_json({"type": "error", "message": f"sample_rate harus bilangan bulat "
+                                                                     f"{_MIN_SAMPLE_RATE}-{_MAX_SAMPLE_RATE}"})
+                    return
+            speaker = self.speaker
+            if "speaker" in message:
+                try:
+                    speaker = speaker_table.resolve(message["speaker"])
+                except UnknownSpeaker as e:
+                    await self.send_json({"type": "error", "message": str(e), "speakers": e.available})
+                    return
+            if sample_rate != self.sample_rate:
+                self.sample_rate = sample_rate
+                self.vad = EnergyVAD(self.sample_rate)
+            self.speaker = speaker
+            await self.send_json({"type": "ready", "session": self.id, "sample_rate": self.sample_rate,
+                                  "speaker": self.speaker})
+        elif kind == "end_of_turn":
+            if self._utterance:
+                self.vad.reset()
+                self._end_utterance()
+        elif kind == "interrupt":
+            await self._barge_in()
+        elif kind == "playback_end":
+            self._playing_until = 0.0
+        else:
+            await self.send_json({"type": "error", "message": f"Jenis pesan tidak dikenal: {kind}"})
+
+    # === Barge-in ===
+
+    def _replying(self) -> bool:
+        task_active = self._reply_task is not None and not self._reply_task.done()
+        return task_active or time.monotonic() < self._playing_until
+
+    async def _speech_started(self):
+        if self._replying():
+            await self._barge_in()
+        await self.send_json({"type": "speech_start"})
+
+    async def _barge_in(self):
+        if not self._replying():
+            return
+        _stats["barge_ins"] += 1
+        self._playing_until = 0.0
+        self._cancel_reply("barge-in")
+        # Klien langsung mengosongkan buffer pemutarannya begitu menerima pesan ini
+        await self.send_json({"type": "interrupted", "turn": self.turn})
+
+    def _cancel_reply(self, reason: str):
+        # Subprocess whisper/TTS dihentikan lewat Deadline, await LLM/pool lewat pembatalan task
+        if self._reply_deadline is not None:
+            self._reply_deadline.cancel(reason)
+        if self._reply_task is not None and not self._reply_task.done():
+            self._reply_task.cancel()
+
+    # === Balasan ===
+
+    def _end_utterance(self):
+        pcm = bytes(self._utterance)
+        self._utterance = bytearray()
+        self._pre_roll = bytearray()
+        if not pcm:
+            return
+        self._cancel_reply("superseded")
+        self.turn += 1
+        self._reply_deadline = Deadline(admission.deadline_s)
+        self._reply_task = asyncio.create_task(self._reply(self.turn, pcm, self._reply_deadline))
+
+    async def _reply(self, turn: int, pcm: bytes, deadline: Deadline):
+        started = time.monotonic()
+        futures = []
+        try:
+            with tracing.span("voice-session.turn", tracing.KIND_SERVER, self.traceparent,
+                              **{"session.id": self.id, "session.turn": turn,
+                                 "audio.duration_s": round(len(pcm) / 2 / self.sample_rate, 3)}):
+                async with admission.admit(self.client_id, deadline):
+                    wav = _pcm_to_wav(pcm, self.sample_rate)
+                    profile = select_profile(len(pcm) / 2 / self.sample_rate, STT_POOL.queue_depth())
+                    transcription = await STT_POOL.run(transcribe_speech_to_text, wav, ".wav", deadline, profile)
+                    if transcription.startswith("[ERROR]"):
+                        await self.send_json({"type": "error", "turn": turn, "message": transcription})
+                        return
+                    if not transcription.strip():
+                        return
+                    await self.send_json({"type": "transcript", "turn": turn, "text": transcription})
+
+                    llm_response = await generate_response_async(transcription, deadline)
+                    if llm_response.startswith("[ERROR]"):
+                        await self.send_json({"type": "error", "turn": turn, "message": llm_response})
+                        return
+                    await self.send_json({"type": "reply", "turn": turn, "text": llm_response})
+
+                    # Semua potongan langsung masuk pool; audio dikirim berurutan begitu potongannya siap.
+                    # Pada engine CLI potongan dikelompokkan sesuai worker TTS yang menganggur, sama
+                    # seperti /voice-chat
+                    chunks = group_chunks(await run_in_threadpool(split_for_tts, llm_response))
+                    futures = [TTS_POOL.submit(synthesize_chunk, chunk, self.speaker, deadline) for chunk in chunks]
+                    for index, future in enumerate(futures):
+                        wav = await asyncio.wrap_future(future)
+                        duration = _wav_duration(wav)
+                        if index == 0:
+                            # Waktu dari akhir ucapan sampai potongan audio pertama siap dikirim
+                            _stats["first_audio_s"] += time.monotonic() - started
+                            _stats["first_audio_count"] += 1
+                        await self._send_audio({"type": "audio", "turn": turn, "index": index,
+                                                "last": index == len(futures) - 1,
+                                                "duration_s": round(duration, 3)}, wav)
+                        self._playing_until = max(self._playing_until, time.monotonic()) + duration
+                    await self.send_json({"type": "reply_end", "turn": turn})
+                    _stats["turns"] += 1
+        except asyncio.CancelledError:
+            # Dibatalkan oleh barge-in atau sesi ditutup; "interrupted" sudah dikirim. Future
+            # dibersihkan di finally, lalu pembatalan diteruskan agar task tercatat "cancelled"
+            raise
+        except RequestCancelled:
+            pass
+        except AdmissionRejected as e:
+            await self._send_error(turn, e.reason, retry_after=e.retry_after)
+        except Exception as e:
+            logger.error(f"Sesi {self.id}: giliran {turn} gagal: {e}", exc_info=True)
+            await self._send_error(turn, f"Terjadi kesalahan: {e}")
+        finally:
+            for future in futures:
+                future.cancel()
+
+    async def _send_error(self, turn: int, message: str, **extra):
+        try:
+            await self.send_json({"type": "error", "turn": turn, "message": message, **extra})
+        except Exception:
+            pass
+
+
+# Sesi yang sedang terbuka dan statistik kumulatif untuk /metrics
+_sessions = {}
+_stats = {"sessions": 0, "turns": 0, "barge_ins": 0, "first_audio_s": 0.0, "first_audio_count": 0}
+
+
+def session_stats() -> dict:
+    return {
+        **_stats,
+        "active": len(_sessions),
+        "first_audio_s": round(_stats["first_audio_s"], 3),
+        "avg_first_audio_ms": round(_stats["first_audio_s"] / max(1, _stats["first_audio_count"]) * 1000, 1),
+    }
+
+
+@router.websocket("/voice-session")
+async def voice_session(websocket: WebSocket):
+    """Sesi voice chat duplex; lihat docstring modul untuk protokolnya."""
+    try:
+        session = VoiceSession(websocket)
+    except UnknownSpeaker as e:
+        await websocket.close(code=1008, reason=str(e)[:120])
+        return
+    await session.run()
@@ -0,0 +1,100 @@
+import os
+import threading
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# File speakers.pth milik model Coqui (dibaca sekali oleh server; CLI `tts` membacanya sendiri per proses)
+SPEAKERS_FILE = os.getenv("COQUI_SPEAKERS_FILE", os.path.join(BASE_DIR, "coqui_utils", "speakers.pth"))
+
+# Speaker default jika permintaan tidak memilih speaker
+DEFAULT_SPEAKER = os.getenv("COQUI_SPEAKER", "wibowo")
+
+
+class UnknownSpeaker(Exception):
+    """Nama speaker tidak ada di speakers.pth."""
+
+    def __init__(self, name: str, available: list):
+        super().__init__(f"Speaker tidak dikenal: {name}")
+        self.name = name
+        self.available = available
+
+
+class SpeakerTable:
+    """
+    Tabel speaker yang dimuat sekali: dipakai untuk validasi nama speaker, dan oleh batcher
+    TTS in-process (TTS_BATCHING=1) sebagai sumber id/embedding speaker.
+
+    speakers.pth berisi salah satu dari:
+      - nama -> id speaker (model dengan speaker embedding layer), atau
+      - nama klip -> {"name", "embedding"} (model dengan d-vector); embedding dirata-rata
+        per speaker dan disimpan dalam satu matriks float32 read-only.
+    """
+
+    def __init__(self, path: str = SPEAKERS_FILE, default: str = DEFAULT_SPEAKER):
+        self.path = path
+        self.default = default
+        self.ids = {}
+        self.embeddings = None
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if not os.path.exists(self.path):
+                print(f"[WARN] {self.path} tidak ditemukan; hanya speaker default '{self.default}' yang dipakai")
+                return
+            import torch
+            data = torch.load(self.path, map_location="cpu", weights_only=True)
+
+            first = next(iter(data.values()), None)
+            if isinstance(first, dict) and "embedding" in first:
+                grouped = {}
+                for entry in data.values():
+                    grouped.setdefault(entry["name"], []).append(np.asarray(entry["embedding"], dtype=np.float32))
+                names = sorted(grouped)
+                table = np.stack([np.mean(grouped[name], axis=0) for name in names]).astype(np.float32)
+                table.flags.writeable = False
+                self.ids = {name: row for row, name in enumerate(names)}
+                self.embeddings = table
+            else:
+                self.ids = {name: int(speaker_id) for name, speaker_id in data.items()}
+            print(f"Speaker table: {len(self.ids)} speaker dimuat dari {self.path}")
+
+    def names(self) -> list:
+        self.load()
+        return sorted(self.ids) or [self.default]
+
+    def resolve(self, name: str = None) -> str:
+        """Nama speaker yang valid; None/kosong berarti speaker default."""
+        self.load()
+        name = (name or "").strip() or self.default
+        if self.ids and name not in self.ids:
+            raise UnknownSpeaker(name, self.names())
+        return name
+
+    def speaker_id(self, name: str) -> int:
+        self.load()
+        return self.ids[name]
+
+    def embedding(self, name: str):
+        """Embedding d-vector speaker (view ke tabel bersama), atau None untuk model berbasis id."""
+        self.load()
+        if self.embeddings is None:
+            return None
+        return self.embeddings[self.ids[name]]
+
+    def stats(self) -> dict:
+        return {
+            "speakers": len(self.ids),
+            "default": self.default,
+            "kind": "d_vector" if self.embeddings is not None else "speaker_id",
+            "table_bytes": int(self.embeddings.nbytes) if self.embeddings is not None else 0,
+        }
+
+
+speaker_table = SpeakerTable()
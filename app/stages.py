@@ -0,0 +1,278 @@
+import os
+import json
+import base64
+import asyncio
+import logging
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, StreamingResponse
+from pydantic import BaseModel
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+
+from app.stt import transcribe_speech_upload, select_profile
+from app.llm import generate_response_async
+from app.tts import transcribe_text_to_speech
+from app.speakers import speaker_table
+from app.scratch import scratch
+from app.ingest import SpooledUpload, UploadForm, ingest_upload, read_upload_form
+from app.admission import admission, client_id_from_request
+from app.deadline import Deadline, RequestCancelled, deadline_from_request, run_cancellable
+from app.workers import STT_POOL, TTS_POOL, WorkerPool
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Batas jumlah item per permintaan batch
+MAX_BATCH_ITEMS = int(os.getenv("MAX_BATCH_ITEMS", "32"))
+
+# Tenggat untuk permintaan batch (lebih panjang dari permintaan interaktif)
+BATCH_DEADLINE_S = float(os.getenv("BATCH_DEADLINE_S", "600"))
+
+# Jumlah item batch (dari semua permintaan batch) yang boleh berada di satu pool sekaligus;
+# 0 = setengah ukuran pool, sehingga job interaktif hanya antre di belakang sedikit item batch
+BATCH_MAX_INFLIGHT = int(os.getenv("BATCH_MAX_INFLIGHT", "0"))
+
+# Gerbang per pool, dibuat saat pertama dipakai di event loop
+_batch_gates = {}
+
+
+class ChatRequest(BaseModel):
+    prompt: str
+
+
+class TTSRequest(BaseModel):
+    text: str
+    # False jika text sudah berupa transkripsi IPA
+    phonemize: bool = True
+    # Nama speaker dari GET /speakers; kosong untuk speaker default
+    speaker: str | None = None
+
+
+class TTSBatchRequest(BaseModel):
+    texts: list[str]
+    phonemize: bool = True
+    speaker: str | None = None
+
+
+def _audio_form_openapi(field: str, multiple: bool = False) -> dict:
+    # Skema body untuk dokumentasi OpenAPI; body dibaca sendiri secara streaming oleh app.ingest
+    audio = {"type": "string", "format": "binary"}
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "required": [field],
+                        "properties": {field: {"type": "array", "items": audio} if multiple else audio},
+                    },
+                },
+            },
+        },
+    }
+
+
+def _begin(request: Request, timeout_s: float) -> Deadline:
+    admission.check_rate_limit(client_id_from_request(request))
+    return deadline_from_request(request, timeout_s)
+
+
+@router.post("/stt", openapi_extra=_audio_form_openapi("file"))
+async def stt(request: Request):
+    """Konversi satu file audio menjadi teks."""
+    deadline = _begin(request, admission.deadline_s)
+    # Upload dibaca bertahap dengan batas ukuran/durasi yang sama seperti /voice-chat
+    async with ingest_upload(request, deadline) as form:
+        profile = select_profile(form.duration_s, STT_POOL.queue_depth())
+        transcription = await run_cancellable(
+            request, deadline,
+            STT_POOL.run(transcribe_speech_upload, form.upload, deadline, profile),
+        )
+    if transcription.startswith("[ERROR]"):
+        raise HTTPException(status_code=500, detail=f"Konversi speech-to-text gagal: {transcription}")
+    return {"text": transcription, "profile": profile.name}
+
+
+@router.post("/chat")
+async def chat(request: Request, body: ChatRequest):
+    """Kirim prompt teks ke LLM dan kembalikan respons teks."""
+    deadline = _begin(request, admission.deadline_s)
+    llm_response = await run_cancellable(request, deadline, generate_response_async(body.prompt, deadline))
+    if llm_response.startswith("[ERROR]"):
+        raise HTTPException(status_code=500, detail=f"Pembuatan respons LLM gagal: {llm_response}")
+    return {"response": llm_response}
+
+
+@router.get("/speakers")
+async def speakers():
+    """Daftar speaker yang bisa dipilih untuk TTS."""
+    return {"default": speaker_table.default, "speakers": speaker_table.names()}
+
+
+@router.post("/tts")
+async def tts(request: Request, body: TTSRequest):
+    """Konversi teks menjadi file audio WAV."""
+    speaker = speaker_table.resolve(body.speaker)
+    deadline = _begin(request, admission.deadline_s)
+    audio_response_path = await run_cancellable(
+        request, deadline,
+        run_in_threadpool(transcribe_text_to_speech, body.text, deadline, body.phonemize, True, speaker),
+    )
+    if audio_response_path.startswith("[ERROR]"):
+        raise HTTPException(status_code=500, detail=f"Konversi text-to-speech gagal: {audio_response_path}")
+    return FileResponse(path=audio_response_path, media_type="audio/wav", filename="response.wav",
+                        background=BackgroundTask(scratch.release, audio_response_path))
+
+
+# === Batch ===
+
+def _stt_item(index: int, upload: SpooledUpload, duration_s: float, deadline: Deadline) -> dict:
+    # Profil dipilih saat job mulai berjalan, mengikuti sisa antrean batch saat itu
+    profile = select_profile(duration_s, batch=True)
+    filename = upload.filename
+    try:
+        transcription = transcribe_speech_upload(upload, deadline, profile)
+    except RequestCancelled:
+        raise
+    except Exception as e:
+        transcription = f"[ERROR] {str(e)}"
+    if transcription.startswith("[ERROR]"):
+        return {"index": index, "filename": filename, "profile": profile.name, "error": transcription}
+    return {"index": index, "filename": filename, "profile": profile.name, "text": transcription}
+
+
+def _tts_item(index: int, text: str, deadline: Deadline, phonemize: bool, speaker: str) -> dict:
+    try:
+        audio_response_path = transcribe_text_to_speech(text, deadline, phonemize, speaker=speaker)
+        if audio_response_path.startswith("[ERROR]"):
+            return {"index": index, "error": audio_response_path}
+        try:
+            with open(audio_response_path, "rb") as f:
+                audio = f.read()
+        finally:
+            scratch.release(audio_response_path)
+    except RequestCancelled:
+        raise
+    except Exception as e:
+        return {"index": index, "error": f"[ERROR] {str(e)}"}
+    return {"index": index, "audio_base64": base64.b64encode(audio).decode("ascii")}
+
+
+def _batch_gate(pool: WorkerPool) -> asyncio.Semaphore:
+    gate = _batch_gates.get(pool.name)
+    if gate is None:
+        gate = _batch_gates[pool.name] = asyncio.Semaphore(BATCH_MAX_INFLIGHT or max(1, pool.size // 2))
+    return gate
+
+
+def _submit_longest_first(pool: WorkerPool, fn, jobs: list, costs: list, deadline: Deadline) -> list:
+    """
+    Jadwalkan job batch, yang paling mahal lebih dulu (LPT) agar item panjang tidak tertinggal
+    di akhir batch. Item baru masuk pool hanya jika gerbang batch pool tersebut masih longgar,
+    sehingga batch besar tidak memenuhi antrean pool di depan permintaan interaktif.
+    Task dikembalikan sesuai urutan input.
+    """
+    gate = _batch_gate(pool)
+
+    async def run_item(job: tuple):
+        async with gate:
+            deadline.check()
+            return await pool.run(fn, *job)
+
+    tasks = [None] * len(jobs)
+    # Semaphore asyncio melayani penunggu sesuai urutan, jadi urutan LPT tetap terjaga
+    for i in sorted(range(len(jobs)), key=lambda i: costs[i], reverse=True):
+        tasks[i] = asyncio.create_task(run_item(jobs[i]))
+    return tasks
+
+
+def _close_when_done(tasks: list, form: UploadForm):
+    """Hapus file upload batch setelah semua task selesai, dibatalkan, atau gagal."""
+    remaining = [len(tasks)]
+
+    def on_done(_task):
+        remaining[0] -= 1
+        if remaining[0] == 0:
+            form.close()
+
+    for task in tasks:
+        task.add_done_callback(on_done)
+
+
+async def _batch_response(request: Request, deadline: Deadline, pending: list, stream: bool):
+    if not stream:
+        async def gather_all():
+            return await asyncio.gather(*pending)
+        return {"results": await run_cancellable(request, deadline, gather_all())}
+
+    async def ndjson():
+        # Generator ditutup (GeneratorExit/CancelledError) tanpa melewati except di bawah
+        # hanya jika klien terputus di tengah stream
+        reason = "client disconnected"
+        # Hasil dikirim sesuai urutan selesai; field "index" menunjuk posisi item di input
+        try:
+            for next_done in asyncio.as_completed(pending, timeout=deadline.remaining()):
+                result = await next_done
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        except asyncio.TimeoutError:
+            reason = "deadline exceeded"
+            deadline.cancel(reason)
+            yield json.dumps({"error": "Permintaan dibatalkan: deadline exceeded"}) + "\n"
+        except RequestCancelled as e:
+            reason = e.reason
+            yield json.dumps({"error": f"Permintaan dibatalkan: {e.reason}"}) + "\n"
+        except Exception as e:
+            reason = f"batch failed: {e}"
+            raise
+        finally:
+            # Stream berhenti sebelum semua item selesai: hentikan job yang masih berjalan/antre
+            if not all(p.done() for p in pending):
+                deadline.cancel(reason)
+                for p in pending:
+                    p.cancel()
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
+@router.post("/stt/batch", openapi_extra=_audio_form_openapi("files", multiple=True))
+async def stt_batch(request: Request, stream: bool = False):
+    """
+    Transkripsi banyak file audio sekaligus.
+    Returns:
+        {"results": [...]} sesuai urutan input, atau NDJSON per item jika stream=true
+    """
+    deadline = _begin(request, BATCH_DEADLINE_S)
+    # Upload dibaca bertahap; batas ukuran/durasi berlaku per file, jumlah file dibatasi
+    # MAX_BATCH_ITEMS. File dihapus setelah semua item selesai (juga saat respons di-stream)
+    form = await read_upload_form(request, deadline, file_field="files", max_files=MAX_BATCH_ITEMS)
+    try:
+        jobs = [(index, upload, duration_s, deadline)
+                for index, (upload, duration_s) in enumerate(zip(form.uploads, form.durations))]
+        # Ukuran file dipakai sebagai perkiraan durasi audio
+        tasks = _submit_longest_first(STT_POOL, _stt_item, jobs, [upload.size for upload in form.uploads], deadline)
+    except BaseException:
+        form.close()
+        raise
+    _close_when_done(tasks, form)
+    logger.info(f"Batch STT: {len(jobs)} item dijadwalkan")
+    return await _batch_response(request, deadline, tasks, stream)
+
+
+@router.post("/tts/batch")
+async def tts_batch(request: Request, body: TTSBatchRequest, stream: bool = False):
+    """
+    Sintesis banyak teks sekaligus. Audio WAV dikembalikan dalam base64.
+    Returns:
+        {"results": [...]} sesuai urutan input, atau NDJSON per item jika stream=true
+    """
+    if len(body.texts) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Maksimal {MAX_BATCH_ITEMS} item per batch")
+    speaker = speaker_table.resolve(body.speaker)
+    deadline = _begin(request, BATCH_DEADLINE_S)
+
+    jobs = [(index, text, deadline, body.phonemize, speaker) for index, text in enumerate(body.texts)]
+    tasks = _submit_longest_first(TTS_POOL, _tts_item, jobs, [len(text) for text in body.texts], deadline)
+    logger.info(f"Batch TTS: {len(jobs)} item dijadwalkan")
+    return await _batch_response(request, deadline, tasks, stream)
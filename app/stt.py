@@ -1,8 +1,16 @@
 import os
 import uuid
-import tempfile
+import threading
 import subprocess
 
+from app.deadline import Deadline, run_subprocess
+from app.stt_cache import stt_cache, audio_fingerprint
+from app.ingest import SpooledUpload, WavHeaderProbe
+from app.workers import STT_POOL
+from app.admission import admission
+from app.scheduler import scheduler
+from app.scratch import scratch
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # path ke folder utilitas STT
@@ -16,40 +24,207 @@ WHISPER_BINARY = os.path.join(WHISPER_DIR, "build", "bin", "whisper-cli")
 # Gunakan os.path.join() untuk mengarah ke file model di dalam folder "models"
 WHISPER_MODEL_PATH = os.path.join(WHISPER_DIR, "models", "ggml-large-v3-turbo.bin")
 
-def transcribe_speech_to_text(file_bytes: bytes, file_ext: str = ".wav") -> str:
+# Model kecil untuk profil "fast" saat server sibuk (jika file tidak ada, model utama dipakai)
+WHISPER_FAST_MODEL_PATH = os.getenv(
+    "WHISPER_FAST_MODEL_PATH", os.path.join(WHISPER_DIR, "models", "ggml-base.bin"))
+
+# Semua input berbahasa Indonesia; deteksi bahasa otomatis hanya menambah latensi
+WHISPER_LANGUAGE = os.getenv("WHISPER_LANGUAGE", "id")
+
+# Thread whisper per job (0 = ditentukan app.scheduler dari porsi core STT)
+STT_THREADS = int(os.getenv("STT_THREADS", "0"))
+
+# Paksa satu profil untuk semua permintaan (kosong = dipilih otomatis sesuai beban)
+STT_PROFILE = os.getenv("STT_PROFILE", "")
+
+# Audio lebih panjang dari ini tidak memakai beam search lebar
+STT_LONG_AUDIO_S = float(os.getenv("STT_LONG_AUDIO_S", "20"))
+
+
+class STTProfile:
+    """Kombinasi model dan parameter decoding whisper.cpp untuk satu tingkat latensi."""
+
+    def __init__(self, name: str, model_path: str, beam_size: int, best_of: int,
+                 threads: int = STT_THREADS, language: str = WHISPER_LANGUAGE):
+        self.name = name
+        self.model_path = model_path
+        self.beam_size = beam_size
+        self.best_of = best_of
+        self.threads = threads
+        self.language = language
+
+    def with_threads(self, threads: int) -> "STTProfile":
+        return STTProfile(self.name, self.model_path, self.beam_size, self.best_of, threads, self.language)
+
+    def resolved_model_path(self) -> str:
+        return self.model_path if os.path.exists(self.model_path) else WHISPER_MODEL_PATH
+
+    def args(self) -> list:
+        args = [
+            "-m", self.resolved_model_path(),
+            "-l", self.language,
+            "-bs", str(self.beam_size),
+            "-bo", str(self.best_of),
+        ]
+        threads = self.threads or scheduler.stt_threads()
+        if threads:
+            args += ["-t", str(threads)]
+        return args
+
+    def cache_options(self) -> str:
+        # Jumlah thread tidak memengaruhi hasil, jadi tidak ikut dalam kunci cache
+        return f"{os.path.basename(self.resolved_model_path())}|l={self.language}|bs={self.beam_size}|bo={self.best_of}"
+
+
+STT_PROFILES = {
+    # Beam search penuh dengan model utama, untuk beban rendah
+    "accurate": STTProfile("accurate", WHISPER_MODEL_PATH, beam_size=5, best_of=5),
+    # Greedy decoding dengan model utama
+    "balanced": STTProfile("balanced", WHISPER_MODEL_PATH, beam_size=1, best_of=1),
+    # Greedy decoding dengan model kecil, saat antrean sudah menumpuk
+    "fast": STTProfile("fast", WHISPER_FAST_MODEL_PATH, beam_size=1, best_of=1),
+}
+
+if STT_PROFILE and STT_PROFILE not in STT_PROFILES:
+    raise ValueError(f"STT_PROFILE tidak dikenal: {STT_PROFILE} (pilihan: {', '.join(STT_PROFILES)})")
+
+_profile_lock = threading.Lock()
+_profile_counts = {name: 0 for name in STT_PROFILES}
+# Item batch dihitung terpisah agar satu permintaan batch tidak mendominasi statistik per permintaan
+_batch_profile_counts = {name: 0 for name in STT_PROFILES}
+
+
+def select_profile(duration_s: float = None, queue_depth: int = None, batch: bool = False,
+                   waiting: int = None) -> STTProfile:
+    """
+    Pilih profil STT berdasarkan durasi audio dan backlog: job STT yang sedang antre/berjalan
+    ditambah pipeline yang masih menunggu di antrean admisi. Pipeline yang menunggu belum terlihat
+    di STT_POOL (admisi membatasi konkurensi sebelum pool), padahal masing-masing akan butuh STT.
+    Args:
+        duration_s (float): Durasi audio dalam detik (None jika tidak diketahui)
+        queue_depth (int): Job di STT_POOL; default diambil dari pool saat ini
+        waiting (int): Permintaan di antrean admisi; default diambil dari app.admission
+        batch (bool): True untuk item permintaan batch (dicatat di statistik "batch")
+    Returns:
+        STTProfile: Profil yang dipakai untuk permintaan ini
+    """
+    if STT_PROFILE:
+        profile = STT_PROFILES[STT_PROFILE]
+    else:
+        if queue_depth is None:
+            queue_depth = STT_POOL.queue_depth()
+        if waiting is None:
+            waiting = admission.queue_depth()
+        # Beban relatif: 1.0 berarti semua worker STT sedang terpakai
+        load = queue_depth / STT_POOL.size
+        # "fast" jika antrean pool menumpuk atau satu gelombang pipeline penuh sedang menunggu admisi
+        if load >= 2 or waiting >= admission.max_concurrency:
+            profile = STT_PROFILES["fast"]
+        elif load >= 1 or waiting > 0 or (duration_s is not None and duration_s > STT_LONG_AUDIO_S):
+            profile = STT_PROFILES["balanced"]
+        else:
+            profile = STT_PROFILES["accurate"]
+    with _profile_lock:
+        (_batch_profile_counts if batch else _profile_counts)[profile.name] += 1
+    return profile
+
+
+def stt_profile_stats() -> dict:
+    with _profile_lock:
+        counts = dict(_profile_counts)
+        batch_counts = dict(_batch_profile_counts)
+    return {"forced": STT_PROFILE or None, "served": counts, "batch_items": batch_counts}
+
+
+def audio_duration(file_bytes: bytes):
+    """Durasi audio WAV dari header-nya, atau None untuk format lain."""
+    probe = WavHeaderProbe()
+    probe.feed(file_bytes[:64 * 1024])
+    return probe.duration(len(file_bytes))
+
+
+def transcribe_speech_to_text(file_bytes: bytes, file_ext: str = ".wav", deadline: Deadline = None,
+                              profile: STTProfile = None) -> str:
     """
     Transkrip file audio menggunakan whisper.cpp CLI
     Args:
         file_bytes (bytes): Isi file audio
         file_ext (str): Ekstensi file, default ".wav"
+        deadline (Deadline): Tenggat/token pembatalan; whisper dihentikan jika dibatalkan
+        profile (STTProfile): Profil decoding; default dipilih dari durasi audio dan beban saat ini
     Returns:
         str: Teks hasil transkripsi
     """
-    with tempfile.TemporaryDirectory() as tmpdir:
+    def run(tmpdir: str) -> str:
         audio_path = os.path.join(tmpdir, f"{uuid.uuid4()}{file_ext}")
-        result_path = os.path.join(os.path.dirname(tmpdir), "transcription.txt")
-
         # simpan audio ke file temporer
         with open(audio_path, "wb") as f:
             f.write(file_bytes)
+        return _run_whisper(audio_path, tmpdir, profile, deadline)
 
-        # jalankan whisper.cpp dengan subprocess
-        cmd = [
-            WHISPER_BINARY,
-            "-m", WHISPER_MODEL_PATH,
-            "-f", audio_path,
-            "-otxt",
-            "-of", os.path.join(os.path.dirname(tmpdir), "transcription")
-        ]
+    if profile is None:
+        profile = select_profile(audio_duration(file_bytes))
+    return _transcribe_cached(audio_fingerprint(file_bytes), profile, run)
+
+
+def transcribe_speech_upload(upload: SpooledUpload, deadline: Deadline = None, profile: STTProfile = None) -> str:
+    """
+    Transkrip upload yang sudah di-spool (lihat app.ingest) tanpa menyalinnya ke memori.
+    Args:
+        upload (SpooledUpload): File audio hasil upload streaming
+        deadline (Deadline): Tenggat/token pembatalan; whisper dihentikan jika dibatalkan
+        profile (STTProfile): Profil decoding; default dipilih dari beban saat ini
+    Returns:
+        str: Teks hasil transkripsi
+    """
+    source = upload.getvalue() if upload.in_memory else upload.to_path()
+    fingerprint = audio_fingerprint(source, upload.sha256.hexdigest())
+    if profile is None:
+        profile = select_profile()
+    return _transcribe_cached(fingerprint, profile,
+                              lambda tmpdir: _run_whisper(upload.to_path(), tmpdir, profile, deadline))
+
+
+def _transcribe_cached(fingerprint: str, profile: STTProfile, run) -> str:
+    # Audio yang sama (termasuk dalam header WAV berbeda) tidak perlu diproses ulang oleh whisper
+    cache_key = None
+    if stt_cache is not None:
+        cache_key = stt_cache.make_key(fingerprint, profile.cache_options())
+        cached = stt_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    tmpdir = scratch.new_dir(prefix="stt_")
+    try:
+        transcription = run(tmpdir)
+    finally:
+        scratch.release(tmpdir)
+    if cache_key is not None and not transcription.startswith("[ERROR]"):
+        stt_cache.put(cache_key, transcription)
+    return transcription
+
+
+def _run_whisper(audio_path: str, tmpdir: str, profile: STTProfile, deadline: Deadline = None) -> str:
+    # hasil ditulis di dalam tmpdir agar permintaan paralel tidak saling menimpa
+    result_path = os.path.join(tmpdir, "transcription.txt")
+
+    # jalankan whisper.cpp dengan subprocess
+    cmd = [
+        WHISPER_BINARY,
+        *profile.args(),
+        "-f", audio_path,
+        "-otxt",
+        "-of", os.path.join(tmpdir, "transcription")
+    ]
+
+    try:
+        run_subprocess(cmd, deadline, check=True, cpus=scheduler.stt_affinity())
+    except subprocess.CalledProcessError as e:
+        return f"[ERROR] Whisper failed: {e}"
 
-        try:
-            subprocess.run(cmd, check=True)
-        except subprocess.CalledProcessError as e:
-            return f"[ERROR] Whisper failed: {e}"
-        
-        # baca hasil transkripsi
-        try:
-            with open(result_path, "r", encoding="utf-8") as result_file:
-                return result_file.read()
-        except FileNotFoundError:
-            return "[ERROR] Transcription file not found"
+    # baca hasil transkripsi
+    try:
+        with open(result_path, "r", encoding="utf-8") as result_file:
+            return result_file.read()
+    except FileNotFoundError:
+        return "[ERROR] Transcription file not found"
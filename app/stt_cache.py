@@ -0,0 +1,216 @@
+import io
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Cache transkripsi berdasarkan sidik jari PCM (0 = nonaktif)
+STT_CACHE_ENABLED = os.getenv("STT_CACHE_ENABLED", "1") == "1"
+
+# Batas tier memori (jumlah entri) dan tier disk (jumlah file)
+STT_CACHE_MEMORY_ITEMS = int(os.getenv("STT_CACHE_MEMORY_ITEMS", "256"))
+STT_CACHE_DISK_ITEMS = int(os.getenv("STT_CACHE_DISK_ITEMS", "5000"))
+STT_CACHE_DIR = os.getenv("STT_CACHE_DIR", os.path.join(BASE_DIR, "stt_cache"))
+
+# Naikkan jika cara normalisasi PCM berubah agar entri lama tidak terpakai
+_FINGERPRINT_VERSION = "pcm-v1"
+
+
+def _to_int16_mono(samples: np.ndarray) -> np.ndarray:
+    if samples.ndim > 1:
+        # Rata-rata kanal agar stereo dan mono dengan isi sama menghasilkan PCM yang sama
+        samples = samples.astype(np.int32).mean(axis=1).round().astype(np.int16)
+    # Sampel nol di awal/akhir (padding digital) tidak memengaruhi transkripsi
+    nonzero = np.flatnonzero(samples)
+    if nonzero.size == 0:
+        return samples[:0]
+    return samples[nonzero[0]:nonzero[-1] + 1]
+
+
+def audio_fingerprint(source, raw_sha256: str = None) -> str:
+    """
+    Hitung sidik jari audio dari PCM hasil decode (mono, int16, tanpa padding sunyi di ujung),
+    sehingga audio yang sama dalam header/container berbeda menghasilkan kunci yang sama.
+    Jika audio tidak bisa di-decode, sidik jari dihitung dari byte mentah.
+    Args:
+        source (bytes | str): Isi file audio atau path ke file audio
+        raw_sha256 (str): sha256 byte mentah jika sudah dihitung (mis. saat upload)
+    Returns:
+        str: Sidik jari heksadesimal (sha256)
+    """
+    try:
+        samples, sample_rate = _decode(io.BytesIO(source) if isinstance(source, bytes) else source)
+    except Exception:
+        return f"raw:{raw_sha256 or _raw_sha256(source)}"
+
+    digest = hashlib.sha256()
+    pcm = _to_int16_mono(samples)
+    digest.update(f"{_FINGERPRINT_VERSION}:{sample_rate}:".encode())
+    digest.update(np.ascontiguousarray(pcm, dtype="<i2").tobytes())
+    return digest.hexdigest()
+
+
+def _raw_sha256(source) -> str:
+    if isinstance(source, bytes):
+        return hashlib.sha256(source).hexdigest()
+    digest = hashlib.sha256()
+    with open(source, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _decode(source):
+    try:
+        import soundfile as sf
+        return sf.read(source, dtype="int16", always_2d=False)
+    except Exception:
+        if hasattr(source, "seek"):
+            source.seek(0)
+
+    # Fallback untuk WAV jika libsndfile tidak tersedia
+    from scipy.io import wavfile
+    sample_rate, samples = wavfile.read(source)
+    if samples.dtype == np.uint8:
+        samples = (samples.astype(np.int16) - 128) << 8
+    elif samples.dtype == np.int32:
+        samples = (samples >> 16).astype(np.int16)
+    elif samples.dtype.kind == "f":
+        samples = np.clip(np.round(samples * 32767), -32768, 32767).astype(np.int16)
+    return samples, sample_rate
+
+
+class TranscriptionCache:
+    """
+    Cache transkripsi dua tingkat: LRU di memori dan file JSON di disk. Entri disk yang
+    paling lama tidak dipakai (mtime) dihapus saat jumlahnya melebihi batas.
+    """
+
+    def __init__(self, cache_dir: str = STT_CACHE_DIR, memory_items: int = STT_CACHE_MEMORY_ITEMS,
+                 disk_items: int = STT_CACHE_DISK_ITEMS):
+        self.cache_dir = cache_dir
+        self.memory_items = memory_items
+        self.disk_items = disk_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_count = None
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "disk_evictions": 0}
+
+    @staticmethod
+    def make_key(fingerprint: str, model: str, options: str = "") -> str:
+        """Gabungkan sidik jari audio dengan model dan opsi whisper yang memengaruhi hasil."""
+        return hashlib.sha256(f"{fingerprint}|{model}|{options}".encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _remember(self, key: str, text: str):
+        # Dipanggil dengan self._lock terpegang
+        self._memory[key] = text
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return self._memory[key]
+
+        if self.disk_items > 0:
+            path = self._path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    text = json.load(f)["text"]
+                # Perbarui mtime sebagai penanda terakhir dipakai untuk eviksi LRU
+                os.utime(path)
+            except (OSError, ValueError, KeyError):
+                text = None
+            if text is not None:
+                with self._lock:
+                    self._stats["disk_hits"] += 1
+                    self._remember(key, text)
+                return text
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, key: str, text: str):
+        with self._lock:
+            self._remember(key, text)
+            self._stats["stores"] += 1
+        if self.disk_items <= 0:
+            return
+
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            is_new = not os.path.exists(path)
+            # Tulis ke file sementara lalu rename agar pembaca (termasuk proses lain) tidak
+            # pernah melihat file setengah jadi
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"text": text, "created": time.time()}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"[WARN] STT cache gagal menulis {path}: {e}")
+            return
+
+        if is_new:
+            with self._lock:
+                if self._disk_count is not None:
+                    self._disk_count += 1
+                over_limit = self._disk_count is None or self._disk_count > self.disk_items
+            if over_limit:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except OSError:
+                    continue
+
+        # Pangkas ke 90% batas agar eviksi (yang memindai direktori) tidak terjadi tiap put
+        excess = len(entries) - self.disk_items
+        if excess > 0:
+            excess = len(entries) - int(self.disk_items * 0.9)
+        removed = 0
+        for _, path in sorted(entries)[:max(0, excess)]:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                continue
+        with self._lock:
+            self._disk_count = len(entries) - removed
+            self._stats["disk_evictions"] += removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_items"] = len(self._memory)
+            stats["disk_items"] = self._disk_count
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / max(1, lookups), 4)
+        return stats
+
+
+stt_cache = TranscriptionCache() if STT_CACHE_ENABLED else None
+
+
+def stt_cache_stats() -> dict:
+    return stt_cache.stats() if stt_cache is not None else {"enabled": False}
@@ -0,0 +1,61 @@
+import os
+import re
+
+# Panjang maksimum satu potongan teks yang disintesis dalam satu job TTS
+TTS_CHUNK_MAX_CHARS = int(os.getenv("TTS_CHUNK_MAX_CHARS", "160"))
+
+# Potongan yang lebih pendek dari ini digabung ke potongan sebelumnya, karena overhead
+# memuat model per job lebih mahal daripada menyintesis beberapa kata tambahan
+TTS_CHUNK_MIN_CHARS = int(os.getenv("TTS_CHUNK_MIN_CHARS", "40"))
+
+_SENTENCE_RE = re.compile(r"[^.?!]+[.?!]*")
+
+
+def normalize(text: str) -> str:
+    """Rapikan spasi dan tanda baca berulang ("..." -> ".", " ," -> ",")."""
+    text = re.sub(r"([.?!,])\1+", r"\1", text)
+    text = re.sub(r"\s+([.?!,])", r"\1", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _split_long(sentence: str, max_chars: int) -> list:
+    # Kalimat panjang dipecah di koma dulu, lalu di spasi
+    pieces = []
+    current = ""
+    for part in re.split(r"(?<=,)\s+", sentence):
+        words = part.split(" ") if len(part) > max_chars else [part]
+        for word in words:
+            candidate = f"{current} {word}".strip()
+            if current and len(candidate) > max_chars:
+                pieces.append(current)
+                current = word
+            else:
+                current = candidate
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_chunks(text: str, max_chars: int = TTS_CHUNK_MAX_CHARS, min_chars: int = TTS_CHUNK_MIN_CHARS) -> list:
+    """
+    Pecah teks (biasa atau IPA) menjadi potongan per kalimat/frasa untuk disintesis paralel.
+    Args:
+        text (str): Teks yang akan dipecah
+        max_chars (int): Panjang maksimum satu potongan
+        min_chars (int): Potongan yang lebih pendek digabung dengan potongan sebelumnya
+    Returns:
+        list: Potongan teks sesuai urutan
+    """
+    chunks = []
+    for sentence in _SENTENCE_RE.findall(normalize(text)):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        pieces = [sentence] if len(sentence) <= max_chars else _split_long(sentence, max_chars)
+        for piece in pieces:
+            if chunks and (len(piece) < min_chars or len(chunks[-1]) < min_chars) \
+                    and len(chunks[-1]) + 1 + len(piece) <= max_chars:
+                chunks[-1] = f"{chunks[-1]} {piece}"
+            else:
+                chunks.append(piece)
+    return chunks
@@ -0,0 +1,319 @@
+"""
+Tracing end-to-end ringan dengan format OpenTelemetry (OTLP/JSON), tanpa dependensi SDK.
+
+Trace ID dibuat oleh frontend dan dikirim lewat header W3C `traceparent`; server membuat span
+untuk permintaan HTTP, upload, antrean admisi, tiap tahap pipeline, job di pool worker, dan
+subprocess whisper/TTS (yang juga menerima env TRACEPARENT). Span diekspor per batch sebagai
+ExportTraceServiceRequest JSON:
+  - TRACE_FILE: satu baris JSON per batch (format file exporter OTel Collector)
+  - OTLP_ENDPOINT: POST ke endpoint OTLP/HTTP, mis. http://localhost:4318/v1/traces
+
+Jika keduanya kosong, tracing nonaktif dan span() hanya mengembalikan span kosong.
+"""
+import os
+import json
+import time
+import queue
+import random
+import threading
+import contextvars
+import urllib.request
+from contextlib import contextmanager
+
+# Tujuan ekspor span; tracing aktif jika salah satunya diisi
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+OTLP_ENDPOINT = os.getenv("OTLP_ENDPOINT", "")
+
+# Nama layanan pada resource OTel
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "voice-chatbot-api")
+
+# Porsi trace baru (tanpa traceparent dari klien) yang direkam
+TRACE_SAMPLE_RATIO = float(os.getenv("TRACE_SAMPLE_RATIO", "1.0"))
+
+# Span dikirim per batch setiap interval ini atau saat batch penuh
+_EXPORT_INTERVAL_S = 1.0
+_EXPORT_BATCH_SIZE = 256
+_MAX_QUEUE = 10000
+
+# Nilai SpanKind OTLP
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+
+_STATUS_ERROR = 2
+
+
+class Span:
+    """Satu span; atribut bisa ditambah selama span masih terbuka."""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "sampled",
+                 "start_ns", "end_ns", "attributes", "events", "status")
+
+    def __init__(self, trace_id: str, span_id: str, parent_id: str, name: str, kind: int, sampled: bool):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.sampled = sampled
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = {}
+        self.events = []
+        self.status = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set_attribute(self, key: str, value):
+        if self.sampled and value is not None:
+            self.attributes[key] = value
+
+    def record_error(self, error: BaseException):
+        if not self.sampled:
+            return
+        self.status = {"code": _STATUS_ERROR, "message": str(error)[:300]}
+        self.events.append({
+            "timeUnixNano": str(time.time_ns()),
+            "name": "exception",
+            "attributes": _attributes({"exception.type": type(error).__name__,
+                                       "exception.message": str(error)[:300]}),
+        })
+
+    def to_otlp(self) -> dict:
+        data = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": _attributes(self.attributes),
+        }
+        if self.parent_id:
+            data["parentSpanId"] = self.parent_id
+        if self.events:
+            data["events"] = self.events
+        if self.status:
+            data["status"] = self.status
+        return data
+
+
+def _attributes(values: dict) -> list:
+    result = []
+    for key, value in values.items():
+        if isinstance(value, bool):
+            encoded = {"boolValue": value}
+        elif isinstance(value, int):
+            encoded = {"intValue": str(value)}
+        elif isinstance(value, float):
+            encoded = {"doubleValue": value}
+        else:
+            encoded = {"stringValue": str(value)}
+        result.append({"key": key, "value": encoded})
+    return result
+
+
+def _new_id(nbytes: int) -> str:
+    return f"{random.getrandbits(nbytes * 8):0{nbytes * 2}x}"
+
+
+def parse_traceparent(header: str):
+    """(trace_id, parent_span_id, sampled) dari header traceparent W3C, atau None jika tidak valid."""
+    parts = (header or "").strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    trace_id, parent_id, flags = parts[1].lower(), parts[2].lower(), parts[3]
+    try:
+        int(trace_id, 16)
+        int(parent_id, 16)
+        sampled = bool(int(flags, 16) & 1)
+    except ValueError:
+        return None
+    if trace_id == "0" * 32 or parent_id == "0" * 16:
+        return None
+    return trace_id, parent_id, sampled
+
+
+class _Exporter:
+    """Mengirim span yang sudah selesai per batch dari thread background."""
+
+    def __init__(self, path: str, endpoint: str):
+        self.path = path
+        self.endpoint = endpoint
+        self._queue = queue.Queue(maxsize=_MAX_QUEUE)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.stats = {"exported": 0, "dropped": 0, "export_errors": 0}
+
+    def submit(self, span: Span):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + _EXPORT_INTERVAL_S
+            while len(batch) < _EXPORT_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.export(batch)
+
+    def flush(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self.export(batch)
+
+    def export(self, spans: list):
+        payload = json.dumps({
+            "resourceSpans": [{
+                "resource": {"attributes": _attributes({"service.name": TRACE_SERVICE_NAME,
+                                                        "process.pid": os.getpid()})},
+                "scopeSpans": [{"scope": {"name": "app.tracing"}, "spans": [s.to_otlp() for s in spans]}],
+            }],
+        }, ensure_ascii=False)
+        try:
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(payload + "\n")
+            if self.endpoint:
+                request = urllib.request.Request(self.endpoint, data=payload.encode("utf-8"), method="POST",
+                                                 headers={"Content-Type": "application/json"})
+                urllib.request.urlopen(request, timeout=5).close()
+            self.stats["exported"] += len(spans)
+        except Exception as e:
+            self.stats["export_errors"] += 1
+            print(f"[WARN] Gagal mengekspor {len(spans)} span: {e}")
+
+
+_exporter = _Exporter(TRACE_FILE, OTLP_ENDPOINT) if (TRACE_FILE or OTLP_ENDPOINT) else None
+
+# Span aktif pada task/thread saat ini
+_current = contextvars.ContextVar("trace_span", default=None)
+
+# Span pengganti saat tracing nonaktif; atributnya tidak pernah disimpan
+_NOOP = Span("0" * 32, "0" * 16, None, "", KIND_INTERNAL, False)
+
+
+def enabled() -> bool:
+    return _exporter is not None
+
+
+def current_span():
+    return _current.get()
+
+
+def start_span(name: str, kind: int = KIND_INTERNAL, parent: str = None, **attributes) -> Span:
+    """
+    Mulai span sebagai anak span aktif. `parent` berupa header traceparent untuk memulai dari
+    konteks milik proses lain (mis. frontend); tanpa keduanya dibuat trace baru.
+    """
+    if _exporter is None:
+        return _NOOP
+    remote = parse_traceparent(parent) if parent else None
+    current = _current.get()
+    if remote is not None:
+        trace_id, parent_id, sampled = remote
+    elif current is not None and current is not _NOOP:
+        trace_id, parent_id, sampled = current.trace_id, current.span_id, current.sampled
+    else:
+        trace_id, parent_id, sampled = _new_id(16), None, random.random() < TRACE_SAMPLE_RATIO
+    span = Span(trace_id, _new_id(8), parent_id, name, kind, sampled)
+    for key, value in attributes.items():
+        span.set_attribute(key, value)
+    return span
+
+
+def end_span(span: Span, error: BaseException = None):
+    if span is _NOOP:
+        return
+    if error is not None:
+        span.record_error(error)
+    span.end_ns = time.time_ns()
+    if span.sampled:
+        _exporter.submit(span)
+
+
+@contextmanager
+def span(name: str, kind: int = KIND_INTERNAL, parent: str = None, **attributes):
+    """Context manager span; span menjadi span aktif untuk kode di dalamnya."""
+    if _exporter is None:
+        yield _NOOP
+        return
+    current = start_span(name, kind, parent, **attributes)
+    token = _current.set(current)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _current.reset(token)
+        end_span(current, error)
+
+
+def child_env(env: dict = None):
+    """Env untuk subprocess dengan TRACEPARENT span aktif (konvensi propagasi env OTel)."""
+    current = _current.get()
+    if current is None or current is _NOOP:
+        return env
+    env = dict(os.environ if env is None else env)
+    env["TRACEPARENT"] = current.traceparent
+    return env
+
+
+def shutdown():
+    if _exporter is not None:
+        _exporter.flush()
+
+
+def tracing_stats() -> dict:
+    if _exporter is None:
+        return {"enabled": False}
+    return {"enabled": True, **_exporter.stats, "pending": _exporter._queue.qsize()}
+
+
+class TracingMiddleware:
+    """Span SERVER per permintaan HTTP, melanjutkan trace dari header traceparent klien."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if _exporter is None or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        parent = headers.get(b"traceparent", b"").decode("latin-1") or None
+        method = scope.get("method", "")
+        with span(f"{method} {scope['path']}", KIND_SERVER, parent,
+                  **{"http.request.method": method, "url.path": scope["path"]}) as server_span:
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    server_span.set_attribute("http.response.status_code", message["status"])
+                    # Trace ID dikembalikan agar klien bisa mencocokkan log-nya dengan trace server
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [
+                        (b"traceparent", server_span.traceparent.encode("latin-1"))]
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
@@ -1,7 +1,17 @@
+import io
 import os
-import uuid
-import tempfile
 import subprocess
+import numpy as np
+import scipy.io.wavfile
+
+from app.deadline import Deadline, RequestCancelled, run_subprocess
+from app.g2p import text_to_ipa
+from app.text_frontend import split_chunks
+from app.workers import TTS_POOL
+from app.scheduler import scheduler
+from app.scratch import scratch
+from app.speakers import DEFAULT_SPEAKER, speaker_table
+from app.tts_batcher import TTS_BATCHING, TTSBatcher, wait_result
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -16,73 +26,278 @@ COQUI_MODEL_PATH = os.path.join(COQUI_DIR, "checkpoint_1260000-inference.pth")
 # File config.json harus berada di dalam folder coqui_utils/
 COQUI_CONFIG_PATH = os.path.join(COQUI_DIR, "config.json")
 
-# TODO: Tentukan nama speaker yang digunakan
-# Pilih nama speaker yang sesuai dengan isi file speakers.pth (misalnya: "wibowo")
-COQUI_SPEAKER = "wibowo"
+# Speaker default (env COQUI_SPEAKER); tiap permintaan bisa memilih speaker lain dari speakers.pth
+COQUI_SPEAKER = DEFAULT_SPEAKER
+
+# Panjang crossfade saat menyambung audio hasil sintesis per kalimat
+TTS_CROSSFADE_MS = float(os.getenv("TTS_CROSSFADE_MS", "30"))
+
+# Sintesis paralel pada engine CLI. Tiap proses `tts` memuat ulang model dan speakers.pth, jadi
+# "auto" hanya memecah balasan menjadi sebanyak mungkin grup potongan berurutan sesuai worker TTS
+# yang sedang menganggur (satu proses per grup); "1" = selalu satu proses per potongan, "0" = selalu
+# satu proses per balasan. Engine in-process (TTS_BATCHING=1) selalu menyintesis per potongan.
+TTS_CLI_PARALLEL_CHUNKS = os.getenv("TTS_CLI_PARALLEL_CHUNKS", "auto")
 
-def transcribe_text_to_speech(text: str) -> str:
+# Engine in-process dengan batching lintas permintaan (TTS_BATCHING=1)
+_batcher = TTSBatcher(
+    os.path.abspath(COQUI_MODEL_PATH), os.path.abspath(COQUI_CONFIG_PATH), COQUI_DIR
+) if TTS_BATCHING else None
+
+def transcribe_text_to_speech(text: str, deadline: Deadline = None, phonemize: bool = True,
+                              parallel: bool = True, speaker: str = None) -> str:
     """
     Fungsi untuk mengonversi teks menjadi suara menggunakan TTS engine yang ditentukan.
+    Teks dipecah per kalimat/frasa dan dikelompokkan dengan group_chunks(); tiap grup disintesis
+    paralel lalu hasilnya disambung dengan crossfade pendek.
     Args:
         text (str): Teks yang akan diubah menjadi suara.
+        deadline (Deadline): Tenggat/token pembatalan; proses TTS dihentikan jika dibatalkan
+        phonemize (bool): Konversi teks biasa ke IPA dengan app.g2p; False jika text sudah berupa IPA
+        parallel (bool): Sintesis potongan secara paralel di TTS_POOL
+        speaker (str): Nama speaker dari speakers.pth; None untuk speaker default
     Returns:
-        str: Path ke file audio hasil konversi.
+        str: Path ke file audio hasil konversi di scratch store; pemanggil memegang satu
+            referensi dan wajib melepasnya dengan scratch.release() setelah file dipakai.
+    """
+    speaker = speaker_table.resolve(speaker)
+    chunks = split_for_tts(text, phonemize)
+    if not chunks:
+        return "[ERROR] Teks tidak berisi kata yang bisa diucapkan"
+    if _batcher is not None:
+        return _tts_with_batcher(chunks, speaker, deadline)
+
+    # Jika sudah berjalan di dalam job TTS_POOL (misalnya item batch), seluruh teks disintesis
+    # satu proses agar tidak menunggu slot pool yang sedang dipakai sendiri
+    groups = group_chunks(chunks, parallel and not TTS_POOL.in_worker())
+    if len(groups) == 1:
+        return _tts_with_coqui(groups[0], speaker, deadline)
+
+    futures = [TTS_POOL.submit(_tts_with_coqui, group, speaker, deadline) for group in groups]
+    paths = []
+    try:
+        for future in futures:
+            paths.append(future.result())
+    except BaseException:
+        # Grup yang masih antre dibatalkan; yang sedang berjalan dilepas dari scratch
+        # store begitu selesai agar file-nya tidak menunggu sweeper
+        for future in futures:
+            if not future.cancel():
+                future.add_done_callback(_release_result)
+        raise
+
+    errors = [path for path in paths if path.startswith("[ERROR]")]
+    if errors:
+        _remove_files(paths)
+        return errors[0]
+
+    output_path = scratch.new_path(".wav", prefix="tts_")
+    try:
+        _concat_with_crossfade(paths, output_path, TTS_CROSSFADE_MS)
+        scratch.commit(output_path)
+    except BaseException:
+        scratch.release(output_path)
+        raise
+    finally:
+        _remove_files(paths)
+    print(f"TTS output file created from {len(paths)} chunks: {output_path}")
+    return output_path
+
+def split_for_tts(text: str, phonemize: bool = True) -> list:
+    """
+    Konversi teks ke IPA (opsional) lalu pecah menjadi potongan kalimat untuk disintesis.
+    Potongan tanpa huruf (hanya tanda baca/emoji) dibuang, sehingga hasilnya bisa kosong.
+    """
+    if phonemize:
+        text = text_to_ipa(text)
+    return [chunk for chunk in split_chunks(text) if any(c.isalpha() for c in chunk)]
+
+def group_chunks(chunks: list, parallel: bool = True) -> list:
+    """
+    Kelompokkan potongan dari split_for_tts() menjadi unit sintesis. Engine in-process memakai
+    potongan apa adanya. Engine CLI menggabungkan potongan berurutan menjadi paling banyak
+    sejumlah worker TTS yang sedang menganggur (lihat TTS_CLI_PARALLEL_CHUNKS), dengan panjang
+    teks per grup kira-kira sama; tanpa worker menganggur seluruh teks menjadi satu grup.
+    """
+    if _batcher is not None or not chunks:
+        return list(chunks)
+    if not parallel or TTS_CLI_PARALLEL_CHUNKS == "0":
+        count = 1
+    elif TTS_CLI_PARALLEL_CHUNKS == "1":
+        count = len(chunks)
+    else:
+        count = TTS_POOL.size - TTS_POOL.queue_depth()
+    count = max(1, min(count, len(chunks)))
+    if count == len(chunks):
+        return list(chunks)
+
+    total = sum(len(chunk) for chunk in chunks)
+    groups, current, done = [], [], 0
+    for index, chunk in enumerate(chunks):
+        current.append(chunk)
+        done += len(chunk)
+        groups_left = count - len(groups) - 1
+        # Tutup grup saat porsi karakternya tercapai, atau jika sisa potongan pas untuk sisa grup
+        if groups_left and (done >= total * (len(groups) + 1) / count or len(chunks) - index - 1 == groups_left):
+            groups.append(" ".join(current))
+            current = []
+    groups.append(" ".join(current))
+    return groups
+
+def synthesize_chunk(chunk: str, speaker: str, deadline: Deadline = None) -> bytes:
+    """
+    Sintesis satu unit hasil group_chunks() dan kembalikan isi file WAV-nya, untuk
+    pemanggil yang mengirim audio per potongan (mis. sesi duplex di app.session).
+    Raises:
+        RuntimeError: jika sintesis gagal
     """
-    path = _tts_with_coqui(text)
-    return path
+    if _batcher is not None:
+        waveform = _batcher.synthesize(chunk, speaker, deadline)
+        buffer = io.BytesIO()
+        _write_wav(buffer, _batcher.sample_rate, waveform)
+        return buffer.getvalue()
+
+    path = _tts_with_coqui(chunk, speaker, deadline)
+    if path.startswith("[ERROR]"):
+        raise RuntimeError(path)
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        scratch.release(path)
+
+def warm_up_tts():
+    """Muat model TTS in-process lebih awal agar giliran pertama tidak menunggu pemuatan model."""
+    if _batcher is not None:
+        _batcher.warm_up()
+
+def _remove_files(paths):
+    scratch.release_all(path for path in paths if path and not path.startswith("[ERROR]"))
+
+def _release_result(future):
+    if not future.cancelled() and future.exception() is None:
+        _remove_files([future.result()])
+
+def _to_float(data: np.ndarray) -> np.ndarray:
+    if data.ndim > 1:
+        data = data.mean(axis=1)
+    if np.issubdtype(data.dtype, np.integer):
+        return data.astype(np.float32) / np.iinfo(data.dtype).max
+    return data.astype(np.float32)
+
+def _write_wav(path: str, rate: int, waveform: np.ndarray):
+    scipy.io.wavfile.write(path, rate, (np.clip(waveform, -1.0, 1.0) * 32767).astype(np.int16))
+
+def _crossfade(pieces: list, rate: int, crossfade_ms: float) -> np.ndarray:
+    """Sambung beberapa waveform float32 dengan crossfade linear."""
+    fade = int(rate * crossfade_ms / 1000)
+    # Overlap dibatasi setengah potongan terpendek agar potongan pendek tidak tertelan
+    overlaps = [0] + [min(fade, len(prev) // 2, len(cur) // 2) for prev, cur in zip(pieces, pieces[1:])]
+    out = np.zeros(sum(len(p) for p in pieces) - sum(overlaps), dtype=np.float32)
+
+    pos = 0
+    for piece, overlap in zip(pieces, overlaps):
+        start = pos - overlap
+        if overlap:
+            ramp = np.linspace(0.0, 1.0, overlap, dtype=np.float32)
+            out[start:pos] *= 1.0 - ramp
+            piece = piece.copy()
+            piece[:overlap] *= ramp
+        out[start:start + len(piece)] += piece
+        pos = start + len(piece)
+    return out
+
+def _concat_with_crossfade(paths: list, output_path: str, crossfade_ms: float):
+    """Sambung beberapa file WAV dengan crossfade linear, lalu tulis sebagai WAV 16-bit."""
+    rate = None
+    pieces = []
+    for path in paths:
+        sr, data = scipy.io.wavfile.read(path)
+        if rate is None:
+            rate = sr
+        elif sr != rate:
+            raise ValueError(f"Sample rate potongan TTS berbeda: {sr} != {rate}")
+        pieces.append(_to_float(data))
+    _write_wav(output_path, rate, _crossfade(pieces, rate, crossfade_ms))
+
+# === ENGINE 2: Coqui in-process dengan batching ===
+def _tts_with_batcher(chunks: list, speaker: str, deadline: Deadline = None) -> str:
+    # Semua potongan masuk antrean sekaligus sehingga bisa ikut satu forward pass,
+    # bersama potongan dari permintaan lain yang datang dalam jendela batch yang sama
+    futures = [_batcher.submit(chunk, speaker, deadline) for chunk in chunks]
+    try:
+        pieces = [wait_result(future, deadline) for future in futures]
+    except RequestCancelled:
+        for future in futures:
+            future.cancel()
+        raise
+    except Exception as e:
+        print(f"[ERROR] TTS batcher failed: {e}")
+        return "[ERROR] Failed to synthesize speech"
+
+    output_path = scratch.new_path(".wav", prefix="tts_")
+    try:
+        _write_wav(output_path, _batcher.sample_rate, _crossfade(pieces, _batcher.sample_rate, TTS_CROSSFADE_MS))
+    except BaseException:
+        scratch.release(output_path)
+        raise
+    scratch.commit(output_path)
+    print(f"TTS output file created from {len(pieces)} batched chunks: {output_path}")
+    return output_path
+
+def tts_batcher_stats():
+    """Statistik utilisasi batcher, atau None jika batching tidak aktif."""
+    return _batcher.stats() if _batcher is not None else None
 
 # === ENGINE 1: Coqui TTS ===
-def _tts_with_coqui(text: str) -> str:
-    tmp_dir = tempfile.gettempdir()
-    output_path = os.path.join(tmp_dir, f"tts_{uuid.uuid4()}.wav")
+def _tts_with_coqui(text: str, speaker: str = COQUI_SPEAKER, deadline: Deadline = None) -> str:
+    output_path = scratch.new_path(".wav", prefix="tts_")
     
     # Dapatkan path absolut untuk semua file
     abs_model_path = os.path.abspath(COQUI_MODEL_PATH)
     abs_config_path = os.path.abspath(COQUI_CONFIG_PATH)
     abs_output_path = os.path.abspath(output_path)
     
-    # Jalankan TTS dari direktori yang berisi speakers.pth
-    current_dir = os.getcwd()
+    # jalankan Coqui TTS dengan subprocess
+    cmd = [
+        "tts",
+        "--text", text,
+        "--model_path", abs_model_path,
+        "--config_path", abs_config_path,
+        "--speaker_idx", speaker,
+        "--out_path", abs_output_path
+    ]
+    
+    # TTS dijalankan dari direktori yang berisi speakers.pth. Dipakai argumen cwd,
+    # bukan os.chdir(), karena beberapa sintesis bisa berjalan paralel di thread berbeda
+    print(f"Running TTS command from directory: {COQUI_DIR}")
+    print(f"Command: {' '.join(cmd)}")
     
     try:
-        # Pindah ke direktori coqui_utils
-        os.chdir(COQUI_DIR)
-        
-        # jalankan Coqui TTS dengan subprocess
-        cmd = [
-            "tts",
-            "--text", text,
-            "--model_path", abs_model_path,
-            "--config_path", abs_config_path,
-            "--speaker_idx", COQUI_SPEAKER,
-            "--out_path", abs_output_path
-        ]
+        result = run_subprocess(cmd, deadline, check=True, capture_output=True, text=True, cwd=COQUI_DIR,
+                                env=scheduler.tts_env(), cpus=scheduler.tts_affinity())
+        if result.stdout:
+            print(f"TTS stdout: {result.stdout}")
+        if result.stderr:
+            print(f"TTS stderr: {result.stderr}")
+    except RequestCancelled:
+        # Buang file setengah jadi dari proses yang dihentikan
+        scratch.release(output_path)
+        raise
+    except subprocess.CalledProcessError as e:
+        print(f"[ERROR] TTS subprocess failed: {e}")
+        if e.stdout:
+            print(f"TTS stdout: {e.stdout}")
+        if e.stderr:
+            print(f"TTS stderr: {e.stderr}")
+        scratch.release(output_path)
+        return "[ERROR] Failed to synthesize speech"
         
-        print(f"Running TTS command from directory: {os.getcwd()}")
-        print(f"Command: {' '.join(cmd)}")
-        
-        try:
-            result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-            if result.stdout:
-                print(f"TTS stdout: {result.stdout}")
-            if result.stderr:
-                print(f"TTS stderr: {result.stderr}")
-        except subprocess.CalledProcessError as e:
-            print(f"[ERROR] TTS subprocess failed: {e}")
-            if e.stdout:
-                print(f"TTS stdout: {e.stdout}")
-            if e.stderr:
-                print(f"TTS stderr: {e.stderr}")
-            return "[ERROR] Failed to synthesize speech"
-            
-        # Verifikasi file output
-        if os.path.exists(abs_output_path):
-            print(f"TTS output file created successfully: {abs_output_path}")
-            return abs_output_path
-        else:
-            print(f"TTS output file not found at: {abs_output_path}")
-            return "[ERROR] TTS output file not found"
-            
-    finally:
-        # Kembali ke direktori asal
-        os.chdir(current_dir)
\ No newline at end of file
+    # Verifikasi file output
+    if os.path.exists(abs_output_path):
+        scratch.commit(output_path)
+        print(f"TTS output file created successfully: {abs_output_path}")
+        return abs_output_path
+    else:
+        print(f"TTS output file not found at: {abs_output_path}")
+        scratch.release(output_path)
+        return "[ERROR] TTS output file not found"
\ No newline at end of file
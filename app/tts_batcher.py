@@ -0,0 +1,275 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future, InvalidStateError, TimeoutError as FutureTimeoutError
+
+from app.deadline import Deadline, RequestCancelled
+from app.scheduler import scheduler
+from app.speakers import speaker_table
+from app import tracing
+
+# Aktifkan sintesis in-process dengan batching (default: CLI `tts` per permintaan)
+TTS_BATCHING = os.getenv("TTS_BATCHING", "0") == "1"
+
+# Jumlah teks maksimum per forward pass dan lama menunggu teks lain sebelum batch dijalankan
+TTS_BATCH_MAX_SIZE = int(os.getenv("TTS_BATCH_MAX_SIZE", "8"))
+TTS_BATCH_MAX_WAIT_MS = float(os.getenv("TTS_BATCH_MAX_WAIT_MS", "20"))
+
+# Interval pengecekan pembatalan saat menunggu hasil batch
+_POLL_INTERVAL_S = 0.1
+
+
+class _Pending:
+    def __init__(self, text: str, speaker: str, deadline: Deadline):
+        self.text = text
+        self.speaker = speaker
+        self.deadline = deadline
+        self.speaker_id = None
+        self.future = Future()
+        self.enqueued = time.monotonic()
+        # Span dibuat di thread pemanggil; batch dijalankan di thread batcher tanpa konteksnya
+        self.parent_span = tracing.current_span()
+        self.queue_span = tracing.start_span("tts_batcher.queue")
+
+
+class TTSBatcher:
+    """
+    Mengumpulkan teks dari beberapa permintaan (atau potongan kalimat) dalam jendela waktu
+    singkat, lalu menyintesis semuanya dalam satu forward pass model VITS. Padding dipotong
+    kembali per item memakai panjang output (y_mask) dari model.
+    """
+
+    def __init__(self, model_path: str, config_path: str, model_dir: str,
+                 max_batch_size: int = TTS_BATCH_MAX_SIZE, max_wait_ms: float = TTS_BATCH_MAX_WAIT_MS):
+        self.model_path = model_path
+        self.config_path = config_path
+        self.model_dir = model_dir
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_s = max_wait_ms / 1000.0
+        self.sample_rate = None
+        self._model = None
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._stats = {
+            "batches": 0,
+            "items": 0,
+            "cancelled": 0,
+            "failed_batches": 0,
+            "busy_s": 0.0,
+            "queue_wait_s": 0.0,
+            "max_batch_seen": 0,
+        }
+
+    # === Model ===
+
+    def _load_model(self):
+        import torch
+        from TTS.tts.configs.vits_config import VitsConfig
+        from TTS.tts.models.vits import Vits
+
+        config = VitsConfig()
+        config.load_json(self.config_path)
+        # Path speakers.pth / d-vector di config relatif terhadap folder model
+        for section in (config, config.model_args):
+            for key in ("speakers_file", "d_vector_file"):
+                value = getattr(section, key, None)
+                if isinstance(value, str) and value and not os.path.isabs(value):
+                    setattr(section, key, os.path.join(self.model_dir, value))
+                elif isinstance(value, list):
+                    setattr(section, key, [path if os.path.isabs(path) else os.path.join(self.model_dir, path)
+                                           for path in value])
+
+        model = Vits.init_from_config(config)
+        model.load_checkpoint(config, checkpoint_path=self.model_path, eval=True)
+        self._torch = torch
+        self._hop_length = config.audio.hop_length
+        self.sample_rate = config.audio.sample_rate
+        self._model = model
+        speaker_table.load()
+        print(f"TTS batcher: model loaded ({self.sample_rate} Hz)")
+
+    def _infer(self, batch: list) -> list:
+        torch = self._torch
+        model = self._model
+        # Jumlah thread intra-op mengikuti porsi core TTS dari scheduler saat ini
+        threads = scheduler.tts_threads(batched=True)
+        if threads and threads != torch.get_num_threads():
+            torch.set_num_threads(threads)
+        ids = [model.tokenizer.text_to_ids(item.text) for item in batch]
+        lengths = torch.tensor([len(seq) for seq in ids], dtype=torch.long)
+        x = torch.zeros(len(ids), int(lengths.max()), dtype=torch.long)
+        for row, seq in enumerate(ids):
+            x[row, :len(seq)] = torch.tensor(seq, dtype=torch.long)
+        aux_input = {"x_lengths": lengths}
+        speaker_ids = [item.speaker_id for item in batch]
+        if speaker_table.embeddings is not None:
+            # Model d-vector: embedding diambil dari tabel speaker bersama
+            aux_input["d_vectors"] = torch.from_numpy(speaker_table.embeddings[speaker_ids])
+        elif speaker_ids[0] is not None:
+            aux_input["speaker_ids"] = torch.tensor(speaker_ids, dtype=torch.long)
+        elif getattr(model, "num_speakers", 0) > 1:
+            # speakers.pth tidak tersedia: pakai speaker pertama model sebagai default
+            aux_input["speaker_ids"] = torch.zeros(len(batch), dtype=torch.long)
+
+        with torch.inference_mode():
+            outputs = model.inference(x, aux_input=aux_input)
+
+        # y_mask menandai frame valid per item; sisanya adalah padding batch
+        frames = outputs["y_mask"].sum(dim=(1, 2)).long().tolist()
+        waveforms = outputs["model_outputs"][:, 0, :]
+        return [waveforms[row, :frames[row] * self._hop_length].cpu().numpy() for row in range(len(batch))]
+
+    # === Antrean ===
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="tts-batcher", daemon=True)
+                self._thread.start()
+
+    def warm_up(self):
+        """Mulai thread batcher (dan muat model) tanpa menunggu teks pertama."""
+        self._ensure_started()
+
+    def submit(self, text: str, speaker: str, deadline: Deadline = None) -> Future:
+        """Masukkan teks ke antrean batch. Future berisi waveform float32 (numpy)."""
+        self._ensure_started()
+        pending = _Pending(text, speaker, deadline)
+        self._queue.put(pending)
+        return pending.future
+
+    def synthesize(self, text: str, speaker: str, deadline: Deadline = None):
+        """Sintesis satu teks dan tunggu hasilnya; berhenti menunggu jika permintaan dibatalkan."""
+        return wait_result(self.submit(text, speaker, deadline), deadline)
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        until = time.monotonic() + self.max_wait_s
+        while len(batch) < self.max_batch_size:
+            remaining = until - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        try:
+            self._load_model()
+        except Exception as e:
+            print(f"[ERROR] TTS batcher gagal memuat model: {e}")
+            while True:
+                item = self._queue.get()
+                if item.future.set_running_or_notify_cancel():
+                    item.future.set_exception(e)
+
+        while True:
+            batch = []
+            try:
+                batch = self._collect()
+                self._process(batch)
+            except Exception as e:
+                # Kesalahan tak terduga hanya menggagalkan batch ini; thread batcher tetap hidup
+                # agar permintaan berikutnya tidak menggantung sampai tenggatnya habis
+                print(f"[ERROR] TTS batcher: batch gagal diproses: {e}")
+                self._count("failed_batches")
+                for item in batch:
+                    _fail(item, e)
+
+    def _process(self, batch: list):
+        live = []
+        for item in batch:
+            # Item yang Future-nya sudah di-cancel pemanggil, atau permintaannya sudah
+            # dibatalkan, tidak ikut dihitung dalam forward pass
+            if not item.future.set_running_or_notify_cancel():
+                self._count("cancelled")
+                item.queue_span.set_attribute("tts.cancelled", True)
+            elif item.deadline is not None and item.deadline.cancelled:
+                item.future.set_exception(RequestCancelled(item.deadline.reason))
+                self._count("cancelled")
+                item.queue_span.set_attribute("tts.cancelled", True)
+            elif speaker_table.ids and item.speaker not in speaker_table.ids:
+                item.future.set_exception(ValueError(f"Speaker tidak dikenal: {item.speaker}"))
+            else:
+                # Baris tabel speaker: id speaker atau indeks embedding d-vector. Tanpa
+                # speakers.pth tetap None dan model memakai speaker default-nya
+                item.speaker_id = speaker_table.speaker_id(item.speaker) if speaker_table.ids else None
+                live.append(item)
+            tracing.end_span(item.queue_span)
+        if not live:
+            return
+
+        started = time.monotonic()
+        # Satu forward pass dipakai bersama; tiap permintaan mendapat span-nya sendiri
+        spans = [tracing.start_span("tts_batcher.infer",
+                                    parent=item.parent_span.traceparent if item.parent_span else None,
+                                    **{"tts.batch_size": len(live), "tts.chars": len(item.text)})
+                 for item in live]
+        try:
+            waveforms = self._infer(live)
+        except Exception as e:
+            print(f"[ERROR] TTS batch inference failed: {e}")
+            self._count("failed_batches")
+            for item, span in zip(live, spans):
+                tracing.end_span(span, e)
+                _fail(item, e)
+            return
+        finished = time.monotonic()
+
+        for item, waveform, span in zip(live, waveforms, spans):
+            tracing.end_span(span)
+            item.future.set_result(waveform)
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["items"] += len(live)
+            self._stats["busy_s"] += finished - started
+            self._stats["queue_wait_s"] += sum(started - item.enqueued for item in live)
+            self._stats["max_batch_seen"] = max(self._stats["max_batch_seen"], len(live))
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self._stats[key] += n
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        elapsed = max(1e-9, time.monotonic() - self._started)
+        batches = max(1, stats["batches"])
+        items = max(1, stats["items"])
+        return {
+            **stats,
+            "busy_s": round(stats["busy_s"], 3),
+            "queue_wait_s": round(stats["queue_wait_s"], 3),
+            "pending": self._queue.qsize(),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_s * 1000,
+            "avg_batch_size": round(stats["items"] / batches, 3),
+            "avg_queue_wait_ms": round(stats["queue_wait_s"] / items * 1000, 3),
+            "utilization": round(stats["busy_s"] / elapsed, 4),
+        }
+
+
+def _fail(item: _Pending, error: BaseException):
+    # Future bisa sudah selesai atau di-cancel pemanggil; abaikan jika demikian
+    try:
+        if not item.future.done():
+            item.future.set_exception(error)
+    except InvalidStateError:
+        pass
+
+
+def wait_result(future: Future, deadline: Deadline = None):
+    """Tunggu Future dari batcher sambil memantau pembatalan permintaan."""
+    while True:
+        if deadline is not None and deadline.cancelled:
+            future.cancel()
+            raise RequestCancelled(deadline.reason)
+        try:
+            return future.result(timeout=_POLL_INTERVAL_S)
+        except FutureTimeoutError:
+            continue
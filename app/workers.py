@@ -0,0 +1,111 @@
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from app import tracing
+
+_CPU_COUNT = os.cpu_count() or 2
+
+# Jumlah job whisper dan TTS yang boleh berjalan bersamaan
+STT_WORKERS = int(os.getenv("STT_WORKERS", str(max(1, _CPU_COUNT // 4))))
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", str(max(1, _CPU_COUNT // 2))))
+
+
+class WorkerPool:
+    """
+    Pool thread untuk job engine (whisper/TTS). Job yang melebihi kapasitas menunggu
+    di antrean pool; job yang dibatalkan sebelum mulai tidak akan dijalankan.
+    """
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = max(1, size)
+        self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix=f"{name}-worker")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._completed = 0
+        self._failed = 0
+        self._busy_s = 0.0
+        self._started = time.monotonic()
+        self._local = threading.local()
+
+    def in_worker(self) -> bool:
+        """True jika dipanggil dari dalam job pool ini (untuk menghindari submit bersarang)."""
+        return getattr(self._local, "active", False)
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        with self._lock:
+            self._queued += 1
+        # Waktu antre dan eksekusi job dicatat sebagai span anak dari span pemanggil
+        queue_span = tracing.start_span(f"{self.name}.queue", **{"worker.pool": self.name})
+
+        def job():
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+            tracing.end_span(queue_span)
+            started = time.monotonic()
+            ok = False
+            self._local.active = True
+            try:
+                with tracing.span(f"{self.name}.job", **{"worker.pool": self.name,
+                                                         "code.function": getattr(fn, "__name__", "")}):
+                    result = fn(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                self._local.active = False
+                with self._lock:
+                    self._active -= 1
+                    self._busy_s += time.monotonic() - started
+                    if ok:
+                        self._completed += 1
+                    else:
+                        self._failed += 1
+
+        # Konteks (termasuk span aktif) pemanggil ikut dibawa ke thread worker
+        future = self._executor.submit(contextvars.copy_context().run, job)
+        # Job yang dibatalkan saat masih antre tidak pernah masuk ke job()
+        future.add_done_callback(lambda f: self._on_done(f, queue_span))
+        return future
+
+    def _on_done(self, future: Future, queue_span):
+        if future.cancelled():
+            with self._lock:
+                self._queued -= 1
+            queue_span.set_attribute("worker.cancelled", True)
+            tracing.end_span(queue_span)
+
+    async def run(self, fn, *args, **kwargs):
+        """Jalankan job di pool dan tunggu hasilnya dari event loop."""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def queue_depth(self) -> int:
+        """Jumlah job yang sedang antre ditambah yang sedang berjalan."""
+        with self._lock:
+            return self._queued + self._active
+
+    def stats(self) -> dict:
+        with self._lock:
+            elapsed = max(1e-9, time.monotonic() - self._started)
+            return {
+                "size": self.size,
+                "queued": self._queued,
+                "active": self._active,
+                "completed": self._completed,
+                "failed": self._failed,
+                "busy_s": round(self._busy_s, 3),
+                "utilization": round(self._busy_s / (elapsed * self.size), 4),
+            }
+
+
+STT_POOL = WorkerPool("stt", STT_WORKERS)
+TTS_POOL = WorkerPool("tts", TTS_WORKERS)
+
+
+def pool_stats() -> dict:
+    return {"stt": STT_POOL.stats(), "tts": TTS_POOL.stats()}
@@ -1,5 +1,8 @@
+import io
 import os
+import secrets
 import tempfile
+import threading
 import requests
 import gradio as gr
 import scipy.io.wavfile
@@ -15,7 +18,85 @@ logger = logging.getLogger('voice_chatbot_frontend')
 # Path to store chat history
 HISTORY_PATH = os.path.join(tempfile.gettempdir(), "voice_chat_history.json")
 API_URL = "http://localhost:8000/voice-chat"
+SPEAKERS_URL = "http://localhost:8000/speakers"
 REQUEST_TIMEOUT = 60  # Increased timeout to 60 seconds
+DEFAULT_SPEAKER = "wibowo"
+# Gradio's own cache (recordings and returned audio) is swept periodically; older files are deleted
+GRADIO_CACHE_SWEEP_S = int(os.getenv("GRADIO_CACHE_SWEEP_S", "600"))
+GRADIO_CACHE_MAX_AGE_S = int(os.getenv("GRADIO_CACHE_MAX_AGE_S", "1800"))
+# Request tracing: spans are exported as OTLP/JSON (same format as the API) when either is set
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+OTLP_ENDPOINT = os.getenv("OTLP_ENDPOINT", "")
+
+# Spans of one voice request; the trace id is created here and sent to the API as a W3C traceparent
+class Trace:
+    INTERNAL, CLIENT = 1, 3
+
+    def __init__(self):
+        self.trace_id = secrets.token_hex(16)
+        self.spans = []
+
+    def start(self, name, parent=None, kind=INTERNAL):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": secrets.token_hex(8),
+            "name": name,
+            "kind": kind,
+            "startTimeUnixNano": str(time.time_ns()),
+            "attributes": [],
+        }
+        if parent is not None:
+            span["parentSpanId"] = parent["spanId"]
+        self.spans.append(span)
+        return span
+
+    def end(self, span, error=None, **attributes):
+        span["endTimeUnixNano"] = str(time.time_ns())
+        for key, value in attributes.items():
+            if isinstance(value, bool):
+                encoded = {"boolValue": value}
+            elif isinstance(value, int):
+                encoded = {"intValue": str(value)}
+            else:
+                encoded = {"stringValue": str(value)}
+            span["attributes"].append({"key": key, "value": encoded})
+        if error:
+            span["status"] = {"code": 2, "message": str(error)[:300]}
+
+    def traceparent(self, span):
+        return f"00-{self.trace_id}-{span['spanId']}-01"
+
+    def export(self):
+        if not (TRACE_FILE or OTLP_ENDPOINT):
+            return
+        spans = [s for s in self.spans if "endTimeUnixNano" in s]
+        payload = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "voice-chatbot-frontend"}}]},
+            "scopeSpans": [{"scope": {"name": "gradio_app"}, "spans": spans}],
+        }]})
+        # Export off the request path so a slow collector never delays the UI
+        threading.Thread(target=_export_trace, args=(payload,), daemon=True).start()
+
+def _export_trace(payload):
+    try:
+        if TRACE_FILE:
+            with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                f.write(payload + "\n")
+        if OTLP_ENDPOINT:
+            requests.post(OTLP_ENDPOINT, data=payload, headers={"Content-Type": "application/json"}, timeout=5)
+    except Exception as e:
+        logger.warning(f"Failed to export trace: {e}")
+
+# Fetch the selectable TTS voices from the backend
+def fetch_speakers():
+    try:
+        response = requests.get(SPEAKERS_URL, timeout=5)
+        response.raise_for_status()
+        data = response.json()
+        return data["speakers"], data["default"]
+    except Exception as e:
+        logger.warning(f"Failed to fetch speakers, using default: {e}")
+        return [DEFAULT_SPEAKER], DEFAULT_SPEAKER
 
 # Load existing chat history or create empty one
 def load_chat_history():
@@ -37,13 +118,25 @@ def save_chat_history(history):
         logger.error(f"Failed to save chat history: {e}")
 
 # Voice chat function with improved error handling and debugging
-def voice_chat(audio, history, progress=gr.Progress()):
+def voice_chat(audio, history, speaker=None, progress=gr.Progress()):
     if audio is None:
         return None, history, "⚠️ Mohon rekam suara terlebih dahulu"
-    
+
+    trace = Trace()
+    root = trace.start("voice_chat")
+    result = (None, history, None)
+    try:
+        result = _voice_chat(audio, history, speaker, progress, trace, root)
+        return result
+    finally:
+        ok = result[0] is not None
+        trace.end(root, error=None if ok else result[2] or "failed", **{"voice_chat.ok": ok})
+        trace.export()
+
+def _voice_chat(audio, history, speaker, progress, trace, root):
     # Update timestamp
     timestamp = datetime.now().strftime("%H:%M:%S")
-    logger.info(f"Processing voice request at {timestamp}")
+    logger.info(f"Processing voice request at {timestamp} (trace {trace.trace_id})")
     
     # Add progress updates
     progress(0, desc="Memproses suara Anda...")
@@ -54,43 +147,53 @@ def voice_chat(audio, history, progress=gr.Progress()):
         # Log audio details for debugging
         logger.info(f"Audio sample rate: {sr}, shape: {audio_data.shape}")
         
-        # Save as .wav with unique filename
+        # Encode as .wav in memory so no input file is left behind in the temp directory
+        encode_span = trace.start("encode_wav", root)
         audio_filename = f"input_{int(time.time())}.wav"
-        audio_path = os.path.join(tempfile.gettempdir(), audio_filename)
-        
-        scipy.io.wavfile.write(audio_path, sr, audio_data)
-        logger.info(f"Saved input audio to: {audio_path}")
-        
-        if not os.path.exists(audio_path):
-            logger.error(f"Failed to save audio file at {audio_path}")
-            return None, history, "⚠️ Gagal menyimpan file audio"
+        audio_buffer = io.BytesIO()
+        scipy.io.wavfile.write(audio_buffer, sr, audio_data)
+        audio_buffer.seek(0)
+        trace.end(encode_span, **{"audio.bytes": audio_buffer.getbuffer().nbytes, "audio.sample_rate": int(sr)})
+        logger.info(f"Encoded input audio: {audio_buffer.getbuffer().nbytes} bytes")
             
         progress(0.3, desc="Mengirim ke server...")
         
         # Send to FastAPI endpoint with increased timeout
+        request_span = trace.start("POST /voice-chat", root, kind=Trace.CLIENT)
         try:
             logger.info(f"Sending request to {API_URL}")
-            with open(audio_path, "rb") as f:
-                files = {"file": (audio_filename, f, "audio/wav")}
-                response = requests.post(
-                    API_URL,
-                    files=files,
-                    timeout=REQUEST_TIMEOUT
-                )
+            files = {"file": (audio_filename, audio_buffer, "audio/wav")}
+            response = requests.post(
+                API_URL,
+                files=files,
+                data={"speaker": speaker} if speaker else None,
+                headers={
+                    # Let the server abandon work it can no longer deliver in time
+                    "X-Request-Timeout": str(REQUEST_TIMEOUT),
+                    # Server spans join this trace
+                    "traceparent": trace.traceparent(request_span),
+                },
+                timeout=REQUEST_TIMEOUT
+            )
+            trace.end(request_span, **{"http.response.status_code": response.status_code,
+                                       "http.response.body.size": len(response.content)})
             
             logger.info(f"Response status: {response.status_code}, Content length: {len(response.content) if response.content else 0}")
             
-        except requests.exceptions.Timeout:
+        except requests.exceptions.Timeout as e:
+            trace.end(request_span, error=e)
             logger.error("Request timed out")
             error_msg = "🕒 Waktu permintaan habis. Server membutuhkan waktu terlalu lama untuk merespons."
             return None, history + [[error_msg, None, timestamp]], error_msg
             
-        except requests.exceptions.ConnectionError:
+        except requests.exceptions.ConnectionError as e:
+            trace.end(request_span, error=e)
             logger.error("Connection error")
             error_msg = "🔌 Tidak dapat terhubung ke server. Pastikan server berjalan di http://localhost:8000"
             return None, history + [[error_msg, None, timestamp]], error_msg
             
         except Exception as e:
+            trace.end(request_span, error=e)
             logger.error(f"Request error: {str(e)}")
             error_msg = f"🔴 Error: {str(e)}"
             return None, history + [[error_msg, None, timestamp]], error_msg
@@ -109,23 +212,22 @@ def voice_chat(audio, history, progress=gr.Progress()):
                 error_msg = "⚠️ Server mengembalikan respons kosong"
                 return None, history + [[error_msg, None, timestamp]], error_msg
             
-            # Save response audio with unique timestamp to avoid caching issues
-            output_audio_path = os.path.join(tempfile.gettempdir(), f"tts_output_{int(time.time())}.wav")
-            
+            # Decode the response audio in memory; Gradio stores it in its own cache,
+            # which is swept by delete_cache (see gr.Blocks below)
             try:
-                with open(output_audio_path, "wb") as f:
-                    f.write(response.content)
-                logger.info(f"Saved response audio to: {output_audio_path}")
+                decode_span = trace.start("decode_wav", root)
+                output_rate, output_data = scipy.io.wavfile.read(io.BytesIO(response.content))
+                trace.end(decode_span)
+                logger.info(f"Received response audio: {output_rate} Hz, {len(output_data)} samples")
                 
-                # Verify if file exists and has content
-                if not os.path.exists(output_audio_path) or os.path.getsize(output_audio_path) == 0:
-                    logger.error(f"Output file doesn't exist or is empty: {output_audio_path}")
+                if len(output_data) == 0:
+                    logger.error("Response audio has no samples")
                     error_msg = "⚠️ File audio respons kosong atau tidak valid"
                     return None, history + [[error_msg, None, timestamp]], error_msg
                 
             except Exception as e:
-                logger.error(f"Failed to save response audio: {e}")
-                error_msg = f"⚠️ Gagal menyimpan file audio respons: {str(e)}"
+                logger.error(f"Failed to read response audio: {e}")
+                error_msg = f"⚠️ Gagal membaca file audio respons: {str(e)}"
                 return None, history + [[error_msg, None, timestamp]], error_msg
             
             # Add successful interaction to history
@@ -135,7 +237,7 @@ def voice_chat(audio, history, progress=gr.Progress()):
             save_chat_history(new_history)
             
             progress(1.0, desc="Selesai!")
-            return output_audio_path, new_history, "✅ Berhasil mendapatkan respons"
+            return (output_rate, output_data), new_history, "✅ Berhasil mendapatkan respons"
         else:
             logger.error(f"Server returned error status: {response.status_code}")
             try:
@@ -516,7 +618,7 @@ def recording_state(recording=False):
         return gr.update(visible=False), gr.update(visible=True)
 
 # UI with Gradio Blocks
-with gr.Blocks(theme=theme, css=custom_css) as demo:
+with gr.Blocks(theme=theme, css=custom_css, delete_cache=(GRADIO_CACHE_SWEEP_S, GRADIO_CACHE_MAX_AGE_S)) as demo:
     # Initialize state
     history_state = gr.State(load_chat_history())
     
@@ -591,6 +693,15 @@ with gr.Blocks(theme=theme, css=custom_css) as demo:
                 streaming=False
             )
             
+            # Voice selection (kept per browser session)
+            speaker_choices, default_speaker = fetch_speakers()
+            speaker_input = gr.Dropdown(
+                choices=speaker_choices,
+                value=default_speaker,
+                label="Suara Asisten",
+                elem_id="speaker-select"
+            )
+            
             # Status message display
             status_msg = gr.HTML(
                 """<div class="status-message">Siap menerima pertanyaan</div>""",
@@ -661,7 +772,7 @@ with gr.Blocks(theme=theme, css=custom_css) as demo:
     # Submit button click
     submit_btn.click(
         fn=voice_chat,
-        inputs=[audio_input, history_state],
+        inputs=[audio_input, history_state, speaker_input],
         outputs=[audio_output, history_state, status_msg]
     ).then(
         fn=format_chat_history,
@@ -0,0 +1,153 @@
+"""
+Benchmark G2P lokal vs IPA yang dihasilkan LLM.
+
+Mengukur:
+  1. Latensi konversi app.g2p.text_to_ipa per balasan (cache dingin dan hangat)
+  2. Jumlah token output: teks biasa vs transkripsi IPA-nya (butuh GEMINI_API_KEY)
+  3. (--live) Latensi end-to-end Gemini dengan instruksi teks biasa + G2P lokal
+     dibandingkan prompt sistem lama (baseline) yang meminta IPA langsung
+
+Contoh:
+    python scripts/bench_g2p.py
+    python scripts/bench_g2p.py --live 5
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from app import g2p  # noqa: E402
+
+MODEL = "gemini-2.0-flash"
+
+SAMPLE_REPLIES = [
+    "Hari ini cuaca cerah di sebagian besar wilayah, dengan suhu sekitar 30 derajat.",
+    "Presiden Indonesia saat ini adalah Joko Widodo.",
+    "Jakarta adalah ibu kota Indonesia yang terletak di pulau Jawa. Kota ini merupakan pusat "
+    "pemerintahan dengan populasi sekitar 10 juta jiwa.",
+    "Harga beras naik 2,5% menjadi Rp15.000 per kilogram pada tahun 2024.",
+    "Maaf, saya tidak tahu jawaban untuk pertanyaan tersebut.",
+]
+
+SAMPLE_PROMPTS = [
+    "Bagaimana cuaca hari ini?",
+    "Siapa presiden Indonesia?",
+    "Ceritakan tentang Jakarta.",
+    "Apa makanan khas Aceh?",
+    "Berapa jarak Jakarta ke Bandung?",
+]
+
+# Instruksi lama (sebelum G2P lokal), disalin apa adanya: LLM diminta langsung menulis IPA
+BASELINE_IPA_INSTRUCTION = """
+You are a responsive, intelligent, and fluent virtual assistant designed for Indonesian language interaction.
+Your task is to provide clear, concise, and informative answers in response to user queries or statements spoken through voice.
+
+IMPORTANT: Your response must ONLY be the IPA phonetic transcription of what you would say in Indonesian. Do not include any regular text.
+
+Your answers must:
+- Be based on polite and easily understandable Indonesian.
+- Be short and to the point (maximum 2–3 sentences).
+- Avoid repeating the user's question; respond directly with the answer.
+- ONLY output the IPA phonetic transcription, nothing else.
+
+Examples:
+User: What's the weather like today?
+Assistant: hari ini t͡ʃuat͡ʃaɲa t͡ʃərah di səbaɡian bəsar wilaʝah, dəŋan suhu səkitar tiɡa puluh dərat͡ʃat.
+
+User: Do you know who is the president of Indonesia?
+Assistant: prɛsidɛn indonɛsia saʔat ini adalah d͡ʒɔkɔ widɔdɔ.
+
+User: Tell me about Jakarta
+Assistant: d͡ʒakarta adalah ibu kɔta indɔnɛsia ʝaŋ tərlɛtak di pulau d͡ʒawa. kɔta ini mərupakan pusat pəmərintahan dəŋan pɔpulasi səkitar səpuluh d͡ʒuta d͡ʒiwa.
+
+If you're unsure about an answer, respond with the IPA transcription of "Maaf, saya tidak tahu jawaban untuk pertanyaan tersebut."
+"""
+
+
+def bench_local(rounds: int):
+    g2p.word_to_ipa.cache_clear()
+    cold = []
+    for reply in SAMPLE_REPLIES:
+        started = time.perf_counter()
+        g2p.text_to_ipa(reply)
+        cold.append((time.perf_counter() - started) * 1000)
+
+    warm = []
+    for _ in range(rounds):
+        for reply in SAMPLE_REPLIES:
+            started = time.perf_counter()
+            g2p.text_to_ipa(reply)
+            warm.append((time.perf_counter() - started) * 1000)
+
+    print("== G2P lokal ==")
+    print(f"cache dingin : rata-rata {statistics.mean(cold):.3f} ms/balasan")
+    print(f"cache hangat : rata-rata {statistics.mean(warm):.3f} ms/balasan, "
+          f"p95 {sorted(warm)[int(len(warm) * 0.95)]:.3f} ms")
+    print(f"cache        : {g2p.word_to_ipa.cache_info()}")
+
+
+def bench_tokens(client):
+    print("\n== Token output per balasan ==")
+    plain_total = ipa_total = 0
+    for reply in SAMPLE_REPLIES:
+        ipa = g2p.text_to_ipa(reply)
+        plain_tokens = client.models.count_tokens(model=MODEL, contents=reply).total_tokens
+        ipa_tokens = client.models.count_tokens(model=MODEL, contents=ipa).total_tokens
+        plain_total += plain_tokens
+        ipa_total += ipa_tokens
+        print(f"{plain_tokens:4d} teks vs {ipa_tokens:4d} IPA  | {reply[:50]}")
+    print(f"total: {plain_total} vs {ipa_total} token ({ipa_total / max(1, plain_total):.2f}x)")
+
+
+def bench_live(client, system_instruction: str, n: int):
+    from google.genai import types
+
+    modes = {
+        "teks + G2P lokal": types.GenerateContentConfig(system_instruction=system_instruction),
+        "IPA dari LLM": types.GenerateContentConfig(system_instruction=BASELINE_IPA_INSTRUCTION),
+    }
+    print("\n== End-to-end (LLM + konversi ke IPA) ==")
+    for name, config in modes.items():
+        latencies = []
+        output_tokens = []
+        for prompt in (SAMPLE_PROMPTS * n)[:n]:
+            started = time.perf_counter()
+            response = client.models.generate_content(model=MODEL, contents=prompt, config=config)
+            if name.startswith("teks"):
+                g2p.text_to_ipa(response.text)
+            latencies.append(time.perf_counter() - started)
+            output_tokens.append(response.usage_metadata.candidates_token_count or 0)
+        print(f"{name:18s}: latensi rata-rata {statistics.mean(latencies):.3f} s, "
+              f"token output rata-rata {statistics.mean(output_tokens):.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=200, help="Jumlah putaran untuk pengukuran cache hangat")
+    parser.add_argument("--live", type=int, default=0, help="Jumlah prompt untuk benchmark end-to-end ke Gemini")
+    args = parser.parse_args()
+
+    bench_local(args.rounds)
+
+    if not os.getenv("GEMINI_API_KEY"):
+        from dotenv import load_dotenv
+        load_dotenv(os.path.join(ROOT_DIR, ".env"))
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        print("\nGEMINI_API_KEY tidak ditemukan; benchmark token dan end-to-end dilewati.")
+        return
+
+    from google import genai
+    client = genai.Client(api_key=api_key)
+    bench_tokens(client)
+    if args.live:
+        from app.llm import system_instruction
+        bench_live(client, system_instruction, args.live)
+
+
+if __name__ == "__main__":
+    main()
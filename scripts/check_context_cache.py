@@ -0,0 +1,143 @@
+"""
+Pemeriksaan end-to-end context caching Gemini terhadap server tiruan (tanpa API key).
+
+Server tiruan dijalankan sebagai subprocess, lalu app.llm dipakai seperti oleh backend:
+  1. giliran pertama membuat CachedContent di server
+  2. giliran berikutnya memakai cache dan cachedContentTokenCount tercatat di statistik
+  3. cache dihapus di server -> panggilan dengan cache gagal dan diulang tanpa cache
+Hal yang sama diperiksa untuk jalur sync (generate_response) dan async (generate_response_async).
+Riwayat chat ditulis ke file temporer, bukan app/chat_history.json.
+
+Contoh:
+    python scripts/check_context_cache.py
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+
+class CheckFailed(Exception):
+    pass
+
+
+def check(condition: bool, message: str):
+    if not condition:
+        raise CheckFailed(message)
+    print(f"  OK  {message}")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _request(base_url: str, path: str, method: str = "GET") -> dict:
+    with urllib.request.urlopen(urllib.request.Request(base_url + path, method=method), timeout=10) as response:
+        return json.loads(response.read() or b"{}")
+
+
+def start_fake_server(port: int) -> subprocess.Popen:
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT_DIR, "scripts", "fake_gemini_server.py"),
+         "--port", str(port), "--min-cache-tokens", "0"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        if server.poll() is not None:
+            raise CheckFailed("server tiruan berhenti saat mulai")
+        try:
+            _request(base_url, "/_stats")
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise CheckFailed("server tiruan tidak merespons")
+
+
+def run_checks(llm, base_url: str, turn, label: str):
+    cache = llm.context_cache
+    before = cache.stats()
+
+    print(f"[{label}] giliran pertama")
+    reply = turn("Halo, apa kabar?")
+    check(not reply.startswith("[ERROR]"), f"balasan diterima: {reply[:60]!r}")
+    stats = cache.stats()
+    check(stats["cache_name"] is not None, f"cache aktif: {stats['cache_name']}")
+    check(stats["created"] > before["created"] or before["cache_name"] == stats["cache_name"],
+          "CachedContent dibuat (atau cache yang sama dipakai ulang)")
+    check(_request(base_url, "/_stats")["live_caches"] >= 1, "server tiruan menyimpan cache")
+
+    print(f"[{label}] giliran kedua memakai cache")
+    reply = turn("Ceritakan tentang Jakarta.")
+    check(not reply.startswith("[ERROR]"), f"balasan diterima: {reply[:60]!r}")
+    stats = cache.stats()
+    check(stats["cached"]["requests"] > before["cached"]["requests"], "panggilan tercatat sebagai cached")
+    check(stats["cached"]["cached_tokens"] > before["cached"]["cached_tokens"], "cached_tokens tercatat")
+
+    print(f"[{label}] cache dihapus di server -> fallback tanpa cache")
+    _request(base_url, "/v1beta/" + stats["cache_name"], method="DELETE")
+    reply = turn("Apa makanan khas Aceh?")
+    check(not reply.startswith("[ERROR]"), f"balasan diterima: {reply[:60]!r}")
+    after = cache.stats()
+    check(after["fallbacks"] == stats["fallbacks"] + 1, "fallback tercatat")
+    check(after["uncached"]["requests"] > stats["uncached"]["requests"], "panggilan diulang tanpa cache")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=0, help="Port server tiruan (default: port bebas)")
+    args = parser.parse_args()
+
+    port = args.port or _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    # Harus di-set sebelum app.llm diimpor; modul membaca konfigurasi saat impor
+    os.environ.update({
+        "GEMINI_API_KEY": "fake",
+        "GEMINI_BASE_URL": base_url,
+        "GEMINI_CONTEXT_CACHE": "1",
+        "GEMINI_CACHE_MIN_TOKENS": "0",
+    })
+
+    server = start_fake_server(port)
+    history_dir = tempfile.mkdtemp(prefix="check_context_cache_")
+    try:
+        from app import llm
+
+        # Jangan sentuh riwayat chat asli
+        llm.CHAT_HISTORY_FILE = os.path.join(history_dir, "chat_history.json")
+        llm.chat = llm.client.chats.create(model=llm.MODEL, config=llm.chat_config)
+
+        run_checks(llm, base_url, llm.generate_response, "sync")
+        # Satu event loop untuk semua giliran async: klien aio Gemini terikat ke loop tempat ia dipakai
+        loop = asyncio.new_event_loop()
+        try:
+            run_checks(llm, base_url, lambda prompt: loop.run_until_complete(llm.generate_response_async(prompt)),
+                       "async")
+        finally:
+            loop.close()
+    except CheckFailed as e:
+        print(f"  GAGAL  {e}")
+        return 1
+    finally:
+        server.terminate()
+        server.wait()
+        for name in os.listdir(history_dir):
+            os.remove(os.path.join(history_dir, name))
+        os.rmdir(history_dir)
+    print("Semua pemeriksaan context cache lulus")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
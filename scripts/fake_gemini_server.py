@@ -0,0 +1,222 @@
+"""
+Server tiruan API Gemini (generateContent, countTokens, cachedContents) untuk menguji
+context caching tanpa API key dan tanpa biaya.
+
+Server mensimulasikan:
+  - latensi yang sebanding dengan jumlah token prompt yang TIDAK berasal dari cache
+  - usageMetadata.cachedContentTokenCount untuk permintaan dengan cachedContent
+  - batas minimum token cache (--min-cache-tokens) dan TTL (cache kedaluwarsa -> 404)
+
+Contoh:
+    python scripts/fake_gemini_server.py --port 8765 --min-cache-tokens 0
+    GEMINI_API_KEY=fake GEMINI_BASE_URL=http://127.0.0.1:8765 GEMINI_CACHE_MIN_TOKENS=0 \\
+        uvicorn app.main:app
+"""
+import re
+import json
+import time
+import uuid
+import asyncio
+import argparse
+from datetime import datetime, timezone
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+app = FastAPI(title="Fake Gemini API")
+
+settings = {
+    "min_cache_tokens": 0,
+    "base_latency_s": 0.05,
+    "per_token_latency_s": 0.0002,
+}
+
+# nama cache -> {"model", "tokens", "expires_at", ...}
+caches = {}
+
+stats = {"generate": 0, "cached_generate": 0, "caches_created": 0, "caches_refreshed": 0, "caches_deleted": 0}
+
+
+def _error(code: int, status: str, message: str) -> JSONResponse:
+    return JSONResponse(status_code=code, content={"error": {"code": code, "message": message, "status": status}})
+
+
+def _tokens(obj) -> int:
+    # Perkiraan yang sama dengan app.context_cache: ~4 karakter per token
+    texts = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            if isinstance(node.get("text"), str):
+                texts.append(node["text"])
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(obj)
+    return max(1, sum(len(t) for t in texts) // 4)
+
+
+def _parse_ttl(ttl: str) -> float:
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)s", ttl or "3600s")
+    return float(match.group(1)) if match else 3600.0
+
+
+def _timestamp(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def _cache_resource(name: str) -> dict:
+    cache = caches[name]
+    return {
+        "name": name,
+        "model": cache["model"],
+        "displayName": cache.get("display_name", ""),
+        "createTime": _timestamp(cache["created"]),
+        "updateTime": _timestamp(cache["updated"]),
+        "expireTime": _timestamp(cache["expires_at"]),
+        "usageMetadata": {"totalTokenCount": cache["tokens"]},
+    }
+
+
+def _live_cache(name: str):
+    cache = caches.get(name)
+    if cache is None or cache["expires_at"] < time.time():
+        caches.pop(name, None)
+        return None
+    return cache
+
+
+def _last_user_text(contents: list) -> str:
+    for content in reversed(contents or []):
+        if content.get("role", "user") == "user":
+            return " ".join(part.get("text", "") for part in content.get("parts", []))
+    return ""
+
+
+@app.post("/{api_version}/models/{model_action}")
+async def model_action(api_version: str, model_action: str, request: Request):
+    model, _, action = model_action.partition(":")
+    body = await request.json()
+
+    if action == "countTokens":
+        return {"totalTokens": _tokens(body.get("contents"))}
+    if action != "generateContent":
+        return _error(404, "NOT_FOUND", f"Unknown action: {action}")
+
+    cached_tokens = 0
+    cached_name = body.get("cachedContent")
+    if cached_name:
+        if body.get("systemInstruction"):
+            return _error(400, "INVALID_ARGUMENT",
+                          "CachedContent can not be used with GenerateContent request setting system_instruction")
+        cache = _live_cache(cached_name)
+        if cache is None:
+            return _error(404, "NOT_FOUND", f"CachedContent not found (or expired): {cached_name}")
+        cached_tokens = cache["tokens"]
+        stats["cached_generate"] += 1
+
+    uncached_tokens = _tokens(body.get("contents")) + _tokens(body.get("systemInstruction"))
+    stats["generate"] += 1
+    await asyncio.sleep(settings["base_latency_s"] + settings["per_token_latency_s"] * uncached_tokens)
+
+    reply = f"Ini jawaban uji untuk: {_last_user_text(body.get('contents'))}".strip()
+    reply_tokens = _tokens([{"text": reply}])
+    usage = {
+        "promptTokenCount": uncached_tokens + cached_tokens,
+        "candidatesTokenCount": reply_tokens,
+        "totalTokenCount": uncached_tokens + cached_tokens + reply_tokens,
+    }
+    if cached_tokens:
+        usage["cachedContentTokenCount"] = cached_tokens
+    return {
+        "candidates": [{
+            "content": {"role": "model", "parts": [{"text": reply}]},
+            "finishReason": "STOP",
+            "index": 0,
+        }],
+        "usageMetadata": usage,
+        "modelVersion": model,
+    }
+
+
+@app.post("/{api_version}/cachedContents")
+async def create_cache(api_version: str, request: Request):
+    body = await request.json()
+    tokens = _tokens(body.get("contents")) + _tokens(body.get("systemInstruction"))
+    if tokens < settings["min_cache_tokens"]:
+        return _error(400, "INVALID_ARGUMENT",
+                      f"Cached content is too small. total_token_count={tokens}, "
+                      f"min_total_token_count={settings['min_cache_tokens']}")
+    now = time.time()
+    name = f"cachedContents/{uuid.uuid4().hex[:12]}"
+    caches[name] = {
+        "model": body.get("model"),
+        "display_name": body.get("displayName"),
+        "tokens": tokens,
+        "created": now,
+        "updated": now,
+        "expires_at": now + _parse_ttl(body.get("ttl")),
+    }
+    stats["caches_created"] += 1
+    return _cache_resource(name)
+
+
+@app.get("/{api_version}/cachedContents/{cache_id}")
+async def get_cache(api_version: str, cache_id: str):
+    name = f"cachedContents/{cache_id}"
+    if _live_cache(name) is None:
+        return _error(404, "NOT_FOUND", f"CachedContent not found: {name}")
+    return _cache_resource(name)
+
+
+@app.patch("/{api_version}/cachedContents/{cache_id}")
+async def update_cache(api_version: str, cache_id: str, request: Request):
+    name = f"cachedContents/{cache_id}"
+    cache = _live_cache(name)
+    if cache is None:
+        return _error(404, "NOT_FOUND", f"CachedContent not found: {name}")
+    body = await request.json()
+    now = time.time()
+    cache["updated"] = now
+    cache["expires_at"] = now + _parse_ttl(body.get("ttl"))
+    stats["caches_refreshed"] += 1
+    return _cache_resource(name)
+
+
+@app.delete("/{api_version}/cachedContents/{cache_id}")
+async def delete_cache(api_version: str, cache_id: str):
+    if caches.pop(f"cachedContents/{cache_id}", None) is not None:
+        stats["caches_deleted"] += 1
+    return {}
+
+
+@app.get("/_stats")
+async def server_stats():
+    """Statistik server tiruan (bukan bagian dari API Gemini)."""
+    return {**stats, "live_caches": len([n for n in list(caches) if _live_cache(n)])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--min-cache-tokens", type=int, default=4096,
+                        help="Tolak cache yang lebih kecil dari ini (seperti API asli)")
+    parser.add_argument("--base-latency-ms", type=float, default=50)
+    parser.add_argument("--per-token-latency-ms", type=float, default=0.2,
+                        help="Latensi tambahan per token prompt yang tidak berasal dari cache")
+    args = parser.parse_args()
+
+    settings["min_cache_tokens"] = args.min_cache_tokens
+    settings["base_latency_s"] = args.base_latency_ms / 1000
+    settings["per_token_latency_s"] = args.per_token_latency_ms / 1000
+    print(json.dumps({"listening": f"http://{args.host}:{args.port}", **settings}))
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Pengganti ringan OTel Collector untuk tracing voice chatbot, sekaligus pembaca trace-nya.
+
+  serve  Menerima OTLP/HTTP JSON di POST /v1/traces dan menulisnya sebagai JSON lines
+         (format yang sama dengan TRACE_FILE), sehingga frontend dan API bisa mengirim ke
+         satu tempat lewat OTLP_ENDPOINT.
+  show   Gabungkan satu atau beberapa file JSON lines, lalu tampilkan pohon span per trace
+         beserta rincian waktu antre vs waktu proses.
+
+Contoh:
+    python scripts/trace_report.py serve --port 4318 --out traces.jsonl
+    OTLP_ENDPOINT=http://127.0.0.1:4318/v1/traces uvicorn app.main:app
+    OTLP_ENDPOINT=http://127.0.0.1:4318/v1/traces python gradio_app/app.py
+    python scripts/trace_report.py show traces.jsonl --last 3
+"""
+import sys
+import json
+import argparse
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _is_queue(name: str) -> bool:
+    # Span antrean: antrean admisi, antrean pool worker, dan antrean batcher TTS
+    return name.endswith(".queue")
+
+
+def load_spans(paths: list) -> dict:
+    """traceId -> daftar span (dict OTLP dengan tambahan "service")."""
+    traces = defaultdict(list)
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                for resource_spans in json.loads(line).get("resourceSpans", []):
+                    service = "?"
+                    for attribute in resource_spans.get("resource", {}).get("attributes", []):
+                        if attribute["key"] == "service.name":
+                            service = attribute["value"].get("stringValue", "?")
+                    for scope_spans in resource_spans.get("scopeSpans", []):
+                        for span in scope_spans.get("spans", []):
+                            span["service"] = service
+                            traces[span["traceId"]].append(span)
+    return traces
+
+
+def _attributes(span: dict) -> dict:
+    values = {}
+    for attribute in span.get("attributes", []):
+        value = attribute["value"]
+        values[attribute["key"]] = next(iter(value.values())) if value else None
+    return values
+
+
+def _duration_ms(span: dict) -> float:
+    return (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e6
+
+
+def print_trace(trace_id: str, spans: list, show_attributes: bool = False):
+    spans.sort(key=lambda s: int(s["startTimeUnixNano"]))
+    ids = {s["spanId"] for s in spans}
+    children = defaultdict(list)
+    roots = []
+    for span in spans:
+        parent = span.get("parentSpanId")
+        if parent and parent in ids:
+            children[parent].append(span)
+        else:
+            roots.append(span)
+
+    origin = int(spans[0]["startTimeUnixNano"])
+    end = max(int(s["endTimeUnixNano"]) for s in spans)
+    print(f"trace {trace_id}  total {(end - origin) / 1e6:.1f} ms  ({len(spans)} span)")
+
+    def walk(span: dict, depth: int):
+        offset = (int(span["startTimeUnixNano"]) - origin) / 1e6
+        marker = " !" if span.get("status", {}).get("code") == 2 else ""
+        label = f"{'  ' * depth}{span['name']} [{span['service']}]{marker}"
+        print(f"  {offset:9.1f} ms  {_duration_ms(span):9.1f} ms  {label}")
+        if show_attributes:
+            for key, value in _attributes(span).items():
+                print(f"  {'':24}{'  ' * depth}  {key}={value}")
+        for child in children[span["spanId"]]:
+            walk(child, depth + 1)
+
+    for root in roots:
+        walk(root, 0)
+
+    # Rincian antre vs proses per nama span (span antrean dan span kerja di bawah root)
+    queued = defaultdict(float)
+    for span in spans:
+        if _is_queue(span["name"]):
+            queued[span["name"]] += _duration_ms(span)
+    if queued:
+        total = sum(queued.values())
+        print(f"  waktu antre: {total:.1f} ms (" +
+              ", ".join(f"{name} {ms:.1f}" for name, ms in sorted(queued.items(), key=lambda x: -x[1])) + ")")
+    print()
+
+
+def show(args):
+    traces = load_spans(args.files)
+    if args.trace:
+        selected = [t for t in traces if t.startswith(args.trace)]
+    else:
+        # Trace terbaru di akhir, seperti urutan log
+        selected = sorted(traces, key=lambda t: min(int(s["startTimeUnixNano"]) for s in traces[t]))
+        selected = selected[-args.last:]
+    if not selected:
+        print("Tidak ada trace yang cocok", file=sys.stderr)
+        return 1
+    for trace_id in selected:
+        print_trace(trace_id, traces[trace_id], args.attributes)
+    return 0
+
+
+def serve(args):
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path.rstrip("/") != "/v1/traces":
+                self.send_error(404)
+                return
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                self.send_error(400, "Body harus berupa OTLP JSON")
+                return
+            with lock, open(args.out, "a", encoding="utf-8") as f:
+                f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, format, *log_args):
+            pass
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(json.dumps({"listening": f"http://{args.host}:{args.port}/v1/traces", "out": args.out}))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="Terima OTLP/HTTP JSON dan tulis ke file")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=4318)
+    serve_parser.add_argument("--out", default="traces.jsonl")
+    serve_parser.set_defaults(func=serve)
+
+    show_parser = commands.add_parser("show", help="Tampilkan pohon span per trace")
+    show_parser.add_argument("files", nargs="+", help="File JSON lines dari TRACE_FILE atau serve")
+    show_parser.add_argument("--trace", help="Trace ID (atau awalannya) yang ditampilkan")
+    show_parser.add_argument("--last", type=int, default=5, help="Jumlah trace terbaru yang ditampilkan")
+    show_parser.add_argument("--attributes", action="store_true", help="Tampilkan atribut span")
+    show_parser.set_defaults(func=show)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()